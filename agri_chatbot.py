@@ -4,6 +4,8 @@
 import os  # <--- 1. 必须把它提到最最最前面
 os.environ["HF_ENDPOINT"] = "https://hf-mirror.com" # <--- 2. 马上设置镜像
 import sys
+import argparse
+import json
 from knowledge_base import KnowledgeBase
 from rag_engine import RAGEngine
 from chat_manager import ChatManager
@@ -404,6 +406,57 @@ class AgriChatBot:
         else:
             print("⚠️ 无效选择")
     
+    def batch_mode(self, path, search_only=False, output=None, n_results=5):
+        """
+        批量模式：从文件读取问题（每行一个），先一次性批量检索，再逐个回答
+        
+        参数:
+            path: 问题文件路径
+            search_only: 只检索不调用大模型（评估检索效果时使用）
+            output: 结果输出文件（JSON Lines），不传则只打印
+            n_results: 每个问题检索的文档数
+        """
+        with open(path, 'r', encoding='utf-8') as f:
+            questions = [line.strip() for line in f if line.strip()]
+        
+        if not questions:
+            print("⚠️ 问题文件为空")
+            return
+        
+        print(f"\n📋 共 {len(questions)} 个问题，批量检索中...")
+        
+        # 一次向量化 + 按作物过滤条件分组检索；RAG 问答时 kb.search 会直接命中这批结果的缓存
+        wheres = [self.kb.detect_filter(question) for question in questions]
+        all_results = self.kb.search_many(questions, n_results=n_results, where=wheres)
+        
+        out = open(output, 'w', encoding='utf-8') if output else None
+        try:
+            for i, (question, results) in enumerate(zip(questions, all_results), 1):
+                record = {
+                    "question": question,
+                    "results": [
+                        {"id": r['id'], "similarity": round(r['similarity'], 4), "content": r['content']}
+                        for r in results
+                    ]
+                }
+                
+                print(f"\n{i}. 🧑 {question}")
+                if search_only:
+                    for r in results:
+                        print(f"   - 相似度 {r['similarity']:.3f}：{r['content'][:60]}...")
+                else:
+                    record["answer"] = self.rag.query(question)
+                    print(f"   🤖 {record['answer']}")
+                
+                if out:
+                    out.write(json.dumps(record, ensure_ascii=False) + "\n")
+        finally:
+            if out:
+                out.close()
+        
+        if output:
+            print(f"\n✅ 结果已保存到 {output}")
+    
     def run(self):
         """运行主程序"""
         print("\n" + "="*60)
@@ -430,9 +483,20 @@ class AgriChatBot:
 
 # ===== 主程序入口 =====
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="农宝 AgriChatBot 命令行")
+    parser.add_argument("--batch", metavar="FILE", help="批量模式：问题文件（每行一个问题）")
+    parser.add_argument("--search-only", action="store_true", help="批量模式下只检索，不调用大模型")
+    parser.add_argument("--output", metavar="FILE", help="批量模式结果输出（JSON Lines）")
+    parser.add_argument("--n-results", type=int, default=5, help="每个问题检索的文档数")
+    args = parser.parse_args()
+    
     try:
         bot = AgriChatBot()
-        bot.run()
+        if args.batch:
+            bot.batch_mode(args.batch, search_only=args.search_only,
+                           output=args.output, n_results=args.n_results)
+        else:
+            bot.run()
     except KeyboardInterrupt:
         print("\n\n👋 程序被中断，再见！")
     except Exception as e:
@@ -6,6 +6,9 @@
 # app_v2.py - 农业智能管理系统主程序
 import os
 import sys
+import json
+import uuid
+import itertools
 
 # 设置环境变量（在导入任何其他模块之前）
 os.environ["HF_ENDPOINT"] = "https://hf-mirror.com"
@@ -24,15 +27,24 @@ if not os.getenv('DASHSCOPE_API_KEY'):
     os.environ['DASHSCOPE_API_KEY'] = 'sk-eacfe18e38104e7e873f2da5e8cb0aa0'
     print("⚠️ 使用硬编码API Key")
 
-from flask import Flask, render_template, request, jsonify, session, redirect
+from flask import Flask, render_template, request, jsonify, session, redirect, Response
 from flask_sqlalchemy import SQLAlchemy
 from datetime import datetime, timedelta
 
 # 导入数据模型
-from models import db, Crop, DailyRecord, AnalysisHistory
+from models import db, Crop, DailyRecord, CropEvent, AnalysisHistory, upgrade_schema, crop_summaries, stats_rollup
 
-from knowledge_base import KnowledgeBase
+from knowledge_base import KnowledgeBase, SEARCH_MODES
 from rag_engine import RAGEngine
+from llm_scheduler import SchedulerBusy
+from pagination import InvalidPageArgs, page_args, result_count, parse_date, keyset_page, offset_page
+from ingest_jobs import IngestJobQueue
+from crop_analysis import (
+    BatchAnalyzer, BatchAnalysisRunning, prepare_analysis, parse_quick_analysis, make_history, recent_records,
+    data_fingerprint, find_reusable
+)
+from config import SEARCH_BATCH_MAX, CHAT_HISTORY_PATH, CHAT_HISTORY_TTL
+from cache_backend import SQLiteBackend
 
 
 app = Flask(__name__)
@@ -40,7 +52,7 @@ app.secret_key = os.urandom(24)
 
 
 # ===== 数据库配置 =====
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///agri_v2.db'
+app.config['SQLALCHEMY_DATABASE_URI'] = os.getenv('DATABASE_URL', 'sqlite:///agri_v2.db')    # 压测时指向临时数据库
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 
 # 初始化数据库
@@ -50,8 +62,41 @@ db.init_app(app)
 print("🚀 初始化AgriChatBot...")
 kb = KnowledgeBase()
 rag = RAGEngine(kb)
+ingest_queue = IngestJobQueue(kb)
+batch_analyzer = BatchAnalyzer(app, rag)
 chat_managers = {}
 
+# 对话历史存在服务端（按会话里的 user_id），流式接口在回答结束后也能写入
+history_store = SQLiteBackend(path=CHAT_HISTORY_PATH, ttl=CHAT_HISTORY_TTL)
+
+def get_user_id():
+    """获取当前会话的用户ID（没有时生成一个）"""
+    if 'user_id' not in session:
+        session['user_id'] = str(uuid.uuid4())
+    return session['user_id']
+
+def load_chat_history(user_id):
+    """读取对话历史"""
+    return history_store.get(f"history:{user_id}") or []
+
+def save_chat_history(user_id, chat_history, question, answer):
+    """追加一轮对话并保存（只保留最近10轮）"""
+    chat_history = chat_history + [
+        {"role": "user", "content": question},
+        {"role": "ai", "content": answer}
+    ]
+    history_store.set(f"history:{user_id}", chat_history[-20:])
+
+def busy_response(error):
+    """大模型调度器饱和时的响应：503 + Retry-After"""
+    response = jsonify({
+        "success": False,
+        "error": str(error),
+        "retry_after": error.retry_after
+    })
+    response.headers["Retry-After"] = str(error.retry_after)
+    return response, 503
+
 def get_chat_manager():
     """获取当前用户的ChatManager"""
     if 'user_id' not in session:
@@ -138,7 +183,8 @@ def api_ask():
         print(f"{'='*60}")
         
         # 2. 获取对话历史
-        chat_history = session.get('chat_history', [])
+        user_id = get_user_id()
+        chat_history = load_chat_history(user_id)
         
         try:
             # 3. 调用RAG引擎
@@ -152,9 +198,7 @@ def api_ask():
                 }), 500
             
             # 5. 保存到历史
-            chat_history.append({"role": "user", "content": question})
-            chat_history.append({"role": "ai", "content": answer})
-            session['chat_history'] = chat_history[-20:]  # 只保留最近10轮
+            save_chat_history(user_id, chat_history, question, answer)
             
             print(f"✅ AI回答：{answer[:100]}...")
             
@@ -163,6 +207,10 @@ def api_ask():
                 "answer": answer
             })
             
+        except SchedulerBusy as busy:
+            print(f"⏳ 大模型调度繁忙：{busy}")
+            return busy_response(busy)
+            
         except Exception as rag_error:
             error_msg = str(rag_error)
             print(f"❌ RAG引擎错误：{error_msg}")
@@ -197,12 +245,74 @@ def api_ask():
         }), 500
 
 
+@app.route('/api/ask/stream', methods=['POST'])
+def api_ask_stream():
+    """AI问答接口（流式，Server-Sent Events）
+
+    事件：delta（一段新生成的文本）、done（完整回答）、error（出错）
+    """
+    data = request.get_json(silent=True) or {}
+    question = (data.get('question') or '').strip()
+    
+    if not question:
+        return jsonify({"success": False, "error": "问题不能为空"}), 400
+    
+    if len(question) > 500:
+        return jsonify({"success": False, "error": "问题过长（最多500字）"}), 400
+    
+    # 生成器运行时已经没有请求上下文，先把需要的会话数据取出来
+    user_id = get_user_id()
+    chat_history = load_chat_history(user_id)
+    
+    print(f"\n{'='*60}")
+    print(f"🔍 用户问题（流式）：{question}")
+    print(f"{'='*60}")
+    
+    def sse(event, payload):
+        return f"event: {event}\ndata: {json.dumps(payload, ensure_ascii=False)}\n\n"
+    
+    # 先取第一段：排队发生在发送响应头之前，调度器饱和时还能返回 503
+    stream = rag.stream_query(question, chat_history=chat_history)
+    first, first_error = None, None
+    try:
+        first = next(stream, None)
+    except SchedulerBusy as busy:
+        print(f"⏳ 大模型调度繁忙：{busy}")
+        return busy_response(busy)
+    except Exception as e:
+        first_error = e
+    
+    def generate():
+        parts = []
+        try:
+            if first_error is not None:
+                raise first_error
+            for delta in itertools.chain([first] if first is not None else [], stream):
+                parts.append(delta)
+                yield sse("delta", {"text": delta})
+        except Exception as e:
+            print(f"❌ 流式回答失败：{e}")
+            yield sse("error", {"error": rag.describe_error(e)})
+            return
+        finally:
+            # 客户端断开时 WSGI 服务器会关闭本生成器，这里随之关闭大模型的流式连接
+            stream.close()
+        
+        answer = ''.join(parts).strip()
+        save_chat_history(user_id, chat_history, question, answer)
+        print(f"✅ AI回答：{answer[:100]}...")
+        yield sse("done", {"answer": answer})
+    
+    return Response(generate(), mimetype='text/event-stream', headers={
+        "Cache-Control": "no-cache",
+        "X-Accel-Buffering": "no"    # 关闭 nginx 缓冲，让每段文本立即送达
+    })
+
 @app.route('/api/clear_history', methods=['POST'])
 def api_clear_history():
     """清空对话历史"""
     try:
-        chat = get_chat_manager()
-        chat.clear_history()
+        history_store.delete(f"history:{get_user_id()}")
         return jsonify({"success": True, "message": "对话历史已清空"})
     except Exception as e:
         return jsonify({"success": False, "error": str(e)}), 500
@@ -211,15 +321,41 @@ def api_clear_history():
 
 @app.route('/api/v2/crops', methods=['GET'])
 def api_v2_get_crops():
-    """获取所有作物"""
+    """
+    获取作物列表（按创建时间游标分页，记录数、最新记录和7天平均值读汇总表）
+    
+    参数（查询字符串，均可选）:
+        crop_type / status: 筛选
+        planted_from / planted_to: 播种日期范围（YYYY-MM-DD，含两端）
+        limit / cursor / order: 分页，见 pagination.page_args
+    """
     try:
-        crops = Crop.query.order_by(Crop.created_at.desc()).all()
+        limit, cursor, order = page_args(request.args)
+        planted_from = parse_date(request.args.get('planted_from'), 'planted_from')
+        planted_to = parse_date(request.args.get('planted_to'), 'planted_to')
+        
+        query = db.session.query(Crop.id, Crop.created_at)
+        if request.args.get('crop_type'):
+            query = query.filter(Crop.crop_type == request.args['crop_type'])
+        if request.args.get('status'):
+            query = query.filter(Crop.status == request.args['status'])
+        if planted_from:
+            query = query.filter(Crop.planting_date >= planted_from)
+        if planted_to:
+            query = query.filter(Crop.planting_date <= planted_to)
+        
+        rows, next_cursor = keyset_page(query, [Crop.created_at, Crop.id], limit, cursor, order)
+        crops = crop_summaries([row.id for row in rows])
         
         return jsonify({
             "success": True,
-            "crops": [c.to_dict() for c in crops],
-            "total": len(crops)
+            "crops": crops,
+            "count": len(crops),
+            "has_more": next_cursor is not None,
+            "next_cursor": next_cursor
         })
+    except InvalidPageArgs as e:
+        return jsonify({"success": False, "error": str(e)}), 400
     except Exception as e:
         return jsonify({"success": False, "error": str(e)}), 500
 
@@ -299,6 +435,10 @@ def api_v2_update_crop(crop_id):
             crop.area = float(data['area']) if data['area'] else None
         if 'status' in data:
             crop.status = data['status']
+        if 'actual_harvest_date' in data:
+            # 填了收获日期后本季统计冻结（见 crop_rollup.py）
+            crop.actual_harvest_date = datetime.strptime(data['actual_harvest_date'], '%Y-%m-%d').date() \
+                if data['actual_harvest_date'] else None
         if 'notes' in data:
             crop.notes = data['notes']
         
@@ -437,15 +577,21 @@ def api_v2_add_crop_event():
 
 @app.route('/api/v2/analysis/quick/<int:crop_id>', methods=['POST'])
 def api_v2_quick_analysis(crop_id):
-    """快速AI分析（保存历史记录）"""
+    """
+    快速AI分析（保存历史记录）
+
+    先做统计分析：数据正常时直接返回统计结果，不调用大模型；
+    数据有异常，或请求里 narrative 为 true（要求文字解读）时才调用大模型；
+    记录、事件和参数都没有变化时直接返回上次的分析（reused 为 true），force 为 true 时重新分析
+    """
     try:
         crop = Crop.query.get_or_404(crop_id)
         data = request.json
         days = data.get('days', 7)
+        narrative = bool(data.get('narrative'))
+        force = bool(data.get('force'))
         
-        records = DailyRecord.query.filter_by(crop_id=crop_id)\
-            .order_by(DailyRecord.date.desc())\
-            .limit(days).all()
+        records = recent_records(crop_id, days)
         
         if not records:
             return jsonify({
@@ -453,80 +599,27 @@ def api_v2_quick_analysis(crop_id):
                 "error": "数据不足，至少需要3天的记录"
             }), 404
         
-        temps = [r.temperature for r in records if r.temperature]
-        humidities = [r.humidity for r in records if r.humidity]
-        
-        avg_temp = sum(temps) / len(temps) if temps else 0
-        avg_humidity = sum(humidities) / len(humidities) if humidities else 0
-        
-        records_text = "\n".join([
-            f"{r.date.strftime('%Y-%m-%d')}: 温度{r.temperature}°C, 湿度{r.humidity}%, " +
-            f"天气{r.weather or '未知'}, 状态{r.growth_status or '未记录'}"
-            for r in reversed(records)
-        ])
-        
-        analysis_prompt = f"""
-你是农宝🌾，一位专业的农业AI助手。请对以下作物进行快速分析：
-
-【作物信息】
-名称：{crop.name}
-类型：{crop.crop_type}
-品种：{crop.variety or '未知'}
-生长天数：{crop.get_growth_days()}天
-
-【最近{days}天数据】
-{records_text}
-
-平均温度：{avg_temp:.1f}°C
-平均湿度：{avg_humidity:.1f}%
-
-请从以下3个维度分析，并以JSON格式返回：
-
-{{
-    "growth_evaluation": "生长评估文字（50-80字）",
-    "growth_score": 85,
-    "fertilizer_advice": "施肥建议文字（50-80字）",
-    "fertilizer_suggestions": ["具体建议1", "具体建议2"],
-    "pest_prediction": "病虫害预测文字（50-80字）",
-    "pest_risk": "低"
-}}
-
-要求：
-1. 评估要客观，基于数据
-2. 建议要具体可行
-3. 语言要通俗易懂
-4. 不要使用markdown格式
-
-请直接返回JSON，不要其他内容。
-"""
-        
-        response = rag.llm.invoke(analysis_prompt)
-        result_text = response.content.strip()
+        # 数据没有变化：直接返回上次的分析
+        fingerprint = data_fingerprint(crop, records, days, narrative)
+        previous = None if force else find_reusable(crop_id, fingerprint)
+        if previous:
+            return jsonify({
+                "success": True,
+                "crop_name": crop.name,
+                "days": days,
+                "records_count": len(records),
+                "analysis": json.loads(previous.full_analysis),
+                "history_id": previous.id,
+                "reused": True
+            })
         
-        json_match = re.search(r'\{[\s\S]*\}', result_text)
-        if json_match:
-            analysis_json = json.loads(json_match.group())
-        else:
-            analysis_json = {
-                "growth_evaluation": result_text[:100],
-                "growth_score": 75,
-                "fertilizer_advice": "建议根据作物生长阶段适时施肥",
-                "fertilizer_suggestions": ["观察作物长势", "适时追肥"],
-                "pest_prediction": "当前风险较低，注意观察",
-                "pest_risk": "低"
-            }
+        analysis_json, analysis_prompt = prepare_analysis(crop, records, days, narrative)
+        if analysis_prompt:
+            result_text = rag.invoke_shared(analysis_prompt, priority="batch")
+            analysis_json = parse_quick_analysis(result_text, fallback=analysis_json)
         
         # 保存分析历史
-        analysis_history = AnalysisHistory(
-            crop_id=crop_id,
-            analysis_type='快速分析',
-            growth_evaluation=analysis_json.get('growth_evaluation', ''),
-            growth_score=analysis_json.get('growth_score', 0),
-            fertilizer_advice=analysis_json.get('fertilizer_advice', ''),
-            pest_prediction=analysis_json.get('pest_prediction', ''),
-            pest_risk=analysis_json.get('pest_risk', '低'),
-            full_analysis=json.dumps(analysis_json, ensure_ascii=False)
-        )
+        analysis_history = make_history(crop_id, analysis_json, fingerprint=fingerprint)
         
         db.session.add(analysis_history)
         db.session.commit()
@@ -537,9 +630,13 @@ def api_v2_quick_analysis(crop_id):
             "days": days,
             "records_count": len(records),
             "analysis": analysis_json,
-            "history_id": analysis_history.id
+            "history_id": analysis_history.id,
+            "reused": False
         })
         
+    except SchedulerBusy as busy:
+        return busy_response(busy)
+        
     except Exception as e:
         db.session.rollback()
         return jsonify({
@@ -547,24 +644,92 @@ def api_v2_quick_analysis(crop_id):
             "error": str(e)
         }), 500
 
+# ===== 批量AI分析API =====
+
+@app.route('/api/v2/analysis/batch', methods=['POST'])
+def api_v2_batch_analysis():
+    """批量分析所有生长中的作物（后台执行，返回任务ID）"""
+    try:
+        data = request.get_json(silent=True) or {}
+        days = int(data.get('days', 7))
+        narrative = bool(data.get('narrative'))
+        force = bool(data.get('force'))
+        
+        try:
+            job = batch_analyzer.submit(days, narrative, force)
+        except BatchAnalysisRunning as running:
+            # 其他 worker 进程或命令行正在执行的任务也算
+            return jsonify({
+                "success": False,
+                "error": str(running),
+                "job_id": running.job_id
+            }), 409
+        
+        return jsonify({
+            "success": True,
+            "message": "批量分析已开始",
+            "job_id": job.id
+        }), 202
+    except Exception as e:
+        return jsonify({"success": False, "error": str(e)}), 500
+
+@app.route('/api/v2/analysis/batch/<job_id>', methods=['GET'])
+def api_v2_get_batch_analysis(job_id):
+    """查询批量分析进度（每个作物的状态、评分和风险）"""
+    try:
+        job = batch_analyzer.get(job_id)
+        
+        if not job:
+            return jsonify({"success": False, "error": "任务不存在"}), 404
+        
+        return jsonify({
+            "success": True,
+            "job": job
+        })
+    except Exception as e:
+        return jsonify({"success": False, "error": str(e)}), 500
+
 # ===== AI分析历史API =====
 
 @app.route('/api/v2/analysis/history/<int:crop_id>', methods=['GET'])
 def api_v2_get_analysis_history(crop_id):
-    """获取作物的分析历史"""
+    """
+    获取作物的分析历史（按分析时间游标分页）
+    
+    参数（查询字符串，均可选）:
+        analysis_type: 筛选，如 快速分析 / 批量分析
+        date_from / date_to: 分析日期范围（YYYY-MM-DD，含两端）
+        limit / cursor / order: 分页，见 pagination.page_args
+    """
     try:
         crop = Crop.query.get_or_404(crop_id)
+        limit, cursor, order = page_args(request.args)
+        date_from = parse_date(request.args.get('date_from'), 'date_from')
+        date_to = parse_date(request.args.get('date_to'), 'date_to')
+        
+        query = AnalysisHistory.query.filter_by(crop_id=crop_id)
+        if request.args.get('analysis_type'):
+            query = query.filter(AnalysisHistory.analysis_type == request.args['analysis_type'])
+        if date_from:
+            query = query.filter(AnalysisHistory.analysis_date >= datetime.combine(date_from, datetime.min.time()))
+        if date_to:
+            query = query.filter(AnalysisHistory.analysis_date < datetime.combine(date_to + timedelta(days=1), datetime.min.time()))
         
-        histories = AnalysisHistory.query.filter_by(crop_id=crop_id)\
-            .order_by(AnalysisHistory.analysis_date.desc()).all()
+        histories, next_cursor = keyset_page(query, [AnalysisHistory.analysis_date, AnalysisHistory.id],
+                                             limit, cursor, order)
         
         return jsonify({
             "success": True,
             "crop_name": crop.name,
             "histories": [h.to_dict() for h in histories],
-            "total": len(histories)
+            "count": len(histories),
+            "has_more": next_cursor is not None,
+            "next_cursor": next_cursor
         })
         
+    except InvalidPageArgs as e:
+        return jsonify({"success": False, "error": str(e)}), 400
+        
     except Exception as e:
         return jsonify({
             "success": False,
@@ -666,8 +831,7 @@ def api_v2_chat_analysis(crop_id):
 请回答用户的问题：
 """
         
-        response = rag.llm.invoke(chat_prompt)
-        answer = response.content.strip()
+        answer = rag.invoke_shared(chat_prompt, priority="interactive")
         
         return jsonify({
             "success": True,
@@ -675,6 +839,9 @@ def api_v2_chat_analysis(crop_id):
             "answer": answer
         })
         
+    except SchedulerBusy as busy:
+        return busy_response(busy)
+        
     except Exception as e:
         return jsonify({
             "success": False,
@@ -685,16 +852,22 @@ def api_v2_chat_analysis(crop_id):
 
 @app.route('/api/documents', methods=['GET'])
 def api_get_documents():
-    """获取文档列表"""
+    """获取文档列表（分页，可按 crop / topic / source 筛选）"""
     try:
-        limit = request.args.get('limit', 50, type=int)
-        docs = kb.list_documents(limit=limit)
+        limit, cursor, _ = page_args(request.args)
+        filters = {key: request.args[key] for key in ('crop', 'topic', 'source') if request.args.get(key)}
+        docs, next_cursor = offset_page(cursor, limit,
+                                        lambda offset, count: kb.list_documents(count, offset, filters))
         
         return jsonify({
             "success": True,
             "documents": docs,
-            "total": kb.collection.count()
+            "total": kb.count_documents(filters),
+            "has_more": next_cursor is not None,
+            "next_cursor": next_cursor
         })
+    except InvalidPageArgs as e:
+        return jsonify({"success": False, "error": str(e)}), 400
     except Exception as e:
         return jsonify({"success": False, "error": str(e)}), 500
 
@@ -711,12 +884,30 @@ def api_add_document():
         if not content:
             return jsonify({"success": False, "error": "文档内容不能为空"}), 400
         
-        doc_id = kb.add_document(content, crop, topic, source)
+        # 加入后台队列，立即返回任务ID
+        job = ingest_queue.submit_text(content, crop, topic, source)
         
         return jsonify({
             "success": True,
-            "message": "文档添加成功",
-            "doc_id": doc_id
+            "message": "文档已加入处理队列",
+            "job_id": job.id,
+            "doc_id": job.doc_id
+        }), 202
+    except Exception as e:
+        return jsonify({"success": False, "error": str(e)}), 500
+
+@app.route('/api/documents/jobs/<job_id>', methods=['GET'])
+def api_get_document_job(job_id):
+    """查询文档导入任务进度"""
+    try:
+        job = ingest_queue.get(job_id)
+        
+        if not job:
+            return jsonify({"success": False, "error": "任务不存在"}), 404
+        
+        return jsonify({
+            "success": True,
+            "job": job
         })
     except Exception as e:
         return jsonify({"success": False, "error": str(e)}), 500
@@ -750,17 +941,68 @@ def api_search():
     try:
         data = request.json
         query = data.get('query', '').strip()
-        n_results = data.get('n_results', 20)
+        n_results = result_count(data, 20)
+        mode = data.get('mode', 'hybrid')    # hybrid / vector / lexical（只用关键词，不跑模型）
         
         if not query:
             return jsonify({"success": False, "error": "搜索关键词不能为空"}), 400
         
-        results = kb.search(query, n_results=n_results)
+        if mode not in SEARCH_MODES:
+            return jsonify({"success": False, "error": f"mode 只能是 {'/'.join(SEARCH_MODES)}"}), 400
+        
+        # 可选过滤：指定作物/主题，或 auto_filter 时从问题中识别作物
+        where = kb.make_where(data.get('crop'), data.get('topic'))
+        if where is None and data.get('auto_filter'):
+            where = kb.detect_filter(query)
+        
+        results = kb.search(query, n_results=n_results, where=where, mode=mode)
         
         return jsonify({
             "success": True,
             "results": results
         })
+    except InvalidPageArgs as e:
+        return jsonify({"success": False, "error": str(e)}), 400
+    except Exception as e:
+        return jsonify({"success": False, "error": str(e)}), 500
+
+@app.route('/api/search/batch', methods=['POST'])
+def api_search_batch():
+    """批量搜索文档（所有查询一次向量化、一次检索）"""
+    try:
+        data = request.json
+        queries = data.get('queries') or []
+        n_results = result_count(data, 5)
+        mode = data.get('mode', 'hybrid')
+        
+        if not isinstance(queries, list) or not queries:
+            return jsonify({"success": False, "error": "queries 必须是非空列表"}), 400
+        
+        if mode not in SEARCH_MODES:
+            return jsonify({"success": False, "error": f"mode 只能是 {'/'.join(SEARCH_MODES)}"}), 400
+        
+        if len(queries) > SEARCH_BATCH_MAX:
+            return jsonify({"success": False, "error": f"一次最多 {SEARCH_BATCH_MAX} 个查询"}), 400
+        
+        queries = [str(query).strip() for query in queries]
+        if not all(queries):
+            return jsonify({"success": False, "error": "搜索关键词不能为空"}), 400
+        
+        where = kb.make_where(data.get('crop'), data.get('topic'))
+        if where is None and data.get('auto_filter'):
+            where = [kb.detect_filter(query) for query in queries]
+        
+        results = kb.search_many(queries, n_results=n_results, where=where, mode=mode)
+        
+        return jsonify({
+            "success": True,
+            "results": [
+                {"query": query, "results": items}
+                for query, items in zip(queries, results)
+            ]
+        })
+    except InvalidPageArgs as e:
+        return jsonify({"success": False, "error": str(e)}), 400
     except Exception as e:
         return jsonify({"success": False, "error": str(e)}), 500
 
@@ -795,53 +1037,19 @@ def api_stats():
 
 # 在文件开头添加导入
 from werkzeug.utils import secure_filename
+from document_loader import allowed_file
 import os
 
 # 配置上传文件夹
 UPLOAD_FOLDER = 'uploads/documents'
-ALLOWED_EXTENSIONS = {'txt', 'pdf', 'docx'}
 
 # 确保上传文件夹存在
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 
-def allowed_file(filename):
-    """检查文件扩展名"""
-    return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
-
-def read_document(filepath):
-    """读取文档内容"""
-    ext = filepath.rsplit('.', 1)[1].lower()
-    
-    if ext == 'txt':
-        with open(filepath, 'r', encoding='utf-8') as f:
-            return f.read()
-    
-    elif ext == 'pdf':
-        try:
-            import PyPDF2
-            with open(filepath, 'rb') as f:
-                pdf_reader = PyPDF2.PdfReader(f)
-                text = ''
-                for page in pdf_reader.pages:
-                    text += page.extract_text()
-                return text
-        except:
-            return "PDF读取失败（需要安装 PyPDF2: pip install PyPDF2）"
-    
-    elif ext == 'docx':
-        try:
-            import docx
-            doc = docx.Document(filepath)
-            return '\n'.join([para.text for para in doc.paragraphs])
-        except:
-            return "DOCX读取失败（需要安装 python-docx: pip install python-docx）"
-    
-    return "不支持的文件格式"
-
 # 添加上传API
 @app.route('/api/documents/upload', methods=['POST'])
 def upload_document():
-    """上传文档并向量化"""
+    """上传文档（后台向量化，返回任务ID）"""
     try:
         # 检查文件
         if 'file' not in request.files:
@@ -859,30 +1067,18 @@ def upload_document():
         filepath = os.path.join(UPLOAD_FOLDER, filename)
         file.save(filepath)
         
-        # 读取内容
-        content = read_document(filepath)
-        
-        if not content or len(content.strip()) < 10:
-            os.remove(filepath)
-            return jsonify({"success": False, "error": "文件内容为空或过短"}), 400
-        
-        # 向量化并添加到知识库
+        # 加入后台队列：解析、切块、向量化都在后台完成，立即返回任务ID
         crop = request.form.get('crop', '未分类')
         topic = request.form.get('topic', '未分类')
         
-        doc_id = kb.add_document(
-            content=content,
-            crop=crop,
-            topic=topic,
-            source=filename
-        )
+        job = ingest_queue.submit_file(filepath, filename, crop, topic)
         
         return jsonify({
             "success": True,
-            "message": "文档上传并向量化成功",
-            "doc_id": doc_id,
-            "content_length": len(content)
-        })
+            "message": "文档已上传，正在后台向量化",
+            "job_id": job.id,
+            "doc_id": job.doc_id
+        }), 202
         
     except Exception as e:
         return jsonify({
@@ -890,6 +1086,20 @@ def upload_document():
             "error": str(e)
         }), 500
 
+# ========== 大模型调度API ==========
+
+@app.route('/api/llm/stats', methods=['GET'])
+def api_llm_stats():
+    """大模型调用统计：并发数、各优先级的队列深度和等待时间、请求合并情况"""
+    try:
+        return jsonify({
+            "success": True,
+            "scheduler": rag.scheduler.get_stats(),
+            "single_flight": rag.flights.get_stats()
+        })
+    except Exception as e:
+        return jsonify({"success": False, "error": str(e)}), 500
+
 # ========== 缓存管理API ==========
 
 @app.route('/api/cache/stats', methods=['GET'])
@@ -918,10 +1128,14 @@ def api_cache_clear():
 
 
 
-# 创建数据库表
+# 创建数据库表（已有的表补上新增的列和索引）
 with app.app_context():
     try:
         db.create_all()
+        upgrade_schema()
+        built = stats_rollup.rebuild_all(db.session, missing_only=True)
+        if built:
+            print(f"🔧 已为 {built} 个作物生成统计汇总")
         print("✅ 数据库表已创建")
     except Exception as e:
         print(f"⚠️ 数据库初始化失败: {e}")
@@ -0,0 +1,336 @@
+# benchmark.py - 离线基准测试 / 压测工具
+# 功能：用本地模拟的大模型和向量模型（stubs.py，不联网、不需要 API Key）启动应用，
+#       并发请求 /api/ask、/api/search、/api/v2/crops、/api/v2/daily-records，
+#       统计每个接口的 p50/p95/p99 延迟和吞吐量；可以和基线结果对比，性能退化时返回非零退出码（CI 用）
+#
+# 用法：
+#   python benchmark.py                                   # 进程内压测全部接口（Flask test client）
+#   python benchmark.py -n 500 -c 16 --endpoints ask,search
+#   python benchmark.py --llm-latency 0.5 --tokens-per-sec 30
+#   python benchmark.py --unique                          # 每个问题都不一样，测缓存未命中的路径
+#   python benchmark.py --json result.json                # 保存结果
+#   python benchmark.py --baseline base.json --max-regression 0.2   # p95 比基线慢 20% 以上时失败
+#   python benchmark.py --url http://127.0.0.1:5000       # 压测已启动的服务（服务端需设置 AGRI_STUB_MODELS=1）
+
+import os
+import sys
+import argparse
+import json
+import math
+import random
+import shutil
+import tempfile
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, timedelta
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+ENDPOINTS = ("ask", "search", "crops", "daily-records")
+
+QUESTIONS = [
+    "小麦什么时候播种比较好",
+    "小麦返青期怎么施肥",
+    "小麦条锈病怎么防治",
+    "冬小麦冬前管理要注意什么",
+    "玉米播种密度多少合适",
+    "玉米大喇叭口期追什么肥",
+    "玉米螟用什么药防治",
+    "玉米倒伏了怎么办",
+    "水稻育秧要注意哪些问题",
+    "稻瘟病的症状和防治方法",
+    "大豆花荚期怎么管理",
+    "土豆晚疫病怎么预防",
+]
+
+
+# ===== 客户端 =====
+
+class InProcessClient:
+    """进程内客户端：每个线程一个 Flask test client（各自的会话 cookie）"""
+
+    def __init__(self, app):
+        self.app = app
+        self.local = threading.local()
+
+    def request(self, method, path, body=None):
+        client = getattr(self.local, 'client', None)
+        if client is None:
+            client = self.local.client = self.app.test_client()
+        response = client.open(path, method=method, json=body)
+        data = response.get_json(silent=True)
+        return response.status_code, data
+
+
+class HttpClient:
+    """HTTP 客户端：压测已启动的服务，每个线程一个连接池"""
+
+    def __init__(self, base_url):
+        import requests
+        self.requests = requests
+        self.base_url = base_url.rstrip('/')
+        self.local = threading.local()
+
+    def request(self, method, path, body=None):
+        session = getattr(self.local, 'session', None)
+        if session is None:
+            session = self.local.session = self.requests.Session()
+        response = session.request(method, self.base_url + path, json=body, timeout=300)
+        try:
+            data = response.json()
+        except ValueError:
+            data = None
+        return response.status_code, data
+
+
+# ===== 环境准备 =====
+
+def setup_in_process(args):
+    """
+    在临时目录里启动应用（模拟模型、独立的向量库/缓存/数据库），导入内置知识文档
+
+    返回:
+        (客户端, 工作目录)
+    """
+    workdir = args.workdir or tempfile.mkdtemp(prefix="agri_bench_")
+    os.makedirs(workdir, exist_ok=True)
+
+    # 必须在导入 config 之前设置
+    os.environ["AGRI_STUB_MODELS"] = "1"
+    os.environ["AGRI_STUB_LLM_LATENCY"] = str(args.llm_latency)
+    os.environ["AGRI_STUB_LLM_TOKENS_PER_SEC"] = str(args.tokens_per_sec)
+    os.environ["AGRI_STUB_EMBEDDING_LATENCY"] = str(args.embedding_latency)
+    os.environ["ANONYMIZED_TELEMETRY"] = "False"
+    os.environ.setdefault("DASHSCOPE_API_KEY", "stub")
+    os.environ["DATABASE_URL"] = "sqlite:///" + os.path.join(os.path.abspath(workdir), "bench.db")
+
+    # 配置里的路径都是相对路径，切到工作目录后全部落在临时目录里
+    os.chdir(workdir)
+    sys.path.insert(0, ROOT)
+
+    import app_v2
+    from ingest import ingest
+
+    if app_v2.kb.collection.count() == 0:
+        ingest(root=os.path.join(ROOT, "data", "knowledge"), kb=app_v2.kb, workers=1,
+               manifest_path=os.path.join(workdir, "ingest_manifest.json"))
+
+    return InProcessClient(app_v2.app), workdir
+
+
+def create_crop(client):
+    """创建压测用的作物，返回作物ID"""
+    status, data = client.request("POST", "/api/v2/crops", {
+        "name": "压测小麦",
+        "crop_type": "小麦",
+        "variety": "济麦22",
+        "area": 10,
+        "planting_date": (date.today() - timedelta(days=60)).strftime('%Y-%m-%d')
+    })
+    if status != 200 or not data or not data.get("success"):
+        raise RuntimeError(f"创建作物失败：HTTP {status} {data}")
+    return data["crop"]["id"]
+
+
+# ===== 请求生成 =====
+
+def make_workload(name, args, crop_id):
+    """
+    生成某个接口的请求函数
+
+    返回:
+        fn(i) → (方法, 路径, 请求体)
+    """
+    rng = random.Random(args.seed)
+    picks = [rng.choice(QUESTIONS) for _ in range(args.requests)]
+
+    def question(i):
+        return f"{picks[i]}（{i}）" if args.unique else picks[i]
+
+    if name == "ask":
+        return lambda i: ("POST", "/api/ask", {"question": question(i)})
+    if name == "search":
+        return lambda i: ("POST", "/api/search", {"query": question(i), "n_results": 5})
+    if name == "crops":
+        return lambda i: ("GET", "/api/v2/crops", None)
+    if name == "daily-records":
+        start = date.today()
+        return lambda i: ("POST", "/api/v2/daily-records", {
+            "crop_id": crop_id,
+            "date": (start - timedelta(days=i)).strftime('%Y-%m-%d'),
+            "temperature": 15 + i % 10,
+            "humidity": 50 + i % 30,
+            "weather": "晴",
+            "growth_status": "良好"
+        })
+    raise ValueError(f"未知的接口：{name}")
+
+
+# ===== 压测与统计 =====
+
+def percentile(values, p):
+    """最近秩百分位数（values 已排序）"""
+    if not values:
+        return 0.0
+    return values[max(0, math.ceil(p / 100 * len(values)) - 1)]
+
+
+def run_endpoint(client, name, workload, total, concurrency):
+    """
+    并发发送 total 个请求
+
+    返回:
+        统计结果字典（延迟单位毫秒）
+    """
+    def one(i):
+        method, path, body = workload(i)
+        started = time.perf_counter()
+        try:
+            status, _ = client.request(method, path, body)
+        except Exception:
+            status = "exception"
+        return time.perf_counter() - started, status
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(one, range(total)))
+    wall = time.perf_counter() - started
+
+    latencies = sorted(latency * 1000 for latency, _ in results)
+    statuses = Counter(str(status) for _, status in results)
+    errors = sum(count for status, count in statuses.items() if status != "200")
+
+    return {
+        "endpoint": name,
+        "requests": total,
+        "concurrency": concurrency,
+        "errors": errors,
+        "status": dict(statuses),
+        "throughput": round(total / wall, 2) if wall else 0.0,
+        "mean_ms": round(sum(latencies) / len(latencies), 2) if latencies else 0.0,
+        "p50_ms": round(percentile(latencies, 50), 2),
+        "p95_ms": round(percentile(latencies, 95), 2),
+        "p99_ms": round(percentile(latencies, 99), 2),
+        "max_ms": round(latencies[-1], 2) if latencies else 0.0,
+        "elapsed": round(wall, 3)
+    }
+
+
+def print_report(results):
+    """打印结果表（表头用英文，终端里中文宽度不一致会错位）"""
+    print("\n" + "=" * 86)
+    print(f"{'endpoint':<16}{'reqs':>6}{'conc':>6}{'errors':>7}{'req/s':>12}"
+          f"{'p50(ms)':>10}{'p95(ms)':>10}{'p99(ms)':>10}{'max(ms)':>10}")
+    print("-" * 86)
+    for r in results:
+        print(f"{r['endpoint']:<16}{r['requests']:>6}{r['concurrency']:>6}{r['errors']:>7}{r['throughput']:>12.2f}"
+              f"{r['p50_ms']:>10.1f}{r['p95_ms']:>10.1f}{r['p99_ms']:>10.1f}{r['max_ms']:>10.1f}")
+    print("=" * 86)
+
+
+def compare_baseline(results, baseline_path, max_regression):
+    """
+    与基线结果比较 p95 延迟
+
+    返回:
+        退化的接口列表 [(接口, 基线p95, 本次p95)]
+    """
+    with open(baseline_path, 'r', encoding='utf-8') as f:
+        baseline = {r["endpoint"]: r for r in json.load(f)["results"]}
+
+    regressions = []
+    for r in results:
+        base = baseline.get(r["endpoint"])
+        if base and base["p95_ms"] > 0 and r["p95_ms"] > base["p95_ms"] * (1 + max_regression):
+            regressions.append((r["endpoint"], base["p95_ms"], r["p95_ms"]))
+    return regressions
+
+
+def main(argv=None):
+    """命令行入口"""
+    parser = argparse.ArgumentParser(description="AgriChatBot 离线压测（模拟大模型和向量模型）")
+    parser.add_argument("-n", "--requests", type=int, default=200, help="每个接口的请求数")
+    parser.add_argument("-c", "--concurrency", type=int, default=8, help="并发数")
+    parser.add_argument("--endpoints", default=",".join(ENDPOINTS), help="要压测的接口，逗号分隔：%(default)s")
+    parser.add_argument("--url", default=None, help="压测已启动的服务（不传则在进程内启动应用）")
+    parser.add_argument("--workdir", default=None, help="进程内模式的工作目录（默认临时目录，结束后删除）")
+    parser.add_argument("--llm-latency", type=float, default=0.3, help="模拟大模型首 token 延迟（秒）")
+    parser.add_argument("--tokens-per-sec", type=float, default=50, help="模拟大模型生成速度（token/秒，0 为不限速）")
+    parser.add_argument("--embedding-latency", type=float, default=0.0, help="模拟向量模型每次调用耗时（秒）")
+    parser.add_argument("--unique", action="store_true", help="每个问题都不一样（测缓存未命中的路径）")
+    parser.add_argument("--seed", type=int, default=42, help="随机种子（问题顺序）")
+    parser.add_argument("--json", default=None, help="把结果保存为 JSON")
+    parser.add_argument("--baseline", default=None, help="基线结果 JSON，p95 退化超过阈值时返回 1")
+    parser.add_argument("--max-regression", type=float, default=0.2, help="允许的 p95 退化比例，默认 %(default)s")
+    args = parser.parse_args(argv)
+
+    # 进程内模式会切换工作目录，先把输出路径转成绝对路径
+    args.json = os.path.abspath(args.json) if args.json else None
+    args.baseline = os.path.abspath(args.baseline) if args.baseline else None
+
+    endpoints = [name.strip() for name in args.endpoints.split(",") if name.strip()]
+    unknown = [name for name in endpoints if name not in ENDPOINTS]
+    if unknown:
+        print(f"❌ 未知的接口：{', '.join(unknown)}（可选：{', '.join(ENDPOINTS)}）")
+        return 2
+
+    cleanup = None
+    if args.url:
+        client = HttpClient(args.url)
+    else:
+        client, workdir = setup_in_process(args)
+        if not args.workdir:
+            cleanup = workdir
+
+    try:
+        crop_id = create_crop(client) if "daily-records" in endpoints else None
+
+        print(f"\n⏱️ 压测开始：每个接口 {args.requests} 个请求，并发 {args.concurrency}")
+        results = []
+        for name in endpoints:
+            print(f"  ▶ {name} ...")
+            results.append(run_endpoint(client, name, make_workload(name, args, crop_id),
+                                        args.requests, args.concurrency))
+    finally:
+        if cleanup:
+            os.chdir(ROOT)
+            shutil.rmtree(cleanup, ignore_errors=True)
+
+    print_report(results)
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump({
+                "settings": {
+                    "requests": args.requests,
+                    "concurrency": args.concurrency,
+                    "llm_latency": args.llm_latency,
+                    "tokens_per_sec": args.tokens_per_sec,
+                    "embedding_latency": args.embedding_latency,
+                    "unique": args.unique,
+                    "url": args.url
+                },
+                "results": results
+            }, f, ensure_ascii=False, indent=2)
+        print(f"💾 结果已保存：{args.json}")
+
+    status = 0
+    if any(r["errors"] for r in results):
+        print("⚠️ 有请求失败，见上表“错误”列")
+        status = 1
+
+    if args.baseline:
+        regressions = compare_baseline(results, args.baseline, args.max_regression)
+        for name, base, current in regressions:
+            print(f"❌ 性能退化：{name} p95 {base:.1f}ms → {current:.1f}ms")
+        if regressions:
+            status = 1
+        else:
+            print(f"✅ 与基线相比没有超过 {args.max_regression:.0%} 的退化")
+
+    return status
+
+
+if __name__ == "__main__":
+    sys.exit(main())
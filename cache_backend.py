@@ -0,0 +1,293 @@
+# cache_backend.py - 缓存后端
+# 功能：可替换的键值缓存后端。SQLite 后端存在磁盘上，同一台机器上的所有 gunicorn worker 共享，
+#       重启/发布后缓存仍在；进程内 LRU 作为一级缓存放在它前面
+
+import json
+import os
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+
+from cache_utils import CacheEngine
+from config import (
+    ANSWER_CACHE_BACKEND, ANSWER_CACHE_PATH, ANSWER_CACHE_TTL,
+    ANSWER_CACHE_MAX_BYTES, ANSWER_CACHE_L1_MAX_BYTES, ANSWER_CACHE_L1_TTL, ANSWER_CACHE_SYNC_INTERVAL
+)
+
+
+class CacheBackend(ABC):
+    """缓存后端接口：值必须能被 JSON 序列化"""
+
+    @abstractmethod
+    def get(self, key):
+        """查询，不存在或已过期时返回 None"""
+
+    @abstractmethod
+    def set(self, key, value, ttl=None):
+        """写入，ttl 为过期秒数（None 表示使用后端默认值）"""
+
+    @abstractmethod
+    def delete(self, key):
+        """删除一条"""
+
+    @abstractmethod
+    def clear(self):
+        """清空"""
+
+    def generation(self):
+        """清空次数（共享后端被任何进程清空后都会变化，不共享的后端返回 None）"""
+        return None
+
+    def get_stats(self):
+        return {}
+
+
+class MemoryBackend(CacheBackend):
+    """进程内缓存（按字节数限制容量的 LRU + TTL，不跨进程）"""
+
+    def __init__(self, max_bytes=ANSWER_CACHE_L1_MAX_BYTES, ttl=ANSWER_CACHE_L1_TTL):
+        self.cache = CacheEngine(max_bytes, ttl=ttl)
+
+    def get(self, key):
+        return self.cache.get(key)
+
+    def set(self, key, value, ttl=None):
+        self.cache.put(key, value, ttl)
+
+    def delete(self, key):
+        self.cache.delete(key)
+
+    def clear(self):
+        self.cache.clear()
+
+    def get_stats(self):
+        return {"type": "memory", **self.cache.get_stats()}
+
+
+class SQLiteBackend(CacheBackend):
+    """
+    SQLite 磁盘缓存（多进程共享）
+
+    - WAL 模式：读写互不阻塞，每次写入是一个事务，进程中途退出也不会留下半条数据
+    - 每条记录有过期时间，读到过期记录当作未命中
+    - 总大小超过上限时按最近访问时间淘汰最旧的记录
+    """
+
+    def __init__(self, path=ANSWER_CACHE_PATH, ttl=ANSWER_CACHE_TTL, max_bytes=ANSWER_CACHE_MAX_BYTES):
+        """
+        参数:
+            path: 数据库文件路径
+            ttl: 默认过期秒数
+            max_bytes: 缓存值的总字节数上限
+        """
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self.path = path
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.local = threading.local()
+        self.stats_lock = threading.Lock()    # 计数器由多个请求线程同时修改
+        self.hits = 0
+        self.misses = 0
+        self.writes_since_evict = 0
+
+        with self._conn() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS cache (
+                    key TEXT PRIMARY KEY,
+                    value TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    expires_at REAL NOT NULL,
+                    accessed_at REAL NOT NULL
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_cache_accessed ON cache (accessed_at)")
+            # 清空代数：每次清空加一，各 worker 据此丢掉自己的一级缓存
+            conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+            conn.execute("INSERT OR IGNORE INTO meta (key, value) VALUES ('generation', 0)")
+
+    def _conn(self):
+        """每个线程（以及 fork 出来的每个进程）各用一个连接"""
+        conn = getattr(self.local, 'conn', None)
+        if conn is None or self.local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self.local.conn = conn
+            self.local.pid = os.getpid()
+        return conn
+
+    def get(self, key):
+        now = time.time()
+        conn = self._conn()
+        row = conn.execute(
+            "SELECT value, expires_at, accessed_at FROM cache WHERE key = ?", (key,)
+        ).fetchone()
+
+        if row is None or row[1] <= now:
+            with self.stats_lock:
+                self.misses += 1
+            return None
+
+        # 访问时间最多每分钟更新一次，避免每次命中都写库
+        if now - row[2] > 60:
+            conn.execute("UPDATE cache SET accessed_at = ? WHERE key = ?", (now, key))
+
+        with self.stats_lock:
+            self.hits += 1
+        return json.loads(row[0])
+
+    def set(self, key, value, ttl=None):
+        now = time.time()
+        data = json.dumps(value, ensure_ascii=False)
+        expires_at = now + (ttl if ttl is not None else self.ttl)
+
+        self._conn().execute(
+            "INSERT OR REPLACE INTO cache (key, value, size, expires_at, accessed_at) VALUES (?, ?, ?, ?, ?)",
+            (key, data, len(data.encode('utf-8')), expires_at, now)
+        )
+
+        # 计数和清零在同一把锁里，每50次写入只有一个线程去淘汰
+        with self.stats_lock:
+            self.writes_since_evict += 1
+            due = self.writes_since_evict >= 50
+            if due:
+                self.writes_since_evict = 0
+        if due:
+            self.evict()
+
+    def delete(self, key):
+        self._conn().execute("DELETE FROM cache WHERE key = ?", (key,))
+
+    def clear(self):
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute("DELETE FROM cache")
+            conn.execute("UPDATE meta SET value = value + 1 WHERE key = 'generation'")
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def generation(self):
+        return self._conn().execute("SELECT value FROM meta WHERE key = 'generation'").fetchone()[0]
+
+    def evict(self):
+        """删除过期记录；总大小超过上限时按访问时间淘汰到上限的 90%"""
+        with self.stats_lock:
+            self.writes_since_evict = 0
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute("DELETE FROM cache WHERE expires_at <= ?", (time.time(),))
+            total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM cache").fetchone()[0]
+
+            if total > self.max_bytes:
+                target = total - int(self.max_bytes * 0.9)
+                removed = 0
+                doomed = []
+                for key, size in conn.execute("SELECT key, size FROM cache ORDER BY accessed_at"):
+                    doomed.append((key,))
+                    removed += size
+                    if removed >= target:
+                        break
+                conn.executemany("DELETE FROM cache WHERE key = ?", doomed)
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def get_stats(self):
+        with self.stats_lock:
+            hits, misses = self.hits, self.misses
+        total = hits + misses
+        entries, size = self._conn().execute(
+            "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM cache"
+        ).fetchone()
+        return {
+            "type": "sqlite",
+            "hits": hits,
+            "misses": misses,
+            "hit_rate": f'{(hits / total * 100) if total else 0:.1f}%',
+            "cache_size": entries,
+            "bytes": size,
+            "max_bytes": self.max_bytes
+        }
+
+
+class TieredCache(CacheBackend):
+    """
+    两级缓存：进程内一级缓存 + 共享的二级缓存（二级命中时回填一级）
+
+    其他 worker 清空缓存时二级缓存的清空代数会变化，本进程查询时发现后也清空一级缓存
+    （最多每 sync_interval 秒查一次，最长在这么久之后生效）。
+    """
+
+    def __init__(self, l1, l2, sync_interval=ANSWER_CACHE_SYNC_INTERVAL):
+        self.l1 = l1
+        self.l2 = l2
+        self.sync_interval = sync_interval
+        self.sync_lock = threading.Lock()
+        self.generation_seen = l2.generation()
+        self.synced_at = time.monotonic()
+
+    def _sync(self):
+        """二级缓存被其他进程清空过时清空一级缓存"""
+        now = time.monotonic()
+        if now - self.synced_at < self.sync_interval:
+            return
+        with self.sync_lock:
+            if now - self.synced_at < self.sync_interval:
+                return
+            self.synced_at = now
+            generation = self.l2.generation()
+            if generation != self.generation_seen:
+                self.generation_seen = generation
+                self.l1.clear()
+
+    def get(self, key):
+        self._sync()
+        value = self.l1.get(key)
+        if value is None:
+            value = self.l2.get(key)
+            if value is not None:
+                self.l1.set(key, value)
+        return value
+
+    def set(self, key, value, ttl=None):
+        self.l1.set(key, value, ttl)
+        self.l2.set(key, value, ttl)
+
+    def delete(self, key):
+        self.l1.delete(key)
+        self.l2.delete(key)
+
+    def clear(self):
+        self.l2.clear()
+        with self.sync_lock:
+            self.l1.clear()
+            self.generation_seen = self.l2.generation()
+
+    def generation(self):
+        return self.l2.generation()
+
+    def get_stats(self):
+        return {"l1": self.l1.get_stats(), "l2": self.l2.get_stats()}
+
+
+def create_answer_cache(backend=ANSWER_CACHE_BACKEND):
+    """
+    按配置创建回答缓存
+
+    参数:
+        backend: "sqlite"（进程内 + SQLite 两级，默认）或 "memory"（只用进程内缓存）
+
+    返回:
+        CacheBackend 实例
+    """
+    if backend == "memory":
+        return MemoryBackend(ttl=ANSWER_CACHE_TTL)
+    if backend == "sqlite":
+        return TieredCache(MemoryBackend(), SQLiteBackend())
+    raise ValueError(f"不支持的缓存后端：{backend}")
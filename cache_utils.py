@@ -0,0 +1,221 @@
+# cache_utils.py - 缓存工具
+# 功能：线程安全的有界 LRU 缓存，带命中/未命中统计（检索、向量等内存缓存共用）
+#       CacheEngine：按总字节数限制容量、支持过期时间、分段加锁的缓存引擎（回答缓存使用）
+
+import json
+import threading
+import time
+from collections import OrderedDict
+
+
+class LRUCache:
+    """有界 LRU 缓存（线程安全）"""
+
+    def __init__(self, maxsize=256):
+        """
+        参数:
+            maxsize: 最多缓存条数，超出时淘汰最久未使用的条目
+        """
+        self.maxsize = maxsize
+        self.data = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, default=None):
+        """查询缓存（命中时移到最近使用的位置）"""
+        with self.lock:
+            if key in self.data:
+                self.data.move_to_end(key)
+                self.hits += 1
+                return self.data[key]
+            self.misses += 1
+            return default
+
+    def put(self, key, value):
+        """写入缓存"""
+        with self.lock:
+            self.data[key] = value
+            self.data.move_to_end(key)
+            while len(self.data) > self.maxsize:
+                self.data.popitem(last=False)
+
+    def delete(self, key):
+        """删除条目（不存在时忽略）"""
+        with self.lock:
+            self.data.pop(key, None)
+
+    def clear(self, reset_stats=False):
+        """清空缓存条目（reset_stats=True 时连统计一起清零）"""
+        with self.lock:
+            self.data.clear()
+            if reset_stats:
+                self.hits = 0
+                self.misses = 0
+
+    def __len__(self):
+        return len(self.data)
+
+    def get_stats(self):
+        """缓存统计"""
+        total = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'total_queries': total,
+            'hit_rate': f'{(self.hits / total * 100) if total else 0:.1f}%',
+            'cache_size': len(self.data),
+            'max_size': self.maxsize
+        }
+
+
+def estimate_size(value):
+    """估算缓存值占用的字节数（字符串按 UTF-8 长度，其他按 JSON 长度）"""
+    if isinstance(value, bytes):
+        return len(value)
+    if isinstance(value, str):
+        return len(value.encode('utf-8'))
+    try:
+        return len(json.dumps(value, ensure_ascii=False).encode('utf-8'))
+    except (TypeError, ValueError):
+        return 64
+
+
+class _Stripe:
+    """缓存引擎的一个分段：独立的锁、LRU 链表和统计"""
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.lock = threading.Lock()
+        self.data = OrderedDict()   # 键 → (值, 字节数, 过期时间)
+        self.bytes = 0
+        self.reset_stats()
+
+    def reset_stats(self):
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.evictions = 0
+        self.rejected = 0
+
+
+class CacheEngine:
+    """
+    有界 LRU + TTL 缓存引擎（线程安全）
+
+    - 容量按总字节数计算：长回答占的额度多，不会因为条数上限把热门的短回答挤出去
+    - 每条记录可以有自己的过期时间
+    - 按键的哈希分成多个分段，每段一把锁，并发请求很少互相等待；
+      统计数据在各段的锁内更新，汇总后是精确值
+    """
+
+    def __init__(self, max_bytes, ttl=None, stripes=16):
+        """
+        参数:
+            max_bytes: 总字节数上限（平均分给各分段）
+            ttl: 默认过期秒数，None 表示不过期
+            stripes: 分段数
+        """
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.stripes = [_Stripe(max_bytes // stripes) for _ in range(stripes)]
+
+    def _stripe(self, key):
+        return self.stripes[hash(key) % len(self.stripes)]
+
+    def get(self, key, default=None):
+        """查询缓存（过期的记录当作未命中并删除）"""
+        stripe = self._stripe(key)
+        with stripe.lock:
+            entry = stripe.data.get(key)
+            if entry is None:
+                stripe.misses += 1
+                return default
+
+            value, size, expires_at = entry
+            if expires_at is not None and expires_at <= time.monotonic():
+                del stripe.data[key]
+                stripe.bytes -= size
+                stripe.expired += 1
+                stripe.misses += 1
+                return default
+
+            stripe.data.move_to_end(key)
+            stripe.hits += 1
+            return value
+
+    def put(self, key, value, ttl=None):
+        """
+        写入缓存
+
+        参数:
+            key: 键
+            value: 值
+            ttl: 过期秒数，None 表示使用默认值
+
+        返回:
+            是否写入（单条超过分段容量时不缓存）
+        """
+        size = estimate_size(key) + estimate_size(value)
+        ttl = self.ttl if ttl is None else ttl
+        expires_at = time.monotonic() + ttl if ttl else None
+
+        stripe = self._stripe(key)
+        with stripe.lock:
+            old = stripe.data.pop(key, None)
+            if old is not None:
+                stripe.bytes -= old[1]
+
+            if size > stripe.capacity:
+                stripe.rejected += 1
+                return False
+
+            stripe.data[key] = (value, size, expires_at)
+            stripe.bytes += size
+
+            # 超出容量：从最久未使用的记录开始淘汰
+            while stripe.bytes > stripe.capacity:
+                _, (_, evicted_size, _) = stripe.data.popitem(last=False)
+                stripe.bytes -= evicted_size
+                stripe.evictions += 1
+            return True
+
+    def delete(self, key):
+        """删除条目（不存在时忽略）"""
+        stripe = self._stripe(key)
+        with stripe.lock:
+            old = stripe.data.pop(key, None)
+            if old is not None:
+                stripe.bytes -= old[1]
+
+    def clear(self, reset_stats=False):
+        """清空缓存（reset_stats=True 时连统计一起清零）"""
+        for stripe in self.stripes:
+            with stripe.lock:
+                stripe.data.clear()
+                stripe.bytes = 0
+                if reset_stats:
+                    stripe.reset_stats()
+
+    def __len__(self):
+        return sum(len(stripe.data) for stripe in self.stripes)
+
+    def get_stats(self):
+        """缓存统计（逐段加锁汇总）"""
+        totals = {'hits': 0, 'misses': 0, 'expired': 0, 'evictions': 0, 'rejected': 0,
+                  'cache_size': 0, 'bytes': 0}
+        for stripe in self.stripes:
+            with stripe.lock:
+                totals['hits'] += stripe.hits
+                totals['misses'] += stripe.misses
+                totals['expired'] += stripe.expired
+                totals['evictions'] += stripe.evictions
+                totals['rejected'] += stripe.rejected
+                totals['cache_size'] += len(stripe.data)
+                totals['bytes'] += stripe.bytes
+
+        total = totals['hits'] + totals['misses']
+        totals['total_queries'] = total
+        totals['hit_rate'] = f"{(totals['hits'] / total * 100) if total else 0:.1f}%"
+        totals['max_bytes'] = self.max_bytes
+        return totals
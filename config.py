@@ -13,13 +13,102 @@ TEMPERATURE = 0.7  # 创造力参数
 # ========== 数据库配置 ==========
 CHROMA_DB_PATH = "./data/chroma_db"    # 向量数据库路径，存放向量数据
 COLLECTION_NAME = "agri_knowledge"     # 集合名称，作用类似于数据库中的表
+EMBEDDING_CACHE_DIR = "./data/embedding_cache"    # 向量缓存目录，按（模型, 内容哈希）缓存，重建知识库时不用重新计算
+KB_VERSION_PATH = "./data/kb_version"    # 知识库版本号文件，每次增删都会加一，多个进程据此让各自的缓存失效
+KB_CHANGES_DIR = "./data/kb_changes"    # 每个版本修改了哪些块（其他进程据此增量更新关键词索引，不用整个重建）
+KB_CHANGE_LOG_SIZE = 1000    # 保留最近多少个版本的修改记录，落后更多的进程在后台整个重建
 
 # ========== RAG配置 ==========
 N_RESULTS = 3 # 检索结果数量
+QUERY_EMBEDDING_CACHE_SIZE = 1024    # 查询向量缓存条数（LRU），相同问题不用再跑一遍模型
+RETRIEVAL_CACHE_SIZE = 256    # 检索结果缓存条数（LRU），知识库有增删时自动失效
+SEARCH_BATCH_MAX = 64    # 批量检索接口一次最多接受的查询数
+SEARCH_N_RESULTS_MAX = 50    # 检索接口每个查询最多返回的结果数（n_results 超过时按此值）
+HYBRID_LEXICAL_WEIGHT = 0.3    # 混合检索时关键词（BM25）得分的权重，其余为向量相似度
 SIMILARITY_THRESHOLD = 0.3 # 相似度阈值,作用是过滤掉不相关的内容，取值范围0-1,值越大，要求越严格
+ANSWER_CACHE_BACKEND = "sqlite"    # 回答缓存后端：sqlite（进程内 + 磁盘两级，所有 worker 共享，重启不丢）/ memory（只用进程内缓存）
+ANSWER_CACHE_PATH = "./data/answer_cache.db"    # SQLite 回答缓存文件
+ANSWER_CACHE_TTL = 7 * 24 * 3600    # 回答缓存过期时间（秒）
+ANSWER_CACHE_MAX_BYTES = 64 * 1024 * 1024    # SQLite 回答缓存总大小上限（字节），超出时淘汰最久未访问的回答
+ANSWER_CACHE_L1_MAX_BYTES = 8 * 1024 * 1024    # 进程内一级缓存总大小上限（字节），按字节而不是条数限制，长回答不会挤掉热门短回答
+ANSWER_CACHE_L1_TTL = 3600    # 进程内一级缓存过期时间（秒），过期后回到共享的二级缓存读取
+ANSWER_CACHE_SYNC_INTERVAL = 1.0    # 一级缓存最多每隔多少秒检查一次其他 worker 是否清空过缓存
+SEMANTIC_CACHE_THRESHOLD = 0.92    # 语义缓存的余弦相似度阈值，问题意思足够接近才复用回答
+SEMANTIC_CACHE_SIZE = 1000    # 语义缓存最多保存的问题数
+CONTEXT_TOKEN_BUDGET = 800    # 提示词里【相关知识】部分的 token 预算，超出时只保留价值最高的句子
+SINGLE_FLIGHT_TIMEOUT = 120    # 相同问题并发到达时，等待正在生成的回答的最长秒数
+WEB_WORKERS = int(os.getenv("WEB_CONCURRENCY", "4"))    # gunicorn worker 进程数（Procfile 的 -w 读同一个环境变量；python app_v2.py 单进程运行时设为1）
+LLM_MAX_CONCURRENCY_TOTAL = 4    # 所有 worker 合计同时进行的大模型调用数上限（按服务商限流额度调整）
+LLM_MAX_CONCURRENCY = max(1, LLM_MAX_CONCURRENCY_TOTAL // WEB_WORKERS)    # 每个进程的上限（调度器只管本进程，按 worker 数平分总额度，至少1）
+LLM_QUEUE_LIMITS = {"interactive": 32, "batch": 8}    # 各优先级最多排队的调用数，超出时接口返回 503
+LLM_QUEUE_TIMEOUT = 30    # 大模型调用最长排队秒数，超时返回 503
+
+# ========== 文档切分配置 ==========
+CHUNK_SIZE = 150    # 每块最大字数，MiniLM 最多读取128个token，超出部分不会被向量化
+CHUNK_OVERLAP = 30  # 相邻块重叠字数，避免关键句被切断
+
+# ========== 批量导入配置 ==========
+KNOWLEDGE_DIR = "./data/knowledge"    # 内置知识文档目录（会递归扫描子目录）
+INGEST_MANIFEST_PATH = "./data/ingest_manifest.json"    # 导入清单，记录每个文件的内容哈希，重复导入时跳过未变化的文件
+INGEST_BATCH_SIZE = 256    # 每批写入向量库的块数
+KNOWN_CROPS = ["小麦", "水稻", "玉米", "大豆", "棉花", "油菜", "马铃薯", "花生"]    # 用于从文件名识别作物
+CROP_ALIASES = {    # 作物别名，用于从问题里识别作物（检索时自动按作物过滤）
+    "小麦": ["麦子", "冬小麦", "春小麦", "麦苗"],
+    "水稻": ["稻谷", "稻子", "稻田", "稻瘟", "稻飞虱"],
+    "玉米": ["苞米", "包谷", "玉蜀黍", "棒子"],
+    "大豆": ["黄豆"],
+    "马铃薯": ["土豆", "洋芋"],
+    "花生": ["落花生"],
+    "棉花": ["棉田", "棉铃"],
+    "油菜": ["菜籽"],
+}
+PDF_PARSE_WORKERS = 1    # 单个大PDF的解析进程数，默认1不开进程池（web 进程里每次解析都开进程池开销太大）；0 表示CPU核数
+PDF_PARALLEL_MIN_PAGES = 40    # PDF页数达到该值且解析进程数大于1时用多进程并行解析
+PDF_PAGES_PER_TASK = 16    # 并行解析时每个任务负责的页数
+
+# ========== 后台导入任务配置 ==========
+INGEST_JOB_WORKERS = 2    # 后台解析文档的线程数
+INGEST_JOB_DIR = "./uploads/jobs"    # 任务状态文件目录（多个 gunicorn 进程共享）
+INGEST_WRITE_BATCH = 256    # 合并写入时每次 upsert 的最大块数
+INGEST_WRITE_LINGER = 0.05    # 合并写入的等待窗口（秒），窗口内到达的小批量会合并成一次写入
+
+# ========== 批量作物分析配置 ==========
+BATCH_ANALYSIS_WORKERS = 4    # 批量分析时同时分析的作物数（实际并发还受 LLM_MAX_CONCURRENCY 限制，不要超过 batch 队列上限）
+BATCH_ANALYSIS_JOB_DIR = "./data/analysis_jobs"    # 批量分析任务状态文件目录（多个 gunicorn 进程共享）
+BATCH_ANALYSIS_RETRIES = 3    # 大模型调度繁忙时单个作物的重试次数
+
+# ========== 列表分页配置（pagination.py）==========
+PAGE_SIZE_DEFAULT = 50    # 列表接口不传 limit 时每页的条数
+PAGE_SIZE_MAX = 200    # 每页最多条数（limit 超过时按此值）
+
+# ========== 作物数据统计配置（growth_stats.py）==========
+CROP_RANGES = {    # 各作物适宜的温度（°C）和空气湿度（%）范围，按作物类型匹配，匹配不到用 default
+    "小麦": {"temperature": (8, 25), "humidity": (45, 80)},
+    "水稻": {"temperature": (18, 32), "humidity": (60, 90)},
+    "玉米": {"temperature": (15, 32), "humidity": (50, 85)},
+    "大豆": {"temperature": (15, 30), "humidity": (50, 85)},
+    "马铃薯": {"temperature": (10, 25), "humidity": (50, 85)},
+    "default": {"temperature": (10, 30), "humidity": (40, 85)},
+}
+STATS_ANOMALY_SPAN = 2    # 连续这么多条记录超出适宜范围算异常（需要大模型分析）
+STATS_SWING_LIMIT = {"temperature": 8, "humidity": 25}    # 相邻两次记录变化超过该值算骤变
+STATS_ROLLING_WINDOW = 3    # 滑动平均的窗口（条）
+# 生长状态里出现这些字样算异常（包括快速记录页的选项“生长缓慢”“需要施肥”“需要浇水”）
+ABNORMAL_STATUS_WORDS = ["病", "虫", "黄", "枯", "萎", "倒伏", "斑", "烂", "差", "缓慢", "需要施肥", "需要浇水", "缺水", "缺肥"]
+
+# ========== 离线压测配置（benchmark.py）==========
+USE_STUB_MODELS = os.getenv("AGRI_STUB_MODELS") == "1"    # 用本地模拟的大模型和向量模型代替通义千问和 HuggingFace 模型（压测/CI，无需联网）
+STUB_EMBEDDING_MODEL = "stub-hash-384"    # 模拟向量模型的名称（向量缓存按模型名分开存放）
+STUB_EMBEDDING_DIM = 384    # 模拟向量的维度（与 MiniLM 相同）
+STUB_EMBEDDING_LATENCY = float(os.getenv("AGRI_STUB_EMBEDDING_LATENCY", "0"))    # 模拟向量模型每次调用的耗时（秒）
+STUB_LLM_LATENCY = float(os.getenv("AGRI_STUB_LLM_LATENCY", "0.3"))    # 模拟大模型返回第一个 token 前的延迟（秒）
+STUB_LLM_TOKENS_PER_SEC = float(os.getenv("AGRI_STUB_LLM_TOKENS_PER_SEC", "50"))    # 模拟大模型的生成速度（token/秒）
+STUB_LLM_ANSWER_TOKENS = int(os.getenv("AGRI_STUB_LLM_ANSWER_TOKENS", "100"))    # 模拟回答的长度（token 数）
 
 # ========== 对话配置 ==========
 MAX_HISTORY = 10  # 最大对话历史长度
+CHAT_HISTORY_PATH = "./data/chat_history.db"    # 网页对话历史（SQLite，所有 worker 共享；流式回答结束时会话 cookie 已经发出，不能再写 session）
+CHAT_HISTORY_TTL = 7 * 24 * 3600    # 对话历史保留时间（秒）
 
 # ========== 提示词配置 ==========
 SYSTEM_PROMPT = (
@@ -81,6 +170,7 @@ def show_config():
     print(f"数据库路径：{CHROMA_DB_PATH}")
     print(f"检索文档数：{N_RESULT}")
     print(f"相似度阈值：{SIMILARITY_THRESHOLD}")
+    print(f"大模型并发：每个进程{LLM_MAX_CONCURRENCY}，共{WEB_WORKERS}个 worker（总额度{LLM_MAX_CONCURRENCY_TOTAL}）")
     print(f"记忆窗口：{MAX_HISTORY}轮")
     print("="*60)
 
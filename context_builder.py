@@ -0,0 +1,141 @@
+# context_builder.py - 上下文组装模块
+# 功能：把检索结果整理成提示词里的【相关知识】
+#       过滤低相似度结果、去掉重叠块里的重复句子，按价值挑句子直到 token 预算用完
+
+import re
+
+from config import CONTEXT_TOKEN_BUDGET, SIMILARITY_THRESHOLD
+from lexical_index import tokenize
+from text_splitter import SENTENCE_PATTERN
+
+_CJK_RE = re.compile(r'[\u4e00-\u9fff]')
+
+
+def estimate_tokens(text):
+    """
+    粗略估计 token 数（汉字约 1 token/字，其他字符约 4 字符/token，偏保守）
+
+    参数:
+        text: 文本
+
+    返回:
+        估计的 token 数
+    """
+    cjk = len(_CJK_RE.findall(text))
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+def split_sentences(content):
+    """
+    把块内容拆成句子
+
+    返回:
+        [(行号, 句子)]
+    """
+    sentences = []
+    for line_no, line in enumerate(content.split('\n')):
+        for sentence in SENTENCE_PATTERN.findall(line.strip()):
+            if sentence.strip():
+                sentences.append((line_no, sentence.strip()))
+    return sentences
+
+
+def _relevance(doc):
+    """结果的相关度：向量相似度和关键词得分取较高者（精确命中农药名等关键词的块不会被阈值误删）"""
+    return max(doc.get('similarity', 0.0), doc.get('lexical_score', 0.0))
+
+
+def _doc_header(index, doc):
+    """文档标题，如 【文档1 - 小麦 · 病虫害防治】"""
+    meta = doc.get('metadata') or {}
+    header = f"【文档{index} - {meta.get('crop', '未分类')}"
+    if meta.get('section'):
+        header += f" · {meta['section']}"
+    return header + "】"
+
+
+def build_context(question, docs, token_budget=CONTEXT_TOKEN_BUDGET, threshold=SIMILARITY_THRESHOLD):
+    """
+    组装上下文
+
+    1. 丢掉相关度低于阈值的结果
+    2. 按句子去重（相邻块的重叠部分、重复上传的内容只保留一次）
+    3. 句子价值 = 所在结果的相关度 ×（0.6 + 0.4 × 与问题的词重合度），
+       从高到低挑选，直到 token 预算用完
+    4. 选中的句子按原文顺序拼回各自的文档
+
+    参数:
+        question: 用户问题
+        docs: 检索结果列表（KnowledgeBase.search 的返回值，按相关度排序）
+        token_budget: 上下文 token 预算
+        threshold: 相似度阈值
+
+    返回:
+        (上下文文本, 统计信息字典)
+    """
+    kept = [doc for doc in docs if _relevance(doc) >= threshold]
+    question_terms = set(tokenize(question))
+
+    info = {
+        "retrieved": len(docs),
+        "below_threshold": len(docs) - len(kept),
+        "duplicate_sentences": 0,
+        "documents": 0,
+        "sentences": 0,
+        "tokens": 0,
+        "token_budget": token_budget
+    }
+
+    # 候选句子：(价值, 结果序号, 句子序号, 行号, 句子, token数)
+    candidates = []
+    seen = set()
+    for rank, doc in enumerate(kept):
+        relevance = _relevance(doc)
+        section = (doc.get('metadata') or {}).get('section', '')
+
+        for position, (line_no, sentence) in enumerate(split_sentences(doc['content'])):
+            # 块开头的章节路径已经放在文档标题里
+            if position == 0 and section and sentence == section:
+                continue
+
+            key = ''.join(sentence.split())
+            if key in seen:
+                info["duplicate_sentences"] += 1
+                continue
+            seen.add(key)
+
+            terms = set(tokenize(sentence))
+            overlap = len(terms & question_terms) / len(question_terms) if question_terms else 0.0
+            value = relevance * (0.6 + 0.4 * overlap)
+            candidates.append((value, rank, position, line_no, sentence, estimate_tokens(sentence)))
+
+    # 按价值挑句子；文档第一次被选中时把标题的 token 也算进预算
+    selected = {}
+    used = 0
+    for value, rank, position, line_no, sentence, tokens in sorted(candidates, key=lambda c: (-c[0], c[1], c[2])):
+        cost = tokens + (0 if rank in selected else estimate_tokens(_doc_header(rank + 1, kept[rank])) + 2)
+        if used + cost > token_budget:
+            continue
+        selected.setdefault(rank, []).append((position, line_no, sentence))
+        used += cost
+
+    # 按结果顺序、句子原文顺序输出；不连续的句子之间用省略号隔开
+    blocks = []
+    for index, rank in enumerate(sorted(selected), 1):
+        parts = []
+        previous = None
+        for position, line_no, sentence in sorted(selected[rank]):
+            if previous is not None:
+                if position != previous[0] + 1:
+                    parts.append("……")
+                elif line_no != previous[1]:
+                    parts.append("\n")
+            parts.append(sentence)
+            previous = (position, line_no)
+        blocks.append(f"{_doc_header(index, kept[rank])}\n{''.join(parts)}")
+
+    context = "\n\n".join(blocks)
+    info["documents"] = len(blocks)
+    info["sentences"] = sum(len(items) for items in selected.values())
+    info["tokens"] = estimate_tokens(context)
+    return context, info
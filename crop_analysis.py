@@ -0,0 +1,582 @@
+# crop_analysis.py - 作物AI分析
+# 功能：快速分析（单个作物接口和批量任务共用）：先用 growth_stats 做统计，
+#       数据正常时直接返回统计结果（毫秒级），有异常或用户要求文字解读时才调用大模型
+#       批量任务：选出所有“生长中”的作物，用有上限的线程池并发调用大模型，
+#       分析结果在一个事务里批量写入分析历史，每个作物的进度可随时查询
+#       每条分析历史记下数据指纹，数据没有变化时直接复用上次的分析
+#       同一时间只允许一个批量任务（任务目录里的文件锁，多个 gunicorn worker 和命令行之间也互斥）
+#
+# 用法：
+#   python crop_analysis.py                  # 分析所有生长中的作物（最近7天数据）
+#   python crop_analysis.py --days 14 --workers 8
+
+import hashlib
+import json
+import os
+import re
+import sys
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime
+
+from sqlalchemy import func
+
+from config import BATCH_ANALYSIS_WORKERS, BATCH_ANALYSIS_JOB_DIR, BATCH_ANALYSIS_RETRIES, ABNORMAL_STATUS_WORDS
+from growth_stats import STATS_VERSION, compute_stats, rule_based_analysis, stats_summary
+from llm_scheduler import SchedulerBusy
+from models import db, Crop, DailyRecord, CropEvent, AnalysisHistory
+
+try:
+    import fcntl  # 多个 gunicorn worker 之间用文件锁保证只有一个批量任务，Windows 上没有就只检查本进程
+except ImportError:
+    fcntl = None
+
+
+# ===== 快速分析（单个作物）=====
+
+def build_quick_prompt(crop, records, days, stats=None):
+    """
+    构建快速分析的提示词
+
+    参数:
+        crop: Crop 对象
+        records: 最近的 DailyRecord 列表（按日期倒序）
+        days: 分析的天数
+        stats: 可选，compute_stats 的统计结果（会作为参考放进提示词）
+
+    返回:
+        提示词
+    """
+    temps = [r.temperature for r in records if r.temperature]
+    humidities = [r.humidity for r in records if r.humidity]
+
+    avg_temp = sum(temps) / len(temps) if temps else 0
+    avg_humidity = sum(humidities) / len(humidities) if humidities else 0
+
+    records_text = "\n".join([
+        f"{r.date.strftime('%Y-%m-%d')}: 温度{r.temperature}°C, 湿度{r.humidity}%, " +
+        f"天气{r.weather or '未知'}, 状态{r.growth_status or '未记录'}"
+        for r in reversed(records)
+    ])
+
+    stats_text = f"\n【统计分析】\n{stats_summary(stats)}\n" if stats else ""
+
+    return f"""
+你是农宝🌾，一位专业的农业AI助手。请对以下作物进行快速分析：
+
+【作物信息】
+名称：{crop.name}
+类型：{crop.crop_type}
+品种：{crop.variety or '未知'}
+生长天数：{crop.get_growth_days()}天
+
+【最近{days}天数据】
+{records_text}
+
+平均温度：{avg_temp:.1f}°C
+平均湿度：{avg_humidity:.1f}%
+{stats_text}
+请从以下3个维度分析，并以JSON格式返回：
+
+{{
+    "growth_evaluation": "生长评估文字（50-80字）",
+    "growth_score": 85,
+    "fertilizer_advice": "施肥建议文字（50-80字）",
+    "fertilizer_suggestions": ["具体建议1", "具体建议2"],
+    "pest_prediction": "病虫害预测文字（50-80字）",
+    "pest_risk": "低"
+}}
+
+要求：
+1. 评估要客观，基于数据
+2. 建议要具体可行
+3. 语言要通俗易懂
+4. 不要使用markdown格式
+
+请直接返回JSON，不要其他内容。
+"""
+
+
+def parse_quick_analysis(result_text, fallback=None):
+    """
+    把模型返回的文本解析成分析结果字典
+
+    参数:
+        result_text: 模型返回的文本
+        fallback: 统计得出的分析结果；模型没有返回有效 JSON 或缺少字段时用它补齐
+
+    返回:
+        分析结果字典
+    """
+    analysis = None
+    json_match = re.search(r'\{[\s\S]*\}', result_text)
+    if json_match:
+        try:
+            analysis = json.loads(json_match.group())
+        except ValueError:
+            analysis = None
+
+    if fallback is not None:
+        if not isinstance(analysis, dict):
+            analysis = {"growth_evaluation": result_text[:100]}
+        return {**fallback, **analysis, "source": "大模型"}
+
+    if isinstance(analysis, dict):
+        return analysis
+    return {
+        "growth_evaluation": result_text[:100],
+        "growth_score": 75,
+        "fertilizer_advice": "建议根据作物生长阶段适时施肥",
+        "fertilizer_suggestions": ["观察作物长势", "适时追肥"],
+        "pest_prediction": "当前风险较低，注意观察",
+        "pest_risk": "低"
+    }
+
+
+def prepare_analysis(crop, records, days, narrative=False):
+    """
+    统计分析，判断是否需要调用大模型
+
+    参数:
+        crop: Crop 对象
+        records: 最近的 DailyRecord 列表（按日期倒序）
+        days: 分析的天数
+        narrative: 用户明确要求大模型的文字解读
+
+    返回:
+        (统计得出的分析结果, 提示词)；数据正常且不要求文字解读时提示词为 None，直接使用统计结果
+    """
+    stats = compute_stats(records, crop.crop_type)
+    baseline = rule_based_analysis(crop, stats)
+    if not stats["anomalies"] and not narrative:
+        return baseline, None
+    return baseline, build_quick_prompt(crop, records, days, stats)
+
+
+def data_fingerprint(crop, records, days, narrative=False):
+    """
+    分析所用数据的指纹
+
+    包括作物基本信息、窗口内每条记录的内容（记录被修改也能发现）、事件数和最新事件ID、分析参数，
+    以及统计规则的版本（规则改了旧结果不再复用）。
+    不包括生长天数，同样的数据隔天再分析也会复用。
+
+    参数:
+        crop: Crop 对象
+        records: 参与分析的 DailyRecord 列表
+        days: 分析的天数
+        narrative: 是否要求大模型的文字解读
+
+    返回:
+        40 位十六进制字符串
+    """
+    event_count, last_event = db.session.query(func.count(CropEvent.id), func.max(CropEvent.id))\
+        .filter(CropEvent.crop_id == crop.id).one()
+    payload = {
+        "crop": [crop.name, crop.crop_type, crop.variety, crop.status],
+        "records": [[r.id, r.date.isoformat() if r.date else None, r.temperature, r.humidity,
+                     r.weather, r.growth_status] for r in records],
+        "events": [event_count, last_event],
+        "days": days,
+        "narrative": bool(narrative),
+        "rules": [STATS_VERSION, ABNORMAL_STATUS_WORDS]
+    }
+    return hashlib.sha1(json.dumps(payload, ensure_ascii=False, default=str).encode('utf-8')).hexdigest()
+
+
+def find_reusable(crop_id, fingerprint):
+    """数据指纹相同的最近一次分析历史（没有时返回 None）"""
+    return AnalysisHistory.query.filter_by(crop_id=crop_id, data_fingerprint=fingerprint)\
+        .order_by(AnalysisHistory.id.desc()).first()
+
+
+def make_history(crop_id, analysis_json, analysis_type='快速分析', fingerprint=None):
+    """根据分析结果创建 AnalysisHistory 对象（未加入会话）"""
+    return AnalysisHistory(
+        crop_id=crop_id,
+        analysis_type=analysis_type,
+        growth_evaluation=analysis_json.get('growth_evaluation', ''),
+        growth_score=analysis_json.get('growth_score', 0),
+        fertilizer_advice=analysis_json.get('fertilizer_advice', ''),
+        pest_prediction=analysis_json.get('pest_prediction', ''),
+        pest_risk=analysis_json.get('pest_risk', '低'),
+        full_analysis=json.dumps(analysis_json, ensure_ascii=False),
+        data_fingerprint=fingerprint
+    )
+
+
+def recent_records(crop_id, days):
+    """作物最近 days 条每日记录（按日期倒序）"""
+    return DailyRecord.query.filter_by(crop_id=crop_id)\
+        .order_by(DailyRecord.date.desc())\
+        .limit(days).all()
+
+
+# ===== 批量分析 =====
+
+class BatchAnalysisRunning(Exception):
+    """已有批量分析任务在执行（接口返回 409）"""
+
+    def __init__(self, job_id):
+        super().__init__("已有批量分析任务在执行")
+        self.job_id = job_id
+
+
+class BatchAnalysisJob:
+    """一次批量分析任务的状态"""
+
+    def __init__(self, days, narrative=False, force=False):
+        self.id = uuid.uuid4().hex
+        self.days = days
+        self.narrative = narrative  # 所有作物都调用大模型生成文字解读
+        self.force = force          # 数据没变也重新分析
+        self.fingerprints = {}      # 作物ID → 数据指纹（写入分析历史）
+        self.status = 'queued'      # queued / running / done / failed
+        self.crops = {}             # 作物ID → 单个作物的进度（发布后只在 BatchAnalyzer.lock 下修改）
+        self.saved = 0              # 写入的分析历史条数
+        self.error = None
+        self.created_at = datetime.now()
+        self.started_at = None
+        self.finished_at = None
+        self.lock_file = None       # 任务执行期间持有的运行锁（见 BatchAnalyzer._acquire）
+
+    def to_dict(self):
+        fmt = lambda t: t.strftime('%Y-%m-%d %H:%M:%S') if t else None
+        counts = {}
+        for item in self.crops.values():
+            counts[item['status']] = counts.get(item['status'], 0) + 1
+        return {
+            'job_id': self.id,
+            'days': self.days,
+            'narrative': self.narrative,
+            'force': self.force,
+            'status': self.status,
+            'total': len(self.crops),
+            'counts': counts,           # 各状态的作物数：queued / running / done / failed / skipped
+            'saved': self.saved,
+            'crops': [dict(item) for item in self.crops.values()],
+            'error': self.error,
+            'created_at': fmt(self.created_at),
+            'started_at': fmt(self.started_at),
+            'finished_at': fmt(self.finished_at)
+        }
+
+
+class BatchAnalyzer:
+    """批量作物分析（后台线程执行，任务状态写入文件，多个 worker 都能查询）"""
+
+    def __init__(self, app, rag, workers=BATCH_ANALYSIS_WORKERS, job_dir=BATCH_ANALYSIS_JOB_DIR):
+        """
+        参数:
+            app: Flask 应用（后台线程里需要应用上下文访问数据库）
+            rag: RAGEngine 实例（调用大模型，经过调度器和请求合并）
+            workers: 同时分析的作物数
+            job_dir: 任务状态文件目录
+        """
+        self.app = app
+        self.rag = rag
+        self.workers = workers
+        self.job_dir = job_dir
+        self.jobs = {}
+        self.lock = threading.Lock()
+        self.run_lock_path = os.path.join(job_dir, "running.lock")
+
+        os.makedirs(job_dir, exist_ok=True)
+
+    def running_job(self):
+        """本进程中正在执行的任务（没有时返回 None）"""
+        with self.lock:
+            for job in self.jobs.values():
+                if job.status in ('queued', 'running'):
+                    return job
+        return None
+
+    def _acquire(self, job):
+        """
+        拿到运行锁（非阻塞的 flock，进程退出时自动释放），锁文件里写上任务ID
+
+        异常:
+            BatchAnalysisRunning: 本进程或其他进程已有任务在执行
+        """
+        running = self.running_job()
+        if running and running is not job:
+            raise BatchAnalysisRunning(running.id)
+
+        lock_file = open(self.run_lock_path, 'a+', encoding='utf-8')
+        if fcntl:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                lock_file.seek(0)
+                job_id = lock_file.read().strip()
+                lock_file.close()
+                raise BatchAnalysisRunning(job_id)
+
+        lock_file.seek(0)
+        lock_file.truncate()
+        lock_file.write(job.id)
+        lock_file.flush()
+        job.lock_file = lock_file
+
+    @staticmethod
+    def _release(job):
+        if job.lock_file is not None:
+            job.lock_file.close()    # 关闭文件即释放 flock
+            job.lock_file = None
+
+    def submit(self, days=7, narrative=False, force=False):
+        """
+        提交批量分析任务（后台执行，立即返回）
+
+        参数:
+            days: 每个作物分析最近几条记录
+            narrative: 所有作物都调用大模型（否则只分析有异常的作物）
+            force: 数据没有变化的作物也重新分析
+
+        返回:
+            BatchAnalysisJob
+
+        异常:
+            BatchAnalysisRunning: 已有任务在执行（包括其他 worker 进程和命令行）
+        """
+        job = BatchAnalysisJob(days, narrative, force)
+        self._acquire(job)
+        with self.lock:
+            self.jobs[job.id] = job
+        self._save(job, throttle=False)
+        threading.Thread(target=self.run, args=(job,), name=f"batch-analysis-{job.id[:8]}", daemon=True).start()
+        return job
+
+    def get(self, job_id):
+        """查询任务状态（本进程没有时从状态文件读取）"""
+        with self.lock:
+            job = self.jobs.get(job_id)
+            if job:
+                return job.to_dict()
+
+        path = self._job_path(job_id)
+        if os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        return None
+
+    def run(self, job, progress=None):
+        """
+        执行批量分析
+
+        1. 选出所有“生长中”的作物，读取最近的记录做统计（数据库只在本线程访问）；
+           数据没变的作物复用上次的分析，数据正常的作物直接用统计结果
+        2. 有异常的作物用线程池并发调用大模型（调度器繁忙时按 Retry-After 等待后重试）
+        3. 全部完成后在一个事务里批量写入分析历史
+
+        参数:
+            job: BatchAnalysisJob
+            progress: 可选回调 progress(job, item, 已完成数, 总数)，每个作物完成时调用
+
+        返回:
+            job
+
+        异常:
+            BatchAnalysisRunning: 直接调用（命令行）时已有任务在执行
+        """
+        if job.lock_file is None:
+            self._acquire(job)
+        job.status = 'running'
+        job.started_at = datetime.now()
+
+        try:
+            with self.app.app_context():
+                prompts, results = self._prepare(job)
+                self._save(job, throttle=False)
+
+                self._analyze(job, prompts, results, progress)
+                self._store(job, results)
+            job.status = 'done'
+        except Exception as e:
+            job.status = 'failed'
+            job.error = str(e)
+            print(f"❌ 批量分析失败（{job.id}）：{e}")
+        finally:
+            job.finished_at = datetime.now()
+            self._save(job, throttle=False)
+            self._release(job)
+        return job
+
+    def _prepare(self, job):
+        """
+        读取作物和记录并做统计
+
+        返回:
+            (需要大模型的 {作物ID: (统计结果, 提示词)}, 直接用统计结果的 {作物ID: 分析结果})
+            复用上次分析的作物不在两者之中
+        """
+        prompts = {}
+        results = {}
+        items = {}      # 全部统计完再一次发布到 job.crops，查询线程不会看到正在增长的字典
+        reused = 0
+        crops = Crop.query.filter_by(status='生长中').order_by(Crop.id).all()
+        for crop in crops:
+            item = {'crop_id': crop.id, 'name': crop.name, 'status': 'queued', 'source': None,
+                    'growth_score': None, 'pest_risk': None, 'error': None}
+            items[crop.id] = item
+
+            records = recent_records(crop.id, job.days)
+            if not records:
+                item['status'] = 'skipped'
+                item['error'] = '没有每日记录'
+                continue
+
+            fingerprint = data_fingerprint(crop, records, job.days, job.narrative)
+            previous = None if job.force else find_reusable(crop.id, fingerprint)
+            if previous:
+                reused += 1
+                item.update(status='done', source='复用', growth_score=previous.growth_score,
+                            pest_risk=previous.pest_risk)
+                continue
+            job.fingerprints[crop.id] = fingerprint
+
+            baseline, prompt = prepare_analysis(crop, records, job.days, job.narrative)
+            if prompt is None:
+                results[crop.id] = baseline
+                item.update(status='done', source='统计', growth_score=baseline['growth_score'],
+                            pest_risk=baseline['pest_risk'])
+            else:
+                prompts[crop.id] = (baseline, prompt)
+
+        with self.lock:
+            job.crops = items
+
+        print(f"📋 批量分析：{len(crops)} 个生长中的作物，{reused} 个数据没变（复用上次分析），"
+              f"{len(results)} 个数据正常（不调用大模型），"
+              f"{len(prompts)} 个需要大模型分析")
+        return prompts, results
+
+    def _invoke(self, prompt):
+        """调用大模型（调度器饱和时等待 Retry-After 秒后重试）"""
+        for attempt in range(BATCH_ANALYSIS_RETRIES + 1):
+            try:
+                return self.rag.invoke_shared(prompt, priority="batch")
+            except SchedulerBusy as busy:
+                if attempt == BATCH_ANALYSIS_RETRIES:
+                    raise
+                time.sleep(busy.retry_after)
+
+    def _analyze(self, job, prompts, results, progress):
+        """并发调用大模型分析，结果写入 results（{作物ID: 分析结果}）"""
+        def analyze(crop_id):
+            with self.lock:
+                job.crops[crop_id]['status'] = 'running'
+            baseline, prompt = prompts[crop_id]
+            return parse_quick_analysis(self._invoke(prompt), fallback=baseline)
+
+        finished = 0
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="analysis") as executor:
+            futures = {executor.submit(analyze, crop_id): crop_id for crop_id in prompts}
+            for future in as_completed(futures):
+                crop_id = futures[future]
+                item = job.crops[crop_id]
+                try:
+                    results[crop_id] = future.result()
+                    with self.lock:
+                        item.update(status='done', source='大模型',
+                                    growth_score=results[crop_id].get('growth_score'),
+                                    pest_risk=results[crop_id].get('pest_risk'))
+                except Exception as e:
+                    with self.lock:
+                        item.update(status='failed', error=str(e))
+
+                finished += 1
+                if progress:
+                    progress(job, item, finished, len(prompts))
+                self._save(job)
+
+    def _store(self, job, results):
+        """在一个事务里批量写入分析历史（分析期间被删除的作物跳过）"""
+        if not results:
+            return
+
+        existing = {crop_id for (crop_id,) in
+                    db.session.query(Crop.id).filter(Crop.id.in_(list(results))).all()}
+        histories = [make_history(crop_id, analysis, '批量分析', job.fingerprints.get(crop_id))
+                     for crop_id, analysis in results.items() if crop_id in existing]
+
+        try:
+            db.session.add_all(histories)
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+
+        job.saved = len(histories)
+        print(f"💾 已写入 {len(histories)} 条分析历史")
+
+    # ===== 状态持久化 =====
+
+    def _job_path(self, job_id):
+        # 任务ID是 uuid hex，过滤掉其他字符防止路径穿越
+        safe_id = ''.join(c for c in job_id if c.isalnum())
+        return os.path.join(self.job_dir, f"{safe_id}.json")
+
+    def _save(self, job, throttle=True):
+        """原子写入任务状态文件（进度更新最多每0.5秒写一次）"""
+        now = time.monotonic()
+        if throttle and now - getattr(job, '_saved_at', 0) < 0.5:
+            return
+        job._saved_at = now
+
+        path = self._job_path(job.id)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with self.lock:
+            data = job.to_dict()
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+
+def main(argv=None):
+    """命令行入口：同步执行一次批量分析并逐个打印作物进度"""
+    import argparse
+
+    parser = argparse.ArgumentParser(description="批量分析所有生长中的作物")
+    parser.add_argument("--days", type=int, default=7, help="每个作物分析最近几天的记录，默认 %(default)s")
+    parser.add_argument("--workers", type=int, default=BATCH_ANALYSIS_WORKERS, help="同时分析的作物数，默认 %(default)s")
+    parser.add_argument("--narrative", action="store_true", help="所有作物都调用大模型生成文字解读（默认只分析数据异常的作物）")
+    parser.add_argument("--force", action="store_true", help="数据没有变化的作物也重新分析（默认复用上次的分析）")
+    args = parser.parse_args(argv)
+
+    from app_v2 import app, rag
+
+    def progress(job, item, finished, total):
+        """只有调用大模型的作物会逐个回调，数据正常的作物在最后一起列出"""
+        if item['status'] == 'done':
+            print(f"✅ [{finished}/{total}] {item['name']}：评分 {item['growth_score']}，病虫害风险 {item['pest_risk']}")
+        else:
+            print(f"❌ [{finished}/{total}] {item['name']}：{item['error']}")
+
+    started = time.time()
+    analyzer = BatchAnalyzer(app, rag, workers=args.workers)
+    try:
+        job = analyzer.run(BatchAnalysisJob(args.days, args.narrative, args.force), progress=progress)
+    except BatchAnalysisRunning as running:
+        print(f"❌ {running}（任务ID：{running.job_id}），请等它完成后再运行")
+        return 1
+    summary = job.to_dict()
+
+    for item in summary['crops']:
+        if item['source'] == '统计':
+            print(f"📊 {item['name']}：评分 {item['growth_score']}，病虫害风险 {item['pest_risk']}（数据正常，未调用大模型）")
+
+    print("\n" + "="*60)
+    print("📊 批量分析完成" if job.status == 'done' else f"❌ 批量分析失败：{job.error}")
+    print(f"  作物数：{summary['total']}  " + "  ".join(f"{k}：{v}" for k, v in summary['counts'].items()))
+    print(f"  写入分析历史：{job.saved} 条")
+    print(f"  耗时：{time.time() - started:.1f}秒")
+    print("="*60)
+
+    return 0 if job.status == 'done' and not summary['counts'].get('failed') else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
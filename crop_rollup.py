@@ -0,0 +1,419 @@
+# crop_rollup.py - 作物统计汇总表
+# 功能：每个作物一行汇总（记录数、温湿度的累计和/条数/最值、最新7条记录、事件数），
+#       每日记录增删改时在同一个事务里更新，作物列表和详情直接读汇总，不用每次扫描全部记录
+#       新增记录增量更新；修改、删除记录时按原始数据重算该作物（这两种操作很少）
+#       作物收获（填了实际收获日期）后本季统计（温湿度的和/条数/最值）冻结：只统计收获日及之前的记录，
+#       收获后的新记录不再计入（补录、修改季内的记录仍会更新，与重建结果一致）；
+#       记录数、最新记录和最近7条平均始终包含全部记录，与作物详情里的记录列表一致
+#       增量更新前先锁住并重新读取汇总行，多个进程/会话同时写同一作物的记录时不会互相覆盖
+#       models.py（app_v2）和 database.py（web_app 旧版）各有一张 crop_stats 表，都用这里的实现
+#       直接改数据库、批量导入绕过了 ORM 时，用命令行检查或重建：
+#
+# 用法：
+#   python crop_rollup.py                # 重建 app_v2 数据库所有作物的汇总
+#   python crop_rollup.py --check        # 只检查汇总是否与原始数据一致，不修改
+#   python crop_rollup.py --crop 12      # 只重建一个作物
+#   python crop_rollup.py --v1           # 旧版 web_app 的数据库
+
+import json
+import sys
+from collections import Counter
+from datetime import date, datetime
+
+from sqlalchemy import Column, DateTime, Float, Integer, Text, event, func, inspect
+
+# 汇总里保留的最新记录条数（作物卡片上的“最近7条平均”）
+RECENT_SIZE = 7
+
+# 汇总的指标（与 DailyRecord / DataRecord 的字段名相同）
+FIELDS = ("temperature", "humidity")
+
+
+class CropStatsMixin:
+    """
+    作物汇总表的公共列（各模型自己定义 crop_id 主键和外键）
+
+    温湿度为 0 或空时视为未填写，不计入和、条数和最值（与原来 to_dict 里的平均值算法一致）。
+    和、条数、最值是本季统计，收获后冻结；record_count 和 recent 统计全部记录。
+    """
+
+    record_count = Column(Integer, nullable=False, default=0)
+    event_count = Column(Integer, nullable=False, default=0)
+
+    temperature_sum = Column(Float, nullable=False, default=0.0)
+    temperature_count = Column(Integer, nullable=False, default=0)
+    temperature_min = Column(Float)
+    temperature_max = Column(Float)
+
+    humidity_sum = Column(Float, nullable=False, default=0.0)
+    humidity_count = Column(Integer, nullable=False, default=0)
+    humidity_min = Column(Float)
+    humidity_max = Column(Float)
+
+    # 最新的 RECENT_SIZE 条记录（JSON：[[日期, 记录ID, 温度, 湿度], ...]，新的在前）
+    recent = Column(Text)
+
+    frozen_at = Column(DateTime)    # 本季统计冻结的时间（收获后），为空表示还在生长
+    updated_at = Column(DateTime)
+
+    def reset(self):
+        """清空汇总（新建汇总行时调用，列默认值要到写入数据库时才生效）"""
+        self.record_count = 0
+        self.event_count = 0
+        for field in FIELDS:
+            setattr(self, f"{field}_sum", 0.0)
+            setattr(self, f"{field}_count", 0)
+            setattr(self, f"{field}_min", None)
+            setattr(self, f"{field}_max", None)
+        self.recent = "[]"
+        self.frozen_at = None
+
+    def add_record(self, record_date, record_id, values, in_season=True):
+        """
+        增量计入一条新记录
+
+        参数:
+            record_date: 记录日期（date 或 YYYY-MM-DD 字符串）
+            record_id: 记录ID（同一天有多条时新的排在前面）
+            values: {"temperature": ..., "humidity": ...}
+            in_season: 是否计入本季统计（收获后的记录为 False，只更新记录数和最新记录）
+        """
+        self.record_count += 1
+        if in_season:
+            for field in FIELDS:
+                value = values.get(field)
+                if not value:
+                    continue
+                setattr(self, f"{field}_sum", getattr(self, f"{field}_sum") + value)
+                setattr(self, f"{field}_count", getattr(self, f"{field}_count") + 1)
+                low, high = getattr(self, f"{field}_min"), getattr(self, f"{field}_max")
+                setattr(self, f"{field}_min", value if low is None else min(low, value))
+                setattr(self, f"{field}_max", value if high is None else max(high, value))
+
+        entries = json.loads(self.recent or "[]")
+        # 与从数据库读出的 Float 列一致（0 存成 0.0），重建和检查时结果相同
+        entries.append([_date_key(record_date), record_id] +
+                       [None if values.get(field) is None else float(values[field]) for field in FIELDS])
+        entries.sort(key=lambda entry: (entry[0], entry[1]), reverse=True)
+        self.recent = json.dumps(entries[:RECENT_SIZE])
+        self.updated_at = datetime.now()
+
+
+def _date_key(value):
+    return value.isoformat() if isinstance(value, (date, datetime)) else value
+
+
+def _average(values):
+    values = [v for v in values if v]
+    return round(sum(values) / len(values), 1) if values else None
+
+
+def summarize(stats):
+    """
+    汇总行转成 to_dict 用的字段
+
+    参数:
+        stats: 汇总对象，或带同名列的查询结果行；为 None（还没有汇总）时按没有记录处理
+
+    返回:
+        字典：record_count、event_count、最近7条平均、最新记录（都含收获后的记录）、本季统计（season，收获后冻结）
+    """
+    recent = json.loads(stats.recent or "[]") if stats is not None else []
+    latest = recent[0] if recent else None
+    season = {"frozen": bool(stats is not None and stats.frozen_at)}
+    for field in FIELDS:
+        count = getattr(stats, f"{field}_count", None) or 0
+        season[f"avg_{field}"] = round(getattr(stats, f"{field}_sum") / count, 1) if count else None
+        for name in ("min", "max"):
+            value = getattr(stats, f"{field}_{name}", None)
+            season[f"{name}_{field}"] = round(value, 1) if value is not None else None
+
+    return {
+        "record_count": getattr(stats, "record_count", None) or 0,
+        "event_count": getattr(stats, "event_count", None) or 0,
+        "avg_temperature_7d": _average([entry[2] for entry in recent]),
+        "avg_humidity_7d": _average([entry[3] for entry in recent]),
+        "latest_temperature": latest[2] if latest else None,
+        "latest_humidity": latest[3] if latest else None,
+        "latest_date": latest[0] if latest else None,
+        "season": season
+    }
+
+
+class Rollup:
+    """
+    维护一个数据库的作物汇总表
+
+    install() 之后，会话每次 flush 时收集新增/修改/删除的记录、事件和作物，
+    flush 完成后更新汇总对象，汇总的改动在同一次提交里写入。
+    更新前用 SELECT ... FOR UPDATE 重新读取汇总行（SQLite 在 flush 写入记录时已经拿到写锁），
+    不会用会话里缓存的旧汇总覆盖其他进程刚提交的更新。
+    """
+
+    def __init__(self, stats_model, record_model, crop_model, crop_key="crop_id",
+                 event_model=None, harvest_key=None):
+        """
+        参数:
+            stats_model: 汇总模型（继承 CropStatsMixin，主键为 crop_id）
+            record_model: 每日记录模型（有 date、temperature、humidity 列）
+            crop_model: 作物模型
+            crop_key: 记录表里指向作物的列名
+            event_model: 事件模型（有 crop_id 列），没有事件表时为 None
+            harvest_key: 作物的实际收获日期列名，有值时本季统计冻结；为 None 表示不冻结
+        """
+        self.stats_model = stats_model
+        self.record_model = record_model
+        self.crop_model = crop_model
+        self.crop_key = crop_key
+        self.event_model = event_model
+        self.harvest_key = harvest_key
+        self._info_key = f"crop_rollup:{stats_model.__tablename__}"
+
+    def install(self, session):
+        """在会话（Flask-SQLAlchemy 的 db.session）上注册 flush 事件"""
+        event.listen(session, "after_flush", self._collect)
+        event.listen(session, "after_flush_postexec", self._apply)
+
+    # ===== flush 事件 =====
+
+    def _collect(self, session, flush_context):
+        """flush 刚写完、对象状态还没重置时，记下哪些作物的汇总要更新"""
+        pending = session.info.setdefault(self._info_key, {
+            "added": [],            # (作物ID, 日期, 记录ID, 温湿度)：增量计入
+            "records": set(),       # 记录被修改或删除：按原始数据重算
+            "crops": set(),         # 新作物或收获日期变了：重算并更新冻结状态
+            "events": Counter()     # 事件数的增减
+        })
+        crop_key = self.crop_key
+
+        for obj in session.new:
+            if isinstance(obj, self.record_model):
+                values = {field: getattr(obj, field) for field in FIELDS}
+                pending["added"].append((getattr(obj, crop_key), obj.date, obj.id, values))
+            elif self.event_model is not None and isinstance(obj, self.event_model):
+                pending["events"][obj.crop_id] += 1
+            elif isinstance(obj, self.crop_model):
+                pending["crops"].add(obj.id)
+
+        for obj in session.deleted:
+            if isinstance(obj, self.record_model):
+                pending["records"].add(getattr(obj, crop_key))
+            elif self.event_model is not None and isinstance(obj, self.event_model):
+                pending["events"][obj.crop_id] -= 1
+
+        for obj in session.dirty:
+            if isinstance(obj, self.record_model):
+                if not session.is_modified(obj, include_collections=False):
+                    continue
+                pending["records"].add(getattr(obj, crop_key))
+                # 记录换了作物：原来的作物也要重算
+                pending["records"].update(v for v in inspect(obj).attrs[crop_key].history.deleted if v)
+            elif isinstance(obj, self.crop_model) and self.harvest_key:
+                if inspect(obj).attrs[self.harvest_key].history.has_changes():
+                    pending["crops"].add(obj.id)
+
+    def _apply(self, session, flush_context):
+        """更新汇总对象（改动会在同一次提交的下一轮 flush 里写入）"""
+        pending = session.info.pop(self._info_key, None)
+        if not pending:
+            return
+
+        rebuilt = set()
+        for crop_id in pending["crops"] | pending["records"]:
+            self.rebuild(session, crop_id)
+            rebuilt.add(crop_id)
+
+        # 每个作物的汇总行只锁定、重新读取一次（同一次 flush 可能有多条记录）
+        locked = {}
+
+        for crop_id, record_date, record_id, values in pending["added"]:
+            if crop_id in rebuilt:
+                continue    # 重算时已经包含这条记录
+            if crop_id not in locked:
+                locked[crop_id] = self._lock(session, crop_id)
+            stats = locked[crop_id]
+            if stats is None:
+                self.rebuild(session, crop_id)    # 还没有汇总（升级前的数据）
+                rebuilt.add(crop_id)
+                continue
+            harvest = self._harvest(session.get(self.crop_model, crop_id))
+            stats.add_record(record_date, record_id, values, in_season=harvest is None or record_date <= harvest)
+
+        for crop_id, delta in pending["events"].items():
+            if crop_id in rebuilt or not delta:
+                continue
+            if crop_id not in locked:
+                locked[crop_id] = self._lock(session, crop_id)
+            stats = locked[crop_id]
+            if stats is not None:
+                stats.event_count = max(0, stats.event_count + delta)
+
+    def _lock(self, session, crop_id):
+        """锁定并从数据库重新读取汇总行（会话里缓存的可能是其他进程提交之前的旧值）"""
+        return session.query(self.stats_model).filter_by(crop_id=crop_id)\
+            .populate_existing().with_for_update().one_or_none()
+
+    # ===== 重算 =====
+
+    def _harvest(self, crop):
+        """作物的实际收获日期（没有收获或不支持冻结时为 None）"""
+        if crop is None or not self.harvest_key:
+            return None
+        return getattr(crop, self.harvest_key)
+
+    def compute(self, session, crop):
+        """
+        按原始数据计算一个作物的汇总
+
+        参数:
+            crop: 作物对象；有实际收获日期时本季统计只包括收获日及之前的记录
+
+        返回:
+            {列名: 值}
+        """
+        record = self.record_model
+        harvest = self._harvest(crop)
+        condition = [getattr(record, self.crop_key) == crop.id]
+        season = condition + ([record.date <= harvest] if harvest else [])
+
+        columns = []
+        for field in FIELDS:
+            value = func.nullif(getattr(record, field), 0)
+            columns += [func.sum(value), func.count(value), func.min(value), func.max(value)]
+        row = session.query(*columns).filter(*season).one()
+
+        values = {"record_count": session.query(func.count(record.id)).filter(*condition).scalar()}
+        for i, field in enumerate(FIELDS):
+            total, count, low, high = row[4 * i: 4 * i + 4]
+            values.update({f"{field}_sum": float(total or 0), f"{field}_count": count,
+                           f"{field}_min": low, f"{field}_max": high})
+
+        recent = session.query(record.date, record.id, *[getattr(record, field) for field in FIELDS])\
+            .filter(*condition).order_by(record.date.desc(), record.id.desc()).limit(RECENT_SIZE).all()
+        values["recent"] = json.dumps([[_date_key(r[0]), r[1]] + list(r[2:]) for r in recent])
+
+        values["event_count"] = 0
+        if self.event_model is not None:
+            values["event_count"] = session.query(func.count(self.event_model.id))\
+                .filter(self.event_model.crop_id == crop.id).scalar()
+        return values
+
+    def rebuild(self, session, crop_id):
+        """
+        按原始数据重算一个作物的汇总（不存在时创建），并按收获日期更新冻结状态
+
+        参数:
+            crop_id: 作物ID
+
+        返回:
+            是否重算了（作物已删除时为 False）
+        """
+        crop = session.get(self.crop_model, crop_id)
+        if crop is None:
+            return False
+
+        # 先锁住汇总行再读原始数据：同时重算同一作物的会话排队执行，后一个能看到前一个提交的记录
+        stats = self._lock(session, crop_id)
+        if stats is None:
+            stats = self.stats_model(crop_id=crop_id)
+            stats.reset()
+            session.add(stats)
+
+        for name, value in self.compute(session, crop).items():
+            setattr(stats, name, value)
+        stats.frozen_at = (stats.frozen_at or datetime.now()) if self._harvest(crop) else None
+        stats.updated_at = datetime.now()
+        return True
+
+    def rebuild_all(self, session, crop_ids=None, missing_only=False):
+        """
+        重建汇总并提交
+
+        参数:
+            crop_ids: 只重建这些作物，None 表示全部
+            missing_only: 只给还没有汇总的作物建（应用启动时补齐升级前的数据）
+
+        返回:
+            重建的作物数
+        """
+        query = session.query(self.crop_model.id)
+        if crop_ids is not None:
+            query = query.filter(self.crop_model.id.in_(list(crop_ids)))
+        if missing_only:
+            query = query.filter(~self.crop_model.id.in_(session.query(self.stats_model.crop_id)))
+
+        count = 0
+        try:
+            for (crop_id,) in query.all():
+                count += self.rebuild(session, crop_id)
+            session.commit()
+        except Exception:
+            session.rollback()
+            raise
+        return count
+
+    def check(self, session, crop_ids=None):
+        """
+        检查汇总与原始数据是否一致（不修改）
+
+        返回:
+            [(作物ID, 不一致的列名列表)]
+        """
+        query = session.query(self.crop_model)
+        if crop_ids is not None:
+            query = query.filter(self.crop_model.id.in_(list(crop_ids)))
+
+        problems = []
+        for crop in query.all():
+            stats = session.get(self.stats_model, crop.id)
+            if stats is None:
+                problems.append((crop.id, ["缺少汇总"]))
+                continue
+            expected = self.compute(session, crop)
+            wrong = [name for name, value in expected.items() if not _same(getattr(stats, name), value)]
+            if bool(stats.frozen_at) != bool(self._harvest(crop)):
+                wrong.append("frozen_at")
+            if wrong:
+                problems.append((crop.id, wrong))
+        return problems
+
+
+def _same(actual, expected):
+    if isinstance(expected, float) or isinstance(actual, float):
+        return actual is not None and expected is not None and abs(actual - expected) < 1e-6
+    return actual == expected
+
+
+def main(argv=None):
+    """命令行入口：检查或重建作物汇总"""
+    import argparse
+
+    parser = argparse.ArgumentParser(description="检查或重建作物统计汇总表（crop_stats）")
+    parser.add_argument("--check", action="store_true", help="只检查汇总是否与原始数据一致，不修改")
+    parser.add_argument("--crop", type=int, action="append", help="只处理指定作物ID（可重复）")
+    parser.add_argument("--v1", action="store_true", help="处理旧版 web_app 的数据库（database.py）")
+    args = parser.parse_args(argv)
+
+    if args.v1:
+        from web_app import app
+        from database import db, stats_rollup
+    else:
+        from app_v2 import app
+        from models import db, stats_rollup
+
+    with app.app_context():
+        db.create_all()
+        if args.check:
+            problems = stats_rollup.check(db.session, args.crop)
+            for crop_id, columns in problems:
+                print(f"❌ 作物 {crop_id}：{', '.join(columns)}")
+            print(f"{'⚠️' if problems else '✅'} 检查完成：{len(problems)} 个作物的汇总与原始数据不一致")
+            return 1 if problems else 0
+
+        count = stats_rollup.rebuild_all(db.session, args.crop)
+        print(f"✅ 已重建 {count} 个作物的汇总")
+        return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
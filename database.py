@@ -6,6 +6,8 @@
 from flask_sqlalchemy import SQLAlchemy
 from datetime import datetime
 
+from crop_rollup import CropStatsMixin, Rollup, summarize
+
 db = SQLAlchemy()
 
 # ===== 作物/田块管理模型 =====
@@ -26,16 +28,33 @@ class Crop(db.Model):
     
     records = db.relationship('DataRecord', backref='crop', lazy=True, cascade='all, delete-orphan')
     
+    # 统计汇总（查询作物时一起连接查出）
+    stats = db.relationship('CropStats', uselist=False, lazy='joined', cascade='all', passive_deletes=True)
+    
+    def display_info(self):
+        """显示用的基本字段（不访问记录，序列化记录时用）"""
+        return {
+            'id': self.id,
+            'crop_id': self.crop_id,
+            'crop_type': self.crop_type,
+            'field_name': self.field_name,
+            'display_name': f"{self.crop_type}{self.field_name}"
+        }
+    
     def to_dict(self):
-        record_count = len(self.records)
-        avg_temp = 0
-        avg_humidity = 0
-        
-        if record_count > 0:
+        """转换为字典（记录数和平均温湿度读汇总表 crop_stats，不加载记录）"""
+        if self.stats is not None:
+            summary = summarize(self.stats)
+            record_count = summary['record_count']
+            avg_temp = summary['season']['avg_temperature']
+            avg_humidity = summary['season']['avg_humidity']
+        else:
+            # 还没有汇总：按记录计算
             temps = [r.temperature for r in self.records if r.temperature]
             humidities = [r.humidity for r in self.records if r.humidity]
-            avg_temp = sum(temps) / len(temps) if temps else 0
-            avg_humidity = sum(humidities) / len(humidities) if humidities else 0
+            record_count = len(self.records)
+            avg_temp = sum(temps) / len(temps) if temps else None
+            avg_humidity = sum(humidities) / len(humidities) if humidities else None
         
         days_growing = 0
         if self.planting_date:
@@ -58,8 +77,8 @@ class Crop(db.Model):
             'notes': self.notes,
             'created_at': self.created_at.strftime('%Y-%m-%d %H:%M:%S'),
             'record_count': record_count,
-            'avg_temperature': round(avg_temp, 1),
-            'avg_humidity': round(avg_humidity, 1),
+            'avg_temperature': round(avg_temp or 0, 1),
+            'avg_humidity': round(avg_humidity or 0, 1),
             'days_growing': days_growing
         }
 
@@ -67,6 +86,12 @@ class Crop(db.Model):
 class DataRecord(db.Model):
     """农业数据记录模型"""
     __tablename__ = 'data_record'
+    __table_args__ = (
+        # 记录列表按 (日期, id) 游标分页，可按作物、记录类型筛选
+        db.Index('ix_data_record_date', 'date', 'id'),
+        db.Index('ix_data_record_crop_date', 'crop_db_id', 'date', 'id'),
+        db.Index('ix_data_record_type_date', 'record_type', 'date', 'id'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     crop_db_id = db.Column(db.Integer, db.ForeignKey('crop.id'), nullable=False)  # ⭐ 关键字段
@@ -79,7 +104,7 @@ class DataRecord(db.Model):
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     
     def to_dict(self):
-        crop_info = self.crop.to_dict() if self.crop else {}
+        crop_info = self.crop.display_info() if self.crop else {}
         
         return {
             'id': self.id,
@@ -96,7 +121,7 @@ class DataRecord(db.Model):
         }
     
     def to_text(self):
-        crop_info = self.crop.to_dict() if self.crop else {}
+        crop_info = self.crop.display_info() if self.crop else {}
         text = f"""
 【记录时间】{self.date}
 【作物】{crop_info.get('display_name', self.crop_name)}
@@ -105,4 +130,24 @@ class DataRecord(db.Model):
 """
         if self.notes:
             text += f"【备注】{self.notes}"
-        return text.strip()
\ No newline at end of file
+        return text.strip()
+
+
+# ===== 作物统计汇总 =====
+class CropStats(CropStatsMixin, db.Model):
+    """作物统计汇总（数据记录增删改时自动更新，见 crop_rollup.py）"""
+    __tablename__ = 'crop_stats'
+    
+    crop_id = db.Column(db.Integer, db.ForeignKey('crop.id', ondelete='CASCADE'), primary_key=True)
+
+
+# 每次 flush 时在同一个事务里更新汇总
+stats_rollup = Rollup(CropStats, DataRecord, Crop, crop_key='crop_db_id')
+stats_rollup.install(db.session)
+
+
+def create_indexes():
+    """给已有的表补上模型里新增的索引（db.create_all 只建新表，不会修改已有的表）"""
+    for table in db.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(db.engine, checkfirst=True)
\ No newline at end of file
@@ -0,0 +1,155 @@
+# document_loader.py - 文档读取模块
+# 功能：从 txt / pdf / docx 文件中提取纯文本（上传接口和批量导入共用）
+#       按页/段落流式产出，大PDF可以多进程并行解析，输出可以直接喂给切分器
+
+import multiprocessing
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from config import PDF_PARSE_WORKERS, PDF_PARALLEL_MIN_PAGES, PDF_PAGES_PER_TASK
+
+ALLOWED_EXTENSIONS = {'txt', 'pdf', 'docx'}
+
+
+def allowed_file(filename):
+    """检查文件扩展名"""
+    return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
+
+
+def _extract_pdf_range(task):
+    """子进程任务：提取PDF中 [start, end) 页的文本"""
+    filepath, start, end = task
+    import PyPDF2
+    reader = PyPDF2.PdfReader(filepath)
+    return [reader.pages[i].extract_text() or '' for i in range(start, end)]
+
+
+def iter_pdf_pages(filepath, workers=None):
+    """
+    逐页提取PDF文本（生成器）
+
+    进程数大于1且页数不少于 PDF_PARALLEL_MIN_PAGES 时，把页按段分给进程池并行解析，
+    同时最多只有 2×进程数 段在途，保证按页序产出且内存占用有上限。
+    进程池只适合命令行等独立进程；web 进程里（上传、后台导入任务）用默认值，不开进程池，
+    否则每个大PDF都会在每个 gunicorn worker 里开一组子进程（spawn 的子进程还会重新导入主模块）。
+
+    参数:
+        filepath: PDF路径
+        workers: 进程数，默认 PDF_PARSE_WORKERS（1，不开进程池）；传0表示CPU核数
+
+    返回:
+        生成器，每项是一页的文本
+    """
+    import PyPDF2
+    reader = PyPDF2.PdfReader(filepath)
+    page_count = len(reader.pages)
+
+    if workers is None:
+        workers = PDF_PARSE_WORKERS
+    if workers == 1 or page_count < PDF_PARALLEL_MIN_PAGES:
+        for page in reader.pages:
+            yield page.extract_text() or ''
+        return
+
+    del reader
+    workers = workers or os.cpu_count() or 1
+    tasks = (
+        (filepath, start, min(start + PDF_PAGES_PER_TASK, page_count))
+        for start in range(0, page_count, PDF_PAGES_PER_TASK)
+    )
+
+    # spawn：子进程不继承主进程里已加载的模型
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context) as executor:
+        pending = deque()
+        for task in tasks:
+            pending.append(executor.submit(_extract_pdf_range, task))
+            if len(pending) >= workers * 2:
+                yield from pending.popleft().result()
+        while pending:
+            yield from pending.popleft().result()
+
+
+def iter_document(filepath, workers=None):
+    """
+    流式读取文档（失败时抛出异常）
+
+    参数:
+        filepath: 文件路径
+        workers: PDF解析进程数
+
+    返回:
+        生成器：txt 逐行、pdf 逐页、docx 逐段产出文本
+    """
+    ext = filepath.rsplit('.', 1)[1].lower()
+
+    if ext == 'txt':
+        with open(filepath, 'r', encoding='utf-8') as f:
+            yield from f
+
+    elif ext == 'pdf':
+        yield from iter_pdf_pages(filepath, workers)
+
+    elif ext == 'docx':
+        import docx
+        doc = docx.Document(filepath)
+        for para in doc.paragraphs:
+            yield para.text
+
+    else:
+        raise ValueError(f"不支持的文件格式：{os.path.basename(filepath)}")
+
+
+def iter_lines(segments):
+    """把页/段落拆成行，直接作为 text_splitter.split_lines 的输入"""
+    for segment in segments:
+        yield from segment.splitlines()
+
+
+def load_text(filepath, workers=None):
+    """
+    读取文档全文（失败时抛出异常）
+
+    参数:
+        filepath: 文件路径
+        workers: PDF解析进程数
+
+    返回:
+        文档全文
+    """
+    ext = filepath.rsplit('.', 1)[1].lower()
+
+    if ext == 'txt':
+        with open(filepath, 'r', encoding='utf-8') as f:
+            return f.read()
+
+    return '\n'.join(iter_document(filepath, workers))
+
+
+def read_document(filepath):
+    """读取文档内容（失败时返回提示文字，供上传接口使用）"""
+    ext = filepath.rsplit('.', 1)[1].lower()
+
+    try:
+        return load_text(filepath)
+    except ImportError:
+        if ext == 'pdf':
+            return "PDF读取失败（需要安装 PyPDF2: pip install PyPDF2）"
+        return "DOCX读取失败（需要安装 python-docx: pip install python-docx）"
+    except ValueError:
+        return "不支持的文件格式"
+    except Exception:
+        if ext == 'pdf':
+            return "PDF读取失败（需要安装 PyPDF2: pip install PyPDF2）"
+        if ext == 'docx':
+            return "DOCX读取失败（需要安装 python-docx: pip install python-docx）"
+        raise
+
+
+def count_pages(filepath):
+    """PDF返回页数，其他格式返回None（用于任务进度）"""
+    if filepath.rsplit('.', 1)[1].lower() != 'pdf':
+        return None
+    import PyPDF2
+    return len(PyPDF2.PdfReader(filepath).pages)
@@ -0,0 +1,192 @@
+# embedding_cache.py - 向量缓存模块
+# 功能：按（模型名, 内容哈希）把向量缓存到磁盘，重建/重复导入时不用再跑模型
+#       向量存放在 float32 内存映射数组里，索引文件记录 键 → 行号
+
+import hashlib
+import json
+import os
+import threading
+
+import numpy as np
+
+try:
+    import fcntl  # 多进程（gunicorn）写入时加文件锁，Windows 上没有就只用线程锁
+except ImportError:
+    fcntl = None
+
+
+class EmbeddingCache:
+    """磁盘向量缓存（内存映射数组 + 追加写的索引文件）"""
+
+    def __init__(self, cache_dir, model_name):
+        """
+        参数:
+            cache_dir: 缓存目录
+            model_name: 模型名（不同模型的向量分开存放）
+        """
+        os.makedirs(cache_dir, exist_ok=True)
+
+        self.model_name = model_name
+        safe_name = ''.join(c if c.isalnum() or c in '-_.' else '_' for c in model_name)
+        base = os.path.join(cache_dir, safe_name)
+        self.vectors_path = f"{base}.f32"
+        self.index_path = f"{base}.idx"
+        self.meta_path = f"{base}.json"
+        self.lock_path = f"{base}.lock"
+
+        self.lock = threading.Lock()
+        self.index = {}          # 键 → 行号
+        self.index_offset = 0    # 索引文件已读取到的位置
+        self.dim = None
+        self.vectors = None      # np.memmap，按需重新映射
+        self.hits = 0
+        self.misses = 0
+
+        if os.path.exists(self.meta_path):
+            with open(self.meta_path, 'r', encoding='utf-8') as f:
+                self.dim = json.load(f)['dim']
+        self._load_index()
+
+    def make_key(self, text):
+        """缓存键：模型名 + 内容哈希"""
+        return hashlib.sha1(f"{self.model_name}\0{text}".encode('utf-8')).hexdigest()
+
+    # ===== 读取 =====
+
+    def _load_index(self):
+        """增量读取索引文件（其他进程追加的新条目也能读到）"""
+        if not os.path.exists(self.index_path):
+            return
+        with open(self.index_path, 'r', encoding='utf-8') as f:
+            f.seek(self.index_offset)
+            for line in f:
+                if not line.endswith('\n'):
+                    break  # 另一个进程正在写的半行，下次再读
+                key, row = line.split('\t')
+                self.index[key] = int(row)
+                self.index_offset += len(line.encode('utf-8'))
+
+    def _row(self, row):
+        """读取一行向量（行号超出当前映射范围时重新映射）"""
+        if self.vectors is None or row >= self.vectors.shape[0]:
+            rows = os.path.getsize(self.vectors_path) // (self.dim * 4)
+            self.vectors = np.memmap(self.vectors_path, dtype=np.float32, mode='r', shape=(rows, self.dim))
+        return np.array(self.vectors[row])
+
+    def get_many(self, keys):
+        """
+        批量查询
+
+        参数:
+            keys: 缓存键列表
+
+        返回:
+            {键: 向量}，只包含命中的键
+        """
+        with self.lock:
+            if any(key not in self.index for key in keys):
+                self._load_index()
+
+            found = {key: self._row(self.index[key]) for key in keys if key in self.index}
+            self.hits += len(found)
+            self.misses += len(keys) - len(found)
+            return found
+
+    # ===== 写入 =====
+
+    def put_many(self, items):
+        """
+        批量写入（先写向量再写索引，索引里出现的行一定已经落盘）
+
+        参数:
+            items: {键: 向量}
+        """
+        if not items:
+            return
+
+        with self.lock:
+            matrix = np.asarray(list(items.values()), dtype=np.float32)
+
+            if self.dim is None:
+                self.dim = matrix.shape[1]
+                with open(self.meta_path, 'w', encoding='utf-8') as f:
+                    json.dump({"model": self.model_name, "dim": self.dim}, f)
+
+            with open(self.lock_path, 'a') as lock_file:
+                if fcntl:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX)
+                try:
+                    self._load_index()
+                    new_keys = [key for key in items if key not in self.index]
+                    if not new_keys:
+                        return
+                    positions = {key: i for i, key in enumerate(items)}
+                    rows = matrix[[positions[key] for key in new_keys]]
+                    row_bytes = self.dim * 4
+
+                    with open(self.vectors_path, 'ab') as f:
+                        # 上次写入中断留下的半行截掉，保证行对齐
+                        size = f.seek(0, os.SEEK_END)
+                        if size % row_bytes:
+                            f.truncate(size - size % row_bytes)
+                        start = size // row_bytes
+                        f.write(rows.tobytes())
+                        f.flush()
+                        os.fsync(f.fileno())
+
+                    with open(self.index_path, 'a', encoding='utf-8') as f:
+                        f.write(''.join(f"{key}\t{start + i}\n" for i, key in enumerate(new_keys)))
+
+                    self._load_index()
+                finally:
+                    if fcntl:
+                        fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def get_stats(self):
+        """缓存统计"""
+        total = self.hits + self.misses
+        return {
+            'entries': len(self.index),
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': f'{(self.hits / total * 100) if total else 0:.1f}%'
+        }
+
+
+class CachedEmbeddingFunction:
+    """带磁盘缓存的向量函数：先查缓存，只把未命中的文本一次性交给模型"""
+
+    def __init__(self, embedding_function, cache):
+        """
+        参数:
+            embedding_function: 原始向量函数（如 SentenceTransformerEmbeddingFunction）
+            cache: EmbeddingCache 实例
+        """
+        self.embedding_function = embedding_function
+        self.cache = cache
+
+    def __call__(self, input):
+        """
+        计算一批文本的向量
+
+        参数:
+            input: 文本列表
+
+        返回:
+            向量列表（与输入顺序一致）
+        """
+        keys = [self.cache.make_key(text) for text in input]
+        found = self.cache.get_many(keys)
+
+        missing = {}
+        for key, text in zip(keys, input):
+            if key not in found and key not in missing:
+                missing[key] = text
+
+        if missing:
+            vectors = self.embedding_function(list(missing.values()))
+            computed = {key: np.asarray(vector, dtype=np.float32) for key, vector in zip(missing, vectors)}
+            self.cache.put_many(computed)
+            found.update(computed)
+
+        return [found[key].tolist() for key in keys]
@@ -0,0 +1,229 @@
+# growth_stats.py - 作物数据统计
+# 功能：对每日记录的温度、湿度序列做向量化统计（趋势、滑动平均、超出适宜范围的连续天数、骤变），
+#       算出基线生长评分和病虫害风险；数据正常时直接生成分析结果，不用调用大模型
+
+from datetime import datetime
+
+import numpy as np
+
+from config import (
+    CROP_RANGES, STATS_ANOMALY_SPAN, STATS_SWING_LIMIT, STATS_ROLLING_WINDOW, ABNORMAL_STATUS_WORDS
+)
+
+# 统计规则的版本：规则改变时加一，数据没变的作物也会重新分析，不再复用旧规则算出的结果
+STATS_VERSION = 2
+
+# 统计的指标：(字段名, 中文名, 单位, 评分权重)
+METRICS = (
+    ("temperature", "温度", "°C", 25),
+    ("humidity", "湿度", "%", 15),
+)
+
+
+def crop_ranges(crop_type):
+    """作物适宜的温度/湿度范围（按作物类型匹配，如“冬小麦”匹配“小麦”）"""
+    for name, ranges in CROP_RANGES.items():
+        if name != "default" and name in (crop_type or ""):
+            return ranges
+    return CROP_RANGES["default"]
+
+
+def rolling_mean(values, window=STATS_ROLLING_WINDOW):
+    """
+    滑动平均（缺失值不参与计算，窗口内全部缺失时为 NaN）
+
+    参数:
+        values: float 数组，缺失值为 NaN
+        window: 窗口天数
+
+    返回:
+        长度为 len(values) - window + 1 的数组（数据不足一个窗口时返回空数组）
+    """
+    if len(values) < window:
+        return np.array([])
+    valid = ~np.isnan(values)
+    kernel = np.ones(window)
+    sums = np.convolve(np.where(valid, values, 0.0), kernel, 'valid')
+    counts = np.convolve(valid.astype(float), kernel, 'valid')
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return sums / counts
+
+
+def longest_run(mask):
+    """布尔数组里最长的连续 True 段长度"""
+    if not mask.any():
+        return 0
+    edges = np.flatnonzero(np.diff(np.concatenate(([0], mask.astype(np.int8), [0]))))
+    return int((edges[1::2] - edges[::2]).max())
+
+
+def series_stats(days, values, low, high):
+    """
+    单个指标的统计
+
+    参数:
+        days: 每条记录距第一条记录的天数（升序）
+        values: 指标值，缺失为 NaN
+        low / high: 适宜范围
+
+    返回:
+        统计字典
+    """
+    valid = ~np.isnan(values)
+    count = int(valid.sum())
+    if not count:
+        return {"count": 0}
+
+    present = values[valid]
+    slope = float(np.polyfit(days[valid], present, 1)[0]) if count >= 3 and np.ptp(days[valid]) > 0 else 0.0
+    below = valid & (values < low)
+    above = valid & (values > high)
+    swings = np.abs(np.diff(present))
+
+    return {
+        "count": count,
+        "mean": round(float(present.mean()), 1),
+        "min": round(float(present.min()), 1),
+        "max": round(float(present.max()), 1),
+        "latest": round(float(present[-1]), 1),
+        "trend": round(slope, 2),    # 每天的变化量（线性回归斜率）
+        "rolling_mean": [None if np.isnan(v) else round(float(v), 1) for v in rolling_mean(values)],
+        "range": [low, high],
+        "below_days": int(below.sum()),
+        "above_days": int(above.sum()),
+        "longest_below": longest_run(below),
+        "longest_above": longest_run(above),
+        "max_swing": round(float(swings.max()), 1) if len(swings) else 0.0
+    }
+
+
+def compute_stats(records, crop_type):
+    """
+    计算作物最近记录的统计、异常、基线评分和病虫害风险
+
+    参数:
+        records: DailyRecord 列表（顺序不限）
+        crop_type: 作物类型
+
+    返回:
+        统计字典，其中 anomalies 为异常说明列表（为空表示数据正常）
+    """
+    records = sorted(records, key=lambda r: r.date)
+    first = records[0].date
+    days = np.array([(r.date - first).days for r in records], dtype=float)
+    ranges = crop_ranges(crop_type)
+
+    stats = {"records": len(records), "span_days": int(days[-1]) + 1, "anomalies": []}
+    score = 100.0
+    series = {}
+
+    for field, label, unit, weight in METRICS:
+        values = np.array([np.nan if getattr(r, field) is None else getattr(r, field) for r in records], dtype=float)
+        series[field] = values
+        low, high = ranges[field]
+        item = series_stats(days, values, low, high)
+        stats[field] = item
+        if not item["count"]:
+            continue
+
+        # 评分：超出范围的比例 + 连续超出的天数 + 骤变
+        score -= weight * (item["below_days"] + item["above_days"]) / item["count"]
+        score -= 5 * max(0, max(item["longest_below"], item["longest_above"]) - 1)
+
+        if item["longest_above"] >= STATS_ANOMALY_SPAN:
+            stats["anomalies"].append(f"连续{item['longest_above']}天{label}高于{high}{unit}")
+        if item["longest_below"] >= STATS_ANOMALY_SPAN:
+            stats["anomalies"].append(f"连续{item['longest_below']}天{label}低于{low}{unit}")
+        if item["max_swing"] >= STATS_SWING_LIMIT[field]:
+            score -= 5
+            stats["anomalies"].append(f"{label}相邻两次记录变化达{item['max_swing']}{unit}")
+
+    # 没有任何温湿度读数：评分只反映生长状态，不可信，不给高分，交给大模型结合文字记录判断
+    measured = sum(1 for field, _, _, _ in METRICS if stats[field]["count"])
+    if not measured:
+        score = min(score, 60.0)
+        stats["anomalies"].append("最近的记录都没有温湿度读数，无法评估环境条件")
+    stats["confidence"] = "高" if measured == len(METRICS) else "中" if measured else "低"
+
+    # 生长状态里出现病、虫、黄叶、生长缓慢、需要施肥/浇水等字样
+    abnormal = [f"{r.date.strftime('%m-%d')} {r.growth_status}" for r in records
+                if r.growth_status and any(word in r.growth_status for word in ABNORMAL_STATUS_WORDS)]
+    if abnormal:
+        score -= min(30, 10 * len(abnormal))
+        stats["anomalies"].append("生长状态异常：" + "；".join(abnormal[-3:]))
+
+    # 病虫害风险：温暖（15-30°C）且高湿（≥80%）的天数
+    temps, humidities = series["temperature"], series["humidity"]
+    with np.errstate(invalid='ignore'):
+        muggy = (temps >= 15) & (temps <= 30) & (humidities >= 80)
+    if muggy.sum() >= 3 or longest_run(muggy) >= 2:
+        risk = "高"
+        stats["anomalies"].append(f"温暖高湿天气{int(muggy.sum())}天，病虫害风险高")
+    elif muggy.any() or abnormal:
+        risk = "中"
+    else:
+        risk = "低"
+
+    stats["growth_score"] = int(round(min(100.0, max(0.0, score))))
+    stats["pest_risk"] = risk
+    stats["computed_at"] = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    return stats
+
+
+def _describe_trend(item, label, unit):
+    if not item.get("count"):
+        return f"暂无{label}数据"
+    direction = "上升" if item["trend"] > 0.3 else "下降" if item["trend"] < -0.3 else "平稳"
+    return f"平均{label}{item['mean']}{unit}（适宜{item['range'][0]}-{item['range'][1]}{unit}），{direction}"
+
+
+def rule_based_analysis(crop, stats):
+    """
+    根据统计结果直接生成分析（字段与大模型返回的 JSON 相同）
+
+    参数:
+        crop: Crop 对象
+        stats: compute_stats 的返回值
+
+    返回:
+        分析结果字典
+    """
+    score = stats["growth_score"]
+    if stats.get("confidence") == "低":
+        level = "缺少温湿度数据，无法判断长势"
+    else:
+        level = "长势良好" if score >= 85 else "长势基本正常" if score >= 70 else "长势偏弱，需要关注"
+    evaluation = (f"最近{stats['records']}条记录：{_describe_trend(stats['temperature'], '温度', '°C')}；"
+                  f"{_describe_trend(stats['humidity'], '湿度', '%')}。{level}。")
+
+    if stats["anomalies"]:
+        evaluation += "注意：" + "；".join(stats["anomalies"]) + "。"
+
+    pest_text = {
+        "低": "温湿度条件不利于病虫害发生，保持日常巡田即可",
+        "中": "出现过温暖高湿或异常状态，建议加强巡田，发现病斑虫害及时处理",
+        "高": "温暖高湿持续，病害易发，建议提前预防性用药并注意通风排湿"
+    }[stats["pest_risk"]]
+
+    return {
+        "growth_evaluation": evaluation,
+        "growth_score": score,
+        "fertilizer_advice": f"{crop.name}已生长{crop.get_growth_days()}天，按当前生育期的施肥计划正常管理即可",
+        "fertilizer_suggestions": ["按计划追肥，不必额外加量", "结合灌溉施肥，避免干施"],
+        "pest_prediction": pest_text,
+        "pest_risk": stats["pest_risk"],
+        "source": "统计",
+        "stats": stats
+    }
+
+
+def stats_summary(stats):
+    """统计结果的文字摘要（放进大模型提示词）"""
+    lines = [
+        _describe_trend(stats["temperature"], "温度", "°C"),
+        _describe_trend(stats["humidity"], "湿度", "%"),
+        f"基线评分：{stats['growth_score']}（数据可信度：{stats.get('confidence', '高')}），病虫害风险：{stats['pest_risk']}"
+    ]
+    if stats["anomalies"]:
+        lines.append("发现的异常：" + "；".join(stats["anomalies"]))
+    return "\n".join(lines)
@@ -0,0 +1,292 @@
+# ingest.py - 知识库批量导入工具
+# 功能：递归扫描知识文档目录，多进程解析文件，批量向量化写入知识库
+#       用内容哈希清单记录已导入的文件，重复运行时只处理新增/修改的文件
+#
+# 用法：
+#   python ingest.py                        # 导入 data/knowledge 目录
+#   python ingest.py 目录 --workers 8       # 指定目录和解析进程数
+#   python ingest.py --force                # 忽略清单，全部重新导入
+#   python ingest.py --prune                # 删除已从目录中移除的文件对应的文档
+
+import os
+os.environ.setdefault("HF_ENDPOINT", "https://hf-mirror.com")
+
+import argparse
+import hashlib
+import json
+import multiprocessing
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+
+from config import (
+    KNOWLEDGE_DIR, INGEST_MANIFEST_PATH, INGEST_BATCH_SIZE, KNOWN_CROPS, CHUNK_SIZE
+)
+from document_loader import allowed_file, load_text
+
+
+# ===== 文件扫描与解析（在子进程中运行，不要依赖知识库）=====
+
+def scan_files(root):
+    """递归扫描目录下所有支持的文档（按路径排序，保证结果稳定）"""
+    found = []
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames.sort()
+        for filename in sorted(filenames):
+            if allowed_file(filename):
+                found.append(os.path.join(dirpath, filename))
+    return found
+
+
+def file_sha256(path):
+    """计算文件内容哈希"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def guess_crop(filename):
+    """从文件名识别作物，例如 小麦种植指南.txt -> 小麦"""
+    for crop in KNOWN_CROPS:
+        if crop in filename:
+            return crop
+    return "未分类"
+
+
+def guess_topic(filename, crop):
+    """从文件名识别主题，例如 小麦种植指南.txt -> 种植指南"""
+    stem = os.path.splitext(filename)[0]
+    topic = stem.replace(crop, '', 1).strip(' _-') if crop != "未分类" else stem
+    return topic or "未分类"
+
+
+def hash_file(path):
+    """子进程任务：计算文件哈希"""
+    try:
+        return path, file_sha256(path), None
+    except Exception as e:
+        return path, None, str(e)
+
+
+def parse_file(path):
+    """子进程任务：提取文件全文（已经在进程池里，PDF不再开子进程）"""
+    try:
+        return path, load_text(path, workers=1), None
+    except Exception as e:
+        return path, None, str(e)
+
+
+# ===== 导入清单 =====
+
+def load_manifest(manifest_path):
+    """读取导入清单 {相对导入目录的路径: {"sha256", "doc_id", ...}}"""
+    if not os.path.exists(manifest_path):
+        return {}
+    with open(manifest_path, 'r', encoding='utf-8') as f:
+        return json.load(f).get('files', {})
+
+
+def save_manifest(manifest_path, files):
+    """原子写入导入清单（先写临时文件再替换，中途中断不会损坏清单）"""
+    os.makedirs(os.path.dirname(manifest_path) or '.', exist_ok=True)
+    tmp_path = f"{manifest_path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump({"version": 1, "files": files}, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, manifest_path)
+
+
+# ===== 导入主流程 =====
+
+def ingest(root=KNOWLEDGE_DIR, kb=None, workers=None, batch_size=INGEST_BATCH_SIZE,
+           force=False, prune=False, crop=None, topic=None,
+           manifest_path=INGEST_MANIFEST_PATH, dry_run=False):
+    """
+    增量导入目录下的知识文档
+
+    参数:
+        root: 文档目录（递归扫描）
+        kb: KnowledgeBase 实例，不传则自动创建
+        workers: 解析进程数，默认CPU核数
+        batch_size: 每批写入的块数
+        force: 忽略清单，全部重新导入
+        prune: 删除已从目录中消失的文件对应的文档
+        crop / topic: 指定作物和主题，不传则从文件名识别
+        manifest_path: 导入清单路径
+        dry_run: 只统计要处理的文件，不写入知识库
+
+    返回:
+        统计信息字典
+    """
+    started = time.time()
+    manifest = load_manifest(manifest_path)
+    paths = scan_files(root)
+    # 清单的键相对导入目录，在哪个目录下运行命令都一样
+    rel_paths = {path: os.path.relpath(path, root) for path in paths}
+    present = set(rel_paths.values())
+
+    # 旧版清单的键相对当时的当前目录：能对应到本目录下的文件时改成相对导入目录的键
+    for key in list(manifest):
+        rel = os.path.relpath(os.path.abspath(key), root)
+        if key not in present and rel in present and rel not in manifest:
+            manifest[rel] = manifest.pop(key)
+
+    stats = {"scanned": len(paths), "added": 0, "updated": 0, "unchanged": 0,
+             "removed": 0, "failed": 0, "chunks": 0}
+
+    # 子进程用 spawn 启动：不继承主进程里已加载的模型和数据库连接
+    context = multiprocessing.get_context("spawn")
+
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context) as executor:
+        # 1. 并行计算哈希，对比清单找出需要处理的文件
+        changed = {}
+        for path, sha, error in executor.map(hash_file, paths, chunksize=16):
+            rel = rel_paths[path]
+            if error:
+                print(f"❌ 读取失败：{rel}（{error}）")
+                stats["failed"] += 1
+                continue
+
+            entry = manifest.get(rel)
+            if not force and entry and entry.get("sha256") == sha:
+                stats["unchanged"] += 1
+            else:
+                changed[path] = sha
+
+        removed = [rel for rel in manifest if rel not in present] if prune else []
+
+        print(f"📂 扫描 {len(paths)} 个文件：{len(changed)} 个需要导入，"
+              f"{stats['unchanged']} 个未变化，{len(removed)} 个已移除")
+
+        if dry_run or (not changed and not removed):
+            stats["elapsed"] = round(time.time() - started, 2)
+            return stats
+
+        if kb is None:
+            from knowledge_base import KnowledgeBase
+            kb = KnowledgeBase()
+
+        def release(doc_id, rel=None):
+            """删除旧文档（其他文件仍引用同一内容时保留）"""
+            if doc_id and not any(e.get("doc_id") == doc_id for r, e in manifest.items() if r != rel):
+                kb.delete_document(doc_id)
+
+        # 2. 删除已移除文件的文档
+        for rel in removed:
+            release(manifest[rel].get("doc_id"), rel)
+            del manifest[rel]
+            stats["removed"] += 1
+        if removed:
+            save_manifest(manifest_path, manifest)
+
+        # 3. 并行解析文件，主进程按批向量化写入
+        # 更新的文件在新内容写入、清单保存之后才删除旧文档，中途失败时旧文档仍可检索
+        batch = []
+        batch_chunks = 0
+
+        def flush():
+            nonlocal batch, batch_chunks
+            if not batch:
+                return
+            doc_ids = kb.add_documents_batch([doc for doc, _, _ in batch], batch_size=batch_size)
+            for (doc, entry, _), doc_id in zip(batch, doc_ids):
+                manifest[doc["file_path"]] = {**entry, "doc_id": doc_id}
+            # 每批写入成功后立即保存清单，中断后重跑可以接着导入
+            save_manifest(manifest_path, manifest)
+            # 再删除被替换的旧文档（新旧内容相同时ID不变，不能删）
+            for (_, _, old_id), doc_id in zip(batch, doc_ids):
+                if old_id != doc_id:
+                    release(old_id)
+            stats["chunks"] += batch_chunks
+            batch, batch_chunks = [], 0
+
+        for path, content, error in executor.map(parse_file, list(changed), chunksize=4):
+            rel = rel_paths[path]
+            if error or not content or not content.strip():
+                print(f"❌ 解析失败：{rel}（{error or '内容为空'}）")
+                stats["failed"] += 1
+                continue
+
+            filename = os.path.basename(path)
+            doc_crop = crop or guess_crop(filename)
+            doc_topic = topic or guess_topic(filename, doc_crop)
+
+            old_entry = manifest.get(rel)
+            if old_entry:
+                stats["updated"] += 1
+            else:
+                stats["added"] += 1
+
+            batch.append((
+                {
+                    "content": content,
+                    "crop": doc_crop,
+                    "topic": doc_topic,
+                    "source": filename,
+                    "file_path": rel
+                },
+                {
+                    "sha256": changed[path],
+                    "crop": doc_crop,
+                    "topic": doc_topic,
+                    "ingested_at": datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+                },
+                old_entry.get("doc_id") if old_entry else None
+            ))
+            batch_chunks += len(content) // CHUNK_SIZE + 1
+
+            if batch_chunks >= batch_size:
+                flush()
+
+        flush()
+
+    stats["elapsed"] = round(time.time() - started, 2)
+    return stats
+
+
+def main(argv=None):
+    """命令行入口"""
+    parser = argparse.ArgumentParser(description="批量导入知识文档到知识库（增量）")
+    parser.add_argument("root", nargs="?", default=KNOWLEDGE_DIR, help="文档目录，默认 %(default)s")
+    parser.add_argument("--workers", type=int, default=None, help="解析进程数，默认CPU核数")
+    parser.add_argument("--batch-size", type=int, default=INGEST_BATCH_SIZE, help="每批写入的块数")
+    parser.add_argument("--crop", default=None, help="指定作物（默认从文件名识别）")
+    parser.add_argument("--topic", default=None, help="指定主题（默认从文件名识别）")
+    parser.add_argument("--manifest", default=INGEST_MANIFEST_PATH, help="导入清单路径")
+    parser.add_argument("--force", action="store_true", help="忽略清单，全部重新导入")
+    parser.add_argument("--prune", action="store_true", help="删除已从目录中移除的文件对应的文档")
+    parser.add_argument("--dry-run", action="store_true", help="只统计，不写入")
+    args = parser.parse_args(argv)
+
+    if not os.path.isdir(args.root):
+        print(f"❌ 目录不存在：{args.root}")
+        return 1
+
+    stats = ingest(
+        root=args.root,
+        workers=args.workers,
+        batch_size=args.batch_size,
+        force=args.force,
+        prune=args.prune,
+        crop=args.crop,
+        topic=args.topic,
+        manifest_path=args.manifest,
+        dry_run=args.dry_run
+    )
+
+    print("\n" + "="*60)
+    print("📊 导入完成")
+    print(f"  扫描文件：{stats['scanned']}")
+    print(f"  新增：{stats['added']}  更新：{stats['updated']}  未变化：{stats['unchanged']}")
+    print(f"  移除：{stats['removed']}  失败：{stats['failed']}")
+    print(f"  写入块数（估算）：{stats['chunks']}")
+    print(f"  耗时：{stats['elapsed']}秒")
+    print("="*60)
+
+    return 1 if stats["failed"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,320 @@
+# ingest_jobs.py - 后台文档导入任务队列
+# 功能：上传/添加文档时只登记任务并立即返回任务ID，由本地线程池解析、切块；
+#       写入线程把多个任务的小批量写入合并成一次 upsert，任务进度可随时查询
+
+import json
+import os
+import queue
+import threading
+import time
+import uuid
+from concurrent.futures import Future, ThreadPoolExecutor
+from datetime import datetime
+from itertools import islice
+
+from config import INGEST_JOB_WORKERS, INGEST_JOB_DIR, INGEST_WRITE_BATCH, INGEST_WRITE_LINGER
+from document_loader import count_pages, iter_document, iter_lines
+from text_splitter import split_lines
+
+
+class ChunkWriter:
+    """合并写入器：把并发到达的小批量块写入合并成一次批量 upsert"""
+
+    def __init__(self, kb, max_batch=INGEST_WRITE_BATCH, linger=INGEST_WRITE_LINGER):
+        """
+        参数:
+            kb: KnowledgeBase 实例
+            max_batch: 每次 upsert 的最大块数
+            linger: 收到第一批后最多再等多久（秒）凑批
+        """
+        self.kb = kb
+        self.max_batch = max_batch
+        self.linger = linger
+        # 有上限的队列：写入跟不上时解析线程会被阻塞（背压）
+        self.queue = queue.Queue(maxsize=64)
+
+        self.thread = threading.Thread(target=self._run, name="chunk-writer", daemon=True)
+        self.thread.start()
+
+    def write(self, ids, contents, metadatas):
+        """
+        提交一批块
+
+        返回:
+            Future，写入完成后结果为块数
+        """
+        future = Future()
+        self.queue.put((ids, contents, metadatas, future))
+        return future
+
+    def _run(self):
+        """写入线程：凑批 → 一次 upsert → 通知各提交方"""
+        while True:
+            items = [self.queue.get()]
+            size = len(items[0][0])
+            deadline = time.monotonic() + self.linger
+
+            while size < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self.queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                items.append(item)
+                size += len(item[0])
+
+            # 同一ID只保留最后一次写入（Chroma 不允许一批里有重复ID）
+            merged = {}
+            for ids, contents, metadatas, _ in items:
+                for chunk_id, content, metadata in zip(ids, contents, metadatas):
+                    merged[chunk_id] = (content, metadata)
+
+            try:
+                self.kb.upsert_chunks(
+                    list(merged),
+                    [content for content, _ in merged.values()],
+                    [metadata for _, metadata in merged.values()]
+                )
+                error = None
+            except Exception as e:
+                error = e
+
+            for ids, _, _, future in items:
+                if error:
+                    future.set_exception(error)
+                else:
+                    future.set_result(len(ids))
+
+
+class IngestJob:
+    """一个导入任务的状态"""
+
+    def __init__(self, kind, source, crop, topic, doc_id):
+        self.id = uuid.uuid4().hex
+        self.kind = kind            # file / text
+        self.source = source
+        self.crop = crop
+        self.topic = topic
+        self.doc_id = doc_id
+        self.status = 'queued'      # queued / running / done / failed
+        self.pages_total = None
+        self.pages_parsed = 0
+        self.chunks_parsed = 0
+        self.chunks_embedded = 0
+        self.content_length = 0
+        self.error = None
+        self.created_at = datetime.now()
+        self.started_at = None
+        self.finished_at = None
+
+    def to_dict(self):
+        fmt = lambda t: t.strftime('%Y-%m-%d %H:%M:%S') if t else None
+        return {
+            'job_id': self.id,
+            'kind': self.kind,
+            'source': self.source,
+            'crop': self.crop,
+            'topic': self.topic,
+            'doc_id': self.doc_id,
+            'status': self.status,
+            'pages_total': self.pages_total,
+            'pages_parsed': self.pages_parsed,
+            'chunks_parsed': self.chunks_parsed,
+            'chunks_embedded': self.chunks_embedded,
+            'content_length': self.content_length,
+            'error': self.error,
+            'created_at': fmt(self.created_at),
+            'started_at': fmt(self.started_at),
+            'finished_at': fmt(self.finished_at)
+        }
+
+
+class IngestJobQueue:
+    """后台导入任务队列"""
+
+    def __init__(self, kb, workers=INGEST_JOB_WORKERS, job_dir=INGEST_JOB_DIR, chunk_batch=32):
+        """
+        参数:
+            kb: KnowledgeBase 实例
+            workers: 解析线程数
+            job_dir: 任务状态文件目录，多个进程共享，任意进程都能查询进度
+            chunk_batch: 解析线程每次提交给写入器的块数
+        """
+        self.kb = kb
+        self.job_dir = job_dir
+        self.chunk_batch = chunk_batch
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="ingest")
+        self.writer = ChunkWriter(kb)
+        self.jobs = {}
+        self.lock = threading.Lock()
+
+        os.makedirs(job_dir, exist_ok=True)
+
+    # ===== 提交任务 =====
+
+    def submit_file(self, filepath, source, crop, topic):
+        """
+        提交文件导入任务（文件已保存到磁盘）
+
+        返回:
+            IngestJob
+        """
+        job = IngestJob('file', source, crop, topic, self.kb.make_file_doc_id(filepath))
+        self._register(job)
+        self.executor.submit(self._run, job, self._run_file, filepath)
+        return job
+
+    def submit_text(self, content, crop, topic, source):
+        """
+        提交文本导入任务
+
+        返回:
+            IngestJob
+        """
+        job = IngestJob('text', source, crop, topic, self.kb.make_doc_id(content))
+        self._register(job)
+        self.executor.submit(self._run, job, self._run_text, content)
+        return job
+
+    def get(self, job_id):
+        """查询任务状态（本进程没有时从状态文件读取）"""
+        with self.lock:
+            job = self.jobs.get(job_id)
+            if job:
+                return job.to_dict()
+
+        path = self._job_path(job_id)
+        if os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        return None
+
+    # ===== 任务执行 =====
+
+    def _run(self, job, handler, payload):
+        """执行任务并记录状态"""
+        job.status = 'running'
+        job.started_at = datetime.now()
+        self._save(job)
+
+        try:
+            handler(job, payload)
+            job.status = 'done'
+        except Exception as e:
+            job.status = 'failed'
+            job.error = str(e)
+            print(f"❌ 导入任务失败（{job.id}）：{e}")
+        finally:
+            job.finished_at = datetime.now()
+            self._save(job)
+
+    def _run_file(self, job, filepath):
+        """文件任务：流式解析 → 切块 → 分批交给写入器"""
+        job.pages_total = count_pages(filepath)
+
+        def segments():
+            # 在 web 进程的线程里解析，不开PDF进程池
+            for segment in iter_document(filepath, workers=1):
+                if job.pages_total is not None:
+                    job.pages_parsed += 1
+                job.content_length += len(segment.strip())
+                yield segment
+
+        chunks = split_lines(iter_lines(segments()))
+        self._write_chunks(job, chunks)
+
+        if job.content_length < 10:
+            if job.chunks_parsed:
+                self.kb.delete_document(job.doc_id)
+            os.remove(filepath)
+            raise ValueError("文件内容为空或过短")
+
+        print(f"✅ 文档已添加（ID: {job.doc_id}，共 {job.chunks_embedded} 块）")
+
+    def _run_text(self, job, content):
+        """文本任务：切块后交给写入器（和 add_document 生成同样的块ID）"""
+        job.content_length = len(content)
+        _, ids, contents, metadatas = self.kb.build_chunks({
+            "content": content,
+            "crop": job.crop,
+            "topic": job.topic,
+            "source": job.source
+        })
+        job.chunks_parsed = len(ids)
+        self._save(job, throttle=False)
+
+        self.writer.write(ids, contents, metadatas).result()
+        job.chunks_embedded = len(ids)
+
+    def _write_chunks(self, job, chunks):
+        """把流式切出的块分批提交给写入器，并等待全部写完"""
+        chunks = iter(chunks)
+        futures = []
+        counted = set()    # 已计入进度的批次：回调和下面的等待循环谁先到谁计，每批只计一次
+
+        while True:
+            batch = list(islice(chunks, self.chunk_batch))
+            if not batch:
+                break
+
+            ids, contents, metadatas = self.kb.prepare_chunks(
+                job.doc_id, batch, job.crop, job.topic, job.source, start=job.chunks_parsed
+            )
+            job.chunks_parsed += len(batch)
+
+            future = self.writer.write(ids, contents, metadatas)
+            future.add_done_callback(lambda f, job=job: self._on_written(job, f, counted))
+            futures.append(future)
+            self._save(job)
+
+        # 回调可能晚于 result() 返回执行，还没计入的批次在这里计入
+        for future in futures:
+            future.result()
+            self._count_written(job, future, counted)
+
+    def _on_written(self, job, future, counted):
+        """写入器回调：累计已向量化块数"""
+        if future.exception() is None:
+            self._count_written(job, future, counted)
+            self._save(job)
+
+    def _count_written(self, job, future, counted):
+        """把一批写完的块计入进度（同一批只计一次）"""
+        with self.lock:
+            if future in counted:
+                return
+            counted.add(future)
+            job.chunks_embedded += future.result()
+
+    # ===== 状态持久化 =====
+
+    def _register(self, job, keep=200):
+        """登记任务；内存里只保留最近的任务，更早的只能从状态文件查询"""
+        with self.lock:
+            self.jobs[job.id] = job
+            finished = [j for j in self.jobs.values() if j.status in ('done', 'failed')]
+            for old in finished[:max(0, len(self.jobs) - keep)]:
+                del self.jobs[old.id]
+        self._save(job, throttle=False)
+
+    def _job_path(self, job_id):
+        # 任务ID是 uuid hex，过滤掉其他字符防止路径穿越
+        safe_id = ''.join(c for c in job_id if c.isalnum())
+        return os.path.join(self.job_dir, f"{safe_id}.json")
+
+    def _save(self, job, throttle=True):
+        """原子写入任务状态文件（进度更新最多每0.5秒写一次）"""
+        now = time.monotonic()
+        if throttle and job.status == 'running' and now - getattr(job, '_saved_at', 0) < 0.5:
+            return
+        job._saved_at = now
+
+        path = self._job_path(job.id)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with self.lock:
+            data = job.to_dict()
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
@@ -6,8 +6,33 @@
 
 import chromadb
 from chromadb.utils import embedding_functions
-from config import CHROMA_DB_PATH, COLLECTION_NAME, EMBEDDING_MODEL
+from config import (
+    CHROMA_DB_PATH, COLLECTION_NAME, EMBEDDING_MODEL, EMBEDDING_CACHE_DIR, KB_VERSION_PATH, CHUNK_SIZE, CHUNK_OVERLAP,
+    KB_CHANGES_DIR, KB_CHANGE_LOG_SIZE,
+    QUERY_EMBEDDING_CACHE_SIZE, RETRIEVAL_CACHE_SIZE, CROP_ALIASES, HYBRID_LEXICAL_WEIGHT,
+    USE_STUB_MODELS, STUB_EMBEDDING_MODEL
+)
+from cache_utils import LRUCache
+from embedding_cache import EmbeddingCache, CachedEmbeddingFunction
+from lexical_index import LexicalIndex
+from text_splitter import split_document
+from contextlib import contextmanager
+from itertools import islice
+import hashlib
+import json
 import os
+import threading
+
+try:
+    import fcntl  # 多进程同时修改知识库时给版本号文件加锁，Windows 上没有就只用线程锁
+except ImportError:
+    fcntl = None
+
+SEARCH_MODES = ("hybrid", "vector", "lexical")
+
+# 向量库用余弦距离（0~2），相似度 = 1 - 距离，与 SIMILARITY_THRESHOLD、关键词得分在同一量纲
+# Chroma 默认的 L2 距离在向量未归一化时远大于1，换算出的相似度几乎都是负数
+COLLECTION_METADATA = {"hnsw:space": "cosine"}
 
 class KnowledgeBase:
     """知识库管理类"""
@@ -20,22 +45,282 @@ class KnowledgeBase:
         # 创建ChromaDB客户端
         self.client = chromadb.PersistentClient(path=CHROMA_DB_PATH)
         
-        # 设置embedding函数
-        self.embedding_function = embedding_functions.SentenceTransformerEmbeddingFunction(
-            model_name=EMBEDDING_MODEL
-        )
+        # 设置embedding函数（离线压测时用模拟向量模型，不下载模型）
+        if USE_STUB_MODELS:
+            from stubs import StubEmbeddingFunction
+            model_name = STUB_EMBEDDING_MODEL
+            self.embedding_function = StubEmbeddingFunction()
+        else:
+            model_name = EMBEDDING_MODEL
+            self.embedding_function = embedding_functions.SentenceTransformerEmbeddingFunction(
+                model_name=EMBEDDING_MODEL
+            )
         
-        # 创建或获取集合
-        self.collection = self.client.get_or_create_collection(
-            name=COLLECTION_NAME,
-            embedding_function=self.embedding_function
-        )
+        # 带磁盘缓存的向量函数：写入时自己算好向量传给 Chroma，相同内容只算一次
+        self.embedding_cache = EmbeddingCache(EMBEDDING_CACHE_DIR, model_name)
+        self.embed = CachedEmbeddingFunction(self.embedding_function, self.embedding_cache)
+        
+        # 检索缓存：查询向量 + 检索结果，结果缓存键带知识库版本号，增删文档后自动失效
+        # 版本号存在共享文件里，其他进程（gunicorn worker、导入脚本）修改知识库后本进程也能发现
+        self.version_lock = threading.Lock()
+        self.version = self._read_version_file()
+        self._version_mtime = self._version_file_mtime()
+        self.query_embedding_cache = LRUCache(QUERY_EMBEDDING_CACHE_SIZE)
+        self.search_cache = LRUCache(RETRIEVAL_CACHE_SIZE)
+        self._vocabulary = None    # ((版本号, 索引代数), 作物集合, 主题集合)
+        
+        # 创建或获取集合（旧版本建的 L2 集合会迁移成余弦距离）
+        self.collection = self._open_collection()
+        
+        # 关键词索引：启动时从向量库加载全部块，之后随增删增量更新
+        # 其他进程的修改按修改记录（KB_CHANGES_DIR）增量追上；记录不全时才在后台线程重建，
+        # 重建时在旁边建新索引、建好后一次替换，检索线程始终用完整的旧索引；
+        # 重建期间的增删同时记下来，替换前在新索引上重放
+        self.index_lock = threading.Lock()
+        self.rebuild_lock = threading.Lock()
+        self._index_pending = 0      # 进行中（含排队）的重建和增量追赶数，不为0时检索结果不写缓存
+        self._rebuild_queued = False # 已有重建在排队（还没开始读向量库），新的重建请求合并进去
+        self._index_generation = 0   # 每更新一次索引加一
+        self._index_ops = None       # 重建期间的增量修改 [(方法名, 参数)]
+        self.lexical_index = LexicalIndex()
+        self._mark_index_stale()
+        self._build_lexical_index()
         
         print(f"✅ 知识库已连接，当前文档数：{self.collection.count()}")
     
+    def _open_collection(self):
+        """
+        打开向量库集合，不是余弦距离的旧集合先迁移
+
+        加知识库文件锁：多个 gunicorn worker 同时启动时只有一个做迁移，其余等它完成后直接打开。
+        """
+        migrating = f"{COLLECTION_NAME}_cosine"
+        with self._version_file_lock():
+            try:
+                collection = self.client.get_collection(
+                    name=COLLECTION_NAME, embedding_function=self.embedding_function
+                )
+            except Exception:
+                collection = None
+
+            if collection is None:
+                try:
+                    # 上次迁移在删除旧集合之后中断：临时集合里已是完整数据
+                    collection = self.client.get_collection(
+                        name=migrating, embedding_function=self.embedding_function
+                    )
+                    collection.modify(name=COLLECTION_NAME)
+                except Exception:
+                    collection = self.client.get_or_create_collection(
+                        name=COLLECTION_NAME,
+                        embedding_function=self.embedding_function,
+                        metadata=COLLECTION_METADATA
+                    )
+            elif (collection.metadata or {}).get("hnsw:space", "l2") != COLLECTION_METADATA["hnsw:space"]:
+                collection = self._migrate_collection(collection, migrating)
+        return collection
+
+    def _migrate_collection(self, old, name, page_size=1000):
+        """把旧集合的块（连同已算好的向量）复制到余弦距离的新集合，再替换旧集合，不重新计算向量"""
+        print(f"🔄 向量库从 L2 距离迁移到余弦距离（{old.count()} 个块）...")
+        try:
+            self.client.delete_collection(name=name)    # 上次没复制完的临时集合
+        except Exception:
+            pass
+        new = self.client.create_collection(
+            name=name, embedding_function=self.embedding_function, metadata=COLLECTION_METADATA
+        )
+
+        offset = 0
+        while True:
+            page = old.get(limit=page_size, offset=offset, include=["embeddings", "documents", "metadatas"])
+            if not len(page['ids']):
+                break
+            new.add(
+                ids=page['ids'],
+                embeddings=page['embeddings'],
+                documents=page['documents'],
+                metadatas=page['metadatas']
+            )
+            offset += len(page['ids'])
+
+        self.client.delete_collection(name=COLLECTION_NAME)
+        new.modify(name=COLLECTION_NAME)
+        print("✅ 向量库迁移完成")
+        return new
+
+    # ===== 关键词索引 =====
+    
+    def _mark_index_stale(self):
+        """登记一次待更新（在公布新版本号之前调用，之后的检索不会把旧索引的结果写进新版本的缓存）"""
+        with self.index_lock:
+            self._index_pending += 1
+            if self._index_ops is None:
+                self._index_ops = []
+    
+    def _index_updated(self):
+        """一次重建或增量追赶结束（调用方持有 index_lock）"""
+        self._index_pending -= 1
+        self._index_generation += 1
+        self._index_ops = [] if self._index_pending else None
+    
+    def _build_lexical_index(self, page_size=1000, reopen=False):
+        """
+        从向量库分页读取所有块，建好新的关键词索引后替换（调用前先 _mark_index_stale）
+        
+        参数:
+            reopen: 先重新打开集合（其他进程清空知识库后，旧的集合对象已经失效）
+        """
+        with self.rebuild_lock:
+            with self.index_lock:
+                # 从这里开始的增删都会体现在下面读到的向量库里，或者记在重放列表里
+                self._index_ops = []
+                self._rebuild_queued = False
+            
+            index = None
+            try:
+                if reopen:
+                    self.collection = self._open_collection()
+                index = LexicalIndex()
+                offset = 0
+                while True:
+                    result = self.collection.get(limit=page_size, offset=offset, include=["documents", "metadatas"])
+                    if not result['ids']:
+                        break
+                    index.add(result['ids'], result['documents'], result['metadatas'] or [{}] * len(result['ids']))
+                    offset += len(result['ids'])
+            except Exception as e:
+                index = None
+                print(f"❌ 重建检索索引失败，继续使用旧索引：{e}")
+            finally:
+                with self.index_lock:
+                    if index is not None:
+                        for method, args in self._index_ops:
+                            getattr(index, method)(*args)
+                        self.lexical_index = index
+                    self._index_updated()
+    
+    def _schedule_rebuild(self):
+        """在后台线程重建关键词索引，检索继续用旧索引（已有重建在排队时合并）"""
+        with self.index_lock:
+            if self._rebuild_queued:
+                return
+            self._rebuild_queued = True
+        self._mark_index_stale()
+        threading.Thread(target=self._build_lexical_index, kwargs={"reopen": True},
+                         name="lexical-rebuild", daemon=True).start()
+    
+    def _catch_up(self, ids, parents, batch_size=1000):
+        """
+        追上其他进程的修改：按改过的块ID从向量库读取当前内容，存在的覆盖、不存在的删除
+        
+        按当前状态同步，与修改的先后顺序无关。调用前先 _mark_index_stale。
+        
+        参数:
+            ids: 写入或删除过的块ID集合
+            parents: 删除过的父文档ID集合（它们的块从本进程的索引里查）
+        """
+        try:
+            ids = set(ids) | set(parents)
+            for parent_id in parents:
+                ids |= self.lexical_index.children_of(parent_id)
+            
+            ids = list(ids)
+            for start in range(0, len(ids), batch_size):
+                batch = ids[start:start + batch_size]
+                result = self.collection.get(ids=batch, include=["documents", "metadatas"])
+                present = set(result['ids'])
+                self._update_index("remove", [chunk_id for chunk_id in batch if chunk_id not in present])
+                if result['ids']:
+                    self._update_index("add", result['ids'], result['documents'],
+                                       result['metadatas'] or [{}] * len(result['ids']))
+        except Exception as e:
+            print(f"⚠️ 增量更新检索索引失败，改为后台重建：{e}")
+            self._schedule_rebuild()
+        finally:
+            with self.index_lock:
+                self._index_updated()
+    
+    def _update_index(self, method, *args):
+        """增量修改关键词索引（add / remove / remove_parent / clear），重建期间同时记下来"""
+        with self.index_lock:
+            getattr(self.lexical_index, method)(*args)
+            if self._index_ops is not None:
+                self._index_ops.append((method, args))
+    
+    def _index_snapshot(self):
+        """检索开始时的索引和状态，结果写缓存前用 _cacheable 核对"""
+        with self.index_lock:
+            return self.lexical_index, self._index_pending, self._index_generation
+    
+    def _cacheable(self, snapshot):
+        """检索期间没有重建、也没有替换过索引，结果才能写进缓存"""
+        _, rebuilds, generation = snapshot
+        with self.index_lock:
+            return rebuilds == 0 and self._index_pending == 0 and self._index_generation == generation
+    
+    @staticmethod
+    def make_doc_id(content):
+        """根据内容生成文档ID（相同内容得到相同ID，重复添加会覆盖而不是重复）"""
+        if isinstance(content, str):
+            content = content.encode('utf-8')
+        return f"doc_{hashlib.md5(content).hexdigest()[:16]}"
+    
+    @staticmethod
+    def make_file_doc_id(filepath):
+        """根据文件内容生成文档ID（分块读取，和 make_doc_id 对同样的字节结果一致）"""
+        digest = hashlib.md5()
+        with open(filepath, 'rb') as f:
+            for block in iter(lambda: f.read(1024 * 1024), b''):
+                digest.update(block)
+        return f"doc_{digest.hexdigest()[:16]}"
+    
+    @staticmethod
+    def _chunk_metadata(doc, parent_id, index, section):
+        """生成块的元数据（父文档信息 + 块位置）"""
+        # 额外字段（如导入时的文件路径）原样写入元数据，Chroma 只接受标量值
+        metadata = {
+            key: value for key, value in doc.items()
+            if key not in ("id", "content", "crop", "topic", "source")
+            and isinstance(value, (str, int, float, bool))
+        }
+        metadata.update({
+            "crop": doc.get("crop") or "未分类",
+            "topic": doc.get("topic") or "未分类",
+            "source": doc.get("source") or "未知",
+            "parent_id": parent_id,
+            "chunk_index": index,
+            "section": section
+        })
+        return metadata
+    
+    def build_chunks(self, doc):
+        """
+        把一篇文档切成块，并给每块附上父文档元数据
+        
+        参数:
+            doc: {"content": "...", "crop": "...", "topic": "...", "source": "..."}
+        
+        返回:
+            (父文档ID, 块ID列表, 块内容列表, 块元数据列表)
+        """
+        content = doc["content"]
+        parent_id = doc.get("id") or self.make_doc_id(content)
+        
+        chunks = split_document(content, CHUNK_SIZE, CHUNK_OVERLAP) or [{"content": content, "section": ""}]
+        
+        ids, contents, metadatas = [], [], []
+        for i, chunk in enumerate(chunks):
+            # 只有一块时直接用父文档ID，和以前的单文档行为一致
+            ids.append(parent_id if len(chunks) == 1 else f"{parent_id}_{i}")
+            contents.append(chunk["content"])
+            metadatas.append(self._chunk_metadata(doc, parent_id, i, chunk["section"]))
+        
+        return parent_id, ids, contents, metadatas
+    
     def add_document(self, content, crop, topic, source="用户添加"):
         """
-        添加单个文档
+        添加单个文档（长文档会自动切块）
         
         参数:
             content: 文档内容
@@ -44,55 +329,277 @@ class KnowledgeBase:
             source: 来源
         
         返回:
-            文档ID
-        """
-        doc_id = f"doc_{self.collection.count() + 1}"
-        
-        self.collection.add(
-            documents=[content],
-            ids=[doc_id],
-            metadatas=[{
-                "crop": crop,
-                "topic": topic,
-                "source": source
-            }]
-        )
+            文档ID（父文档ID，各块元数据里的 parent_id）
+        """
+        doc_id, ids, contents, metadatas = self.build_chunks({
+            "content": content,
+            "crop": crop,
+            "topic": topic,
+            "source": source
+        })
         
-        print(f"✅ 文档已添加（ID: {doc_id}）")
+        self.upsert_chunks(ids, contents, metadatas)
+        
+        print(f"✅ 文档已添加（ID: {doc_id}，共 {len(ids)} 块）")
         return doc_id
     
-    def add_documents_batch(self, documents_list):
+    def add_documents_batch(self, documents_list, batch_size=1000):
         """
-        批量添加文档
+        批量添加文档（长文档会自动切块，所有块批量写入）
         
         参数:
             documents_list: 文档列表，每个元素是字典
                 [{"content": "...", "crop": "...", "topic": "...", "source": "..."}]
+                可选 "id" 指定父文档ID，其余字段会原样写入元数据
+            batch_size: 每次写入向量库的最大块数
         
         返回:
             添加的文档ID列表
         """
-        start_count = self.collection.count()
+        doc_ids = []
+        chunk_ids, contents, metadatas = [], [], []
+        seen = set()
+        
+        for doc in documents_list:
+            doc_id, ids, chunk_contents, chunk_metas = self.build_chunks(doc)
+            doc_ids.append(doc_id)
+            
+            # 同一批次里的重复内容只写一次
+            for chunk_id, chunk_content, meta in zip(ids, chunk_contents, chunk_metas):
+                if chunk_id in seen:
+                    continue
+                seen.add(chunk_id)
+                chunk_ids.append(chunk_id)
+                contents.append(chunk_content)
+                metadatas.append(meta)
         
-        contents = [doc["content"] for doc in documents_list]
-        ids = [f"doc_{start_count + i + 1}" for i in range(len(documents_list))]
+        # 分批写入，避免超过 Chroma 单次写入上限
+        for start in range(0, len(chunk_ids), batch_size):
+            self.upsert_chunks(
+                chunk_ids[start:start + batch_size],
+                contents[start:start + batch_size],
+                metadatas[start:start + batch_size]
+            )
+        
+        print(f"✅ 批量添加成功：{len(documents_list)} 个文档，共 {len(chunk_ids)} 块")
+        return doc_ids
+    
+    def prepare_chunks(self, doc_id, chunks, crop, topic, source="用户添加", start=0):
+        """
+        为流式切出的块生成ID和元数据（不写入）
+        
+        参数:
+            doc_id: 父文档ID
+            chunks: 块列表，每项 {"content": "...", "section": "..."}
+            crop / topic / source: 父文档元数据
+            start: 第一块的序号
+        
+        返回:
+            (块ID列表, 块内容列表, 块元数据列表)
+        """
+        doc = {"crop": crop, "topic": topic, "source": source}
+        ids = [f"{doc_id}_{start + i}" for i in range(len(chunks))]
+        contents = [chunk["content"] for chunk in chunks]
         metadatas = [
-            {
-                "crop": doc.get("crop", "未分类"),
-                "topic": doc.get("topic", "未分类"),
-                "source": doc.get("source", "未知")
-            }
-            for doc in documents_list
+            self._chunk_metadata(doc, doc_id, start + i, chunk["section"])
+            for i, chunk in enumerate(chunks)
         ]
+        return ids, contents, metadatas
+    
+    def upsert_chunks(self, ids, contents, metadatas):
+        """
+        写入（或覆盖）一批块，所有写操作都从这里进入向量库
         
-        self.collection.add(
+        参数:
+            ids: 块ID列表
+            contents: 块内容列表
+            metadatas: 块元数据列表
+        """
+        if not ids:
+            return
+        self.collection.upsert(
             documents=contents,
+            embeddings=self.embed(contents),
             ids=ids,
             metadatas=metadatas
         )
+        self._update_index("add", ids, contents, metadatas)
+        self._bump_version(ids=ids)
+    
+    # ===== 知识库版本号 =====
+    
+    @staticmethod
+    def _read_version_file():
+        """读取共享版本号（文件不存在时为0）"""
+        try:
+            with open(KB_VERSION_PATH, 'r', encoding='utf-8') as f:
+                return int(f.read().strip() or 0)
+        except (FileNotFoundError, ValueError):
+            return 0
+    
+    @staticmethod
+    def _version_file_mtime():
+        try:
+            return os.stat(KB_VERSION_PATH).st_mtime_ns
+        except FileNotFoundError:
+            return None
+    
+    @contextmanager
+    def _version_file_lock(self):
+        """线程锁 + 跨进程文件锁（Windows 上没有 fcntl 时只有线程锁）"""
+        os.makedirs(os.path.dirname(KB_VERSION_PATH) or '.', exist_ok=True)
         
-        print(f"✅ 批量添加成功：{len(documents_list)} 个文档")
-        return ids
+        with self.version_lock, open(f"{KB_VERSION_PATH}.lock", 'a') as lock_file:
+            if fcntl:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+    
+    @staticmethod
+    def _change_path(version):
+        return os.path.join(KB_CHANGES_DIR, f"{version}.json")
+    
+    def _write_change(self, version, ids, parents, clear):
+        """记下这个版本改了哪些块（持有版本号文件锁时调用），并删掉太旧的记录"""
+        os.makedirs(KB_CHANGES_DIR, exist_ok=True)
+        path = self._change_path(version)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({"ids": list(ids), "parents": list(parents), "clear": clear}, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+        
+        try:
+            os.remove(self._change_path(version - KB_CHANGE_LOG_SIZE))
+        except FileNotFoundError:
+            pass
+    
+    def _read_changes(self, start, end):
+        """
+        读取 (start, end] 版本的修改记录并合并
+        
+        返回:
+            (块ID集合, 父文档ID集合)；记录不全（落后太多、版本号文件被重置）或有清空操作时返回 None，需要整个重建
+        """
+        if end <= start or end - start > KB_CHANGE_LOG_SIZE:
+            return None
+        
+        ids, parents = set(), set()
+        for version in range(start + 1, end + 1):
+            try:
+                with open(self._change_path(version), 'r', encoding='utf-8') as f:
+                    change = json.load(f)
+            except (FileNotFoundError, ValueError):
+                return None
+            if change.get("clear"):
+                return None
+            ids.update(change.get("ids", ()))
+            parents.update(change.get("parents", ()))
+        return ids, parents
+    
+    def _follow(self, start, end):
+        """
+        准备追上其他进程在 (start, end] 版本的修改（持有 version_lock、公布新版本号之前调用）
+        
+        返回:
+            要增量同步的 (块ID集合, 父文档ID集合)；记录不全时已安排后台重建，返回 None
+        """
+        changes = self._read_changes(start, end)
+        if changes is None:
+            print(f"🔄 知识库已被其他进程修改（版本 {end}），后台重建检索索引")
+            self._schedule_rebuild()
+        else:
+            self._mark_index_stale()
+        return changes
+    
+    def _bump_version(self, ids=(), parents=(), clear=False):
+        """
+        知识库内容变化：共享版本号加一并记下修改了哪些块，旧版本的检索结果不会再被命中
+        
+        参数:
+            ids: 写入或删除的块ID
+            parents: 删除的父文档ID（连同所有块）
+            clear: 清空了知识库
+        """
+        changes = None
+        with self._version_file_lock():
+            current = self._read_version_file()
+            # 上次同步之后其他进程也改过知识库：本进程的关键词索引也要追上
+            if current != self.version:
+                changes = self._follow(self.version, current)
+            
+            self._write_change(current + 1, ids, parents, clear)
+            tmp_path = f"{KB_VERSION_PATH}.{os.getpid()}.tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                f.write(str(current + 1))
+            os.replace(tmp_path, KB_VERSION_PATH)
+            
+            self.version = current + 1
+            self._version_mtime = self._version_file_mtime()
+        
+        self.search_cache.clear()
+        if changes is not None:
+            self._catch_up(*changes)
+    
+    def sync_version(self):
+        """
+        检查其他进程是否修改过知识库（只 stat 一次版本号文件，开销很小）
+        
+        修改过就丢掉本进程的检索结果缓存，按修改记录只更新改过的块；
+        修改记录不全时在后台线程重建关键词索引，不阻塞检索。
+        
+        返回:
+            当前版本号
+        """
+        mtime = self._version_file_mtime()
+        if mtime == self._version_mtime:
+            return self.version
+        
+        with self.version_lock:
+            self._version_mtime = mtime
+            version = self._read_version_file()
+            if version == self.version:
+                return self.version
+            changes = self._follow(self.version, version)
+            self.version = version
+        
+        self.search_cache.clear()
+        if changes is not None:
+            self._catch_up(*changes)
+        return self.version
+    
+    def add_document_chunks(self, doc_id, chunks, crop, topic, source="用户添加", batch_size=64):
+        """
+        流式添加已切好的文档块（配合 document_loader.iter_document + text_splitter.split_lines）
+        
+        块边产出边写入，不需要先把全文读进内存。
+        
+        参数:
+            doc_id: 父文档ID（通常是文件内容哈希，见 make_doc_id）
+            chunks: 块的可迭代对象，每项 {"content": "...", "section": "..."}
+            crop: 作物类型
+            topic: 主题
+            source: 来源
+            batch_size: 每次写入向量库的块数
+        
+        返回:
+            写入的块数
+        """
+        chunks = iter(chunks)
+        total = 0
+        
+        while True:
+            batch = list(islice(chunks, batch_size))
+            if not batch:
+                break
+            
+            self.upsert_chunks(*self.prepare_chunks(doc_id, batch, crop, topic, source, start=total))
+            total += len(batch)
+        
+        print(f"✅ 文档已添加（ID: {doc_id}，共 {total} 块）")
+        return total
     
     def get_document(self, doc_id):
         """
@@ -105,83 +612,424 @@ class KnowledgeBase:
             文档信息（字典）
         """
         result = self.collection.get(ids=[doc_id])
-        
+
         if result['documents']:
             return {
                 "id": doc_id,
                 "content": result['documents'][0],
                 "metadata": result['metadatas'][0] if result['metadatas'] else {}
             }
+
+        # 父文档ID：按块顺序拼回全文
+        result = self.collection.get(where={"parent_id": doc_id})
+
+        if result['documents']:
+            chunks = sorted(
+                zip(result['documents'], result['metadatas']),
+                key=lambda item: item[1].get('chunk_index', 0)
+            )
+            return {
+                "id": doc_id,
+                "content": "\n".join(content for content, _ in chunks),
+                "metadata": chunks[0][1]
+            }
         else:
             return None
     
     def delete_document(self, doc_id):
         """
-        删除文档
+        删除文档（传父文档ID时会连同它的所有块一起删除）
         
         参数:
             doc_id: 文档ID
         """
         self.collection.delete(ids=[doc_id])
+        self.collection.delete(where={"parent_id": doc_id})
+        self._update_index("remove", [doc_id])
+        self._update_index("remove_parent", doc_id)
+        self._bump_version(ids=[doc_id], parents=[doc_id])
         print(f"✅ 文档已删除（ID: {doc_id}）")
     
-    def list_documents(self, limit=10):
+    @staticmethod
+    def _filters_where(filters):
+        """{"crop": ..., "topic": ...} 转成 Chroma 过滤条件"""
+        if not filters:
+            return None
+        clauses = [{key: value} for key, value in filters.items()]
+        return clauses[0] if len(clauses) == 1 else {"$and": clauses}
+    
+    def _group_parents(self, where=None, page_size=1000):
+        """
+        按父文档分组所有块（只读元数据，分页读取）
+        
+        返回:
+            {父文档ID: {"chunks": [块ID, ...], "metadata": 第一个块的元数据}}，按向量库里的顺序；
+            切块之前添加的整篇文档没有 parent_id，自己就是父文档
+        """
+        parents = {}
+        offset = 0
+        while True:
+            result = self.collection.get(where=where, limit=page_size, offset=offset, include=["metadatas"])
+            if not result['ids']:
+                break
+            for chunk_id, metadata in zip(result['ids'], result['metadatas'] or [{}] * len(result['ids'])):
+                metadata = metadata or {}
+                group = parents.setdefault(metadata.get('parent_id') or chunk_id,
+                                           {"chunks": [], "metadata": metadata})
+                group["chunks"].append(chunk_id)
+            offset += len(result['ids'])
+        return parents
+    
+    def count_documents(self, filters=None):
+        """文档数（按父文档计，不是块数）"""
+        return len(self._group_parents(self._filters_where(filters)))
+    
+    def list_documents(self, limit=10, offset=0, filters=None):
         """
-        列出所有文档
+        列出文档（每个父文档一条，内容按块顺序拼回全文，与 get_document 相同）
         
         参数:
             limit: 最多显示数量
+            offset: 跳过前面多少篇文档（分页）
+            filters: 元数据筛选，如 {"crop": "小麦", "topic": "施肥"}
         
         返回:
-            文档列表
+            文档列表，每项 {"id": 父文档ID, "content", "metadata", "chunk_count"}；
+            删除时用这里的 id，会连同所有块一起删除
         """
-        count = self.collection.count()
-        
-        if count == 0:
+        if self.collection.count() == 0:
             print("⚠️ 知识库为空")
             return []
         
-        # 获取所有文档
-        result = self.collection.get(limit=min(limit, count))
+        page = list(self._group_parents(self._filters_where(filters)).items())[offset:offset + limit]
+        if not page:
+            return []
+        
+        # 本页所有文档的块一次读出
+        result = self.collection.get(ids=[chunk_id for _, group in page for chunk_id in group["chunks"]],
+                                     include=["documents", "metadatas"])
+        chunks = {
+            chunk_id: (content, metadata or {})
+            for chunk_id, content, metadata in zip(result['ids'], result['documents'],
+                                                   result['metadatas'] or [{}] * len(result['ids']))
+        }
         
         documents = []
-        for i in range(len(result['ids'])):
+        for parent_id, group in page:
+            parts = sorted((chunks[chunk_id] for chunk_id in group["chunks"] if chunk_id in chunks),
+                           key=lambda item: item[1].get('chunk_index', 0))
+            if not parts:
+                continue
             documents.append({
-                "id": result['ids'][i],
-                "content": result['documents'][i],
-                "metadata": result['metadatas'][i] if result['metadatas'] else {}
+                "id": parent_id,
+                "content": "\n".join(content for content, _ in parts),
+                "metadata": parts[0][1],
+                "chunk_count": len(parts)
             })
         
         return documents
     
-    def search(self, query, n_results=5):
+    @staticmethod
+    def normalize_query(query):
+        """规范化查询文本（去掉多余空白、统一大小写），作为缓存键"""
+        return ' '.join(query.split()).lower()
+    
+    def embed_query(self, query):
         """
-        搜索相关文档
+        计算查询向量（带 LRU 缓存）
+        
+        参数:
+            query: 规范化后的查询文本
+        
+        返回:
+            向量
+        """
+        return self.embed_queries([query])[0]
+    
+    def embed_queries(self, queries):
+        """
+        批量计算查询向量（未命中缓存的查询一次性交给模型）
+        
+        参数:
+            queries: 规范化后的查询文本列表
+        
+        返回:
+            向量列表（与输入顺序一致）
+        """
+        embeddings = {}
+        for query in queries:
+            if query not in embeddings:
+                embeddings[query] = self.query_embedding_cache.get(query)
+        
+        missing = [query for query, embedding in embeddings.items() if embedding is None]
+        if missing:
+            for query, embedding in zip(missing, self.embedding_function(missing)):
+                embeddings[query] = embedding
+                self.query_embedding_cache.put(query, embedding)
+        
+        return [embeddings[query] for query in queries]
+    
+    def _search_key(self, normalized, n_results, where, mode="hybrid"):
+        """检索结果缓存键（带知识库版本号）"""
+        return (
+            normalized,
+            n_results,
+            json.dumps(where, sort_keys=True, ensure_ascii=False) if where else None,
+            mode,
+            self.version
+        )
+    
+    @staticmethod
+    def _format_results(results, row=0):
+        """把 Chroma 查询结果的第 row 个查询整理成结果列表"""
+        search_results = []
+        for i in range(len(results['ids'][row])):
+            search_results.append({
+                "id": results['ids'][row][i],
+                "content": results['documents'][row][i],
+                "distance": results['distances'][row][i],
+                # 余弦距离 0~2，相似度截到 0~1
+                "similarity": max(0.0, 1 - results['distances'][row][i]),
+                "metadata": results['metadatas'][row][i] if results['metadatas'] else {}
+            })
+        return search_results
+    
+    def search(self, query, n_results=5, where=None, mode="hybrid"):
+        """
+        搜索相关文档（查询向量和检索结果都有缓存）
         
         参数:
             query: 查询文本
             n_results: 返回结果数量
+            where: Chroma 元数据过滤条件（可选）
+            mode: hybrid（向量 + 关键词融合，默认）/ vector（只用向量）/ lexical（只用关键词，不跑模型）
         
         返回:
             搜索结果列表
         """
-        results = self.collection.query(
-            query_texts=[query],
-            n_results=n_results
-        )
+        return self.search_many([query], n_results, where=[where], mode=mode)[0]
+    
+    def search_many(self, queries, n_results=5, where=None, mode="hybrid"):
+        """
+        批量搜索：所有查询一次向量化、一次向量库查询
+        
+        结果和 search 共用缓存，先批量检索再逐个调用 search（如 RAG 问答）会直接命中。
+        
+        参数:
+            queries: 查询文本列表
+            n_results: 每个查询返回的结果数量
+            where: Chroma 元数据过滤条件（可选）；传一个字典对所有查询生效，
+                   传列表则逐个对应（过滤条件相同的查询合并成一次向量库查询）
+            mode: 检索方式，同 search
+        
+        返回:
+            搜索结果列表的列表（与输入顺序一致）
+        """
+        if mode not in SEARCH_MODES:
+            raise ValueError(f"不支持的检索方式：{mode}")
+        
+        self.sync_version()
+        # 重建索引期间（或检索途中替换了索引）的结果只返回，不写缓存
+        snapshot = self._index_snapshot()
+        index = snapshot[0]
+        wheres = where if isinstance(where, list) else [where] * len(queries)
+        normalized = [self.normalize_query(query) for query in queries]
+        keys = [self._search_key(query, n_results, w, mode) for query, w in zip(normalized, wheres)]
+        
+        found = {}
+        filters = {}
+        for key, w in zip(keys, wheres):
+            if key not in found:
+                found[key] = self.search_cache.get(key)
+                filters[key] = w
+        
+        missing = [key for key, cached in found.items() if cached is None]
+        
+        if missing and mode == "lexical":
+            for key in missing:
+                found[key] = self._lexical_results(index, key[0], n_results, filters[key])
+                if self._cacheable(snapshot):
+                    self.search_cache.put(key, found[key])
+        
+        elif missing:
+            # 混合检索时两路各多取一些候选，融合后再截取前 n_results 个
+            pool = n_results if mode == "vector" else max(n_results * 3, 20)
+            
+            # 所有未命中的查询一次向量化，再按过滤条件分组查询
+            embeddings = dict(zip(missing, self.embed_queries([key[0] for key in missing])))
+            groups = {}
+            for key in missing:
+                groups.setdefault(key[2], []).append(key)
+            
+            for group in groups.values():
+                results = self.collection.query(
+                    query_embeddings=[embeddings[key] for key in group],
+                    n_results=pool,
+                    where=filters[group[0]]
+                )
+                for row, key in enumerate(group):
+                    vector_results = self._format_results(results, row)
+                    if mode == "hybrid":
+                        lexical_hits = index.search(key[0], pool, filters[key])
+                        vector_results = self._fuse(index, vector_results, lexical_hits, n_results)
+                    found[key] = vector_results
+                    if self._cacheable(snapshot):
+                        self.search_cache.put(key, found[key])
+        
+        return [[dict(item) for item in found[key]] for key in keys]
+    
+    @staticmethod
+    def _lexical_results(index, query, n_results, where):
+        """关键词检索结果（相似度为归一化后的 BM25 分数）"""
+        hits = index.search(query, n_results, where)
+        top = hits[0][1] if hits else 1.0
         
         search_results = []
-        for i in range(len(results['ids'][0])):
+        for chunk_id, score in hits:
+            entry = index.get(chunk_id)
+            if entry is None:
+                continue
+            similarity = score / top
             search_results.append({
-                "id": results['ids'][0][i],
-                "content": results['documents'][0][i],
-                "distance": results['distances'][0][i],
-                "similarity": 1 - results['distances'][0][i],
-                "metadata": results['metadatas'][0][i] if results['metadatas'] else {}
+                "id": chunk_id,
+                "content": entry[0],
+                "distance": 1 - similarity,
+                "similarity": similarity,
+                "lexical_score": similarity,
+                "score": similarity,
+                "metadata": entry[1]
             })
-        
         return search_results
     
+    @staticmethod
+    def _fuse(index, vector_results, lexical_hits, n_results):
+        """
+        融合向量结果和关键词结果
+        
+        得分 = (1 - 权重) × 向量相似度 + 权重 × 归一化 BM25 分数；
+        只被关键词命中的块，向量相似度按向量候选里的最低值计。
+        """
+        weight = HYBRID_LEXICAL_WEIGHT
+        top = lexical_hits[0][1] if lexical_hits else 1.0
+        floor = min((r["similarity"] for r in vector_results), default=0.0)
+        
+        candidates = {r["id"]: dict(r, lexical_score=0.0) for r in vector_results}
+        for chunk_id, score in lexical_hits:
+            if chunk_id in candidates:
+                candidates[chunk_id]["lexical_score"] = score / top
+                continue
+            entry = index.get(chunk_id)
+            if entry is None:
+                continue
+            candidates[chunk_id] = {
+                "id": chunk_id,
+                "content": entry[0],
+                "distance": 1 - floor,
+                "similarity": floor,
+                "lexical_score": score / top,
+                "metadata": entry[1]
+            }
+        
+        for item in candidates.values():
+            item["score"] = (1 - weight) * item["similarity"] + weight * item["lexical_score"]
+        
+        return sorted(candidates.values(), key=lambda item: item["score"], reverse=True)[:n_results]
+    
+    @staticmethod
+    def make_where(crop=None, topic=None):
+        """
+        根据作物/主题生成 Chroma 过滤条件
+        
+        返回:
+            where 字典，都没有指定时返回 None
+        """
+        conditions = []
+        if crop:
+            conditions.append({"crop": crop})
+        if topic:
+            conditions.append({"topic": topic})
+        
+        if not conditions:
+            return None
+        return conditions[0] if len(conditions) == 1 else {"$and": conditions}
+    
+    def get_vocabulary(self):
+        """
+        知识库里已有的作物和主题
+        
+        从关键词索引里的元数据统计，不访问向量库；按版本号和索引代数缓存，
+        文档有增删或索引更新后重新统计。
+        
+        返回:
+            (作物集合, 主题集合)
+        """
+        self.sync_version()
+        with self.index_lock:
+            key = (self.version, self._index_generation)
+            index = self.lexical_index
+        if self._vocabulary is None or self._vocabulary[0] != key:
+            crops, topics = index.values('crop', 'topic', default='未分类')
+            self._vocabulary = (key, crops, topics)
+        return self._vocabulary[1], self._vocabulary[2]
+    
+    def detect_crops(self, question):
+        """
+        识别问题里明确提到的作物（作物名或别名，如 麦子 → 小麦）
+        
+        只识别知识库里已有文档的作物，没有相关文档时不做过滤。
+        
+        参数:
+            question: 用户问题
+        
+        返回:
+            作物列表
+        """
+        crops, _ = self.get_vocabulary()
+        found = []
+        for crop in sorted(crops):
+            if crop == "未分类":
+                continue
+            names = [crop] + CROP_ALIASES.get(crop, [])
+            if any(name in question for name in names):
+                found.append(crop)
+        return found
+    
+    def detect_filter(self, question):
+        """
+        根据问题自动生成检索过滤条件
+        
+        问题提到作物时只检索这些作物和未分类的通用文档；主题不自动过滤
+        （同一个问题常常跨主题，比如“小麦播种前怎么施肥”）。
+        
+        参数:
+            question: 用户问题
+        
+        返回:
+            where 字典，没有识别到作物时返回 None
+        """
+        crops = self.detect_crops(question)
+        if not crops:
+            return None
+        return {"crop": {"$in": crops + ["未分类"]}}
+    
+    def get_cache_stats(self):
+        """
+        检索缓存统计
+        
+        返回:
+            {"query_embedding": {...}, "search": {...}, "version": 知识库版本号}
+        """
+        return {
+            "query_embedding": self.query_embedding_cache.get_stats(),
+            "search": self.search_cache.get_stats(),
+            "version": self.version
+        }
+    
+    def clear_cache(self):
+        """清空检索缓存（查询向量 + 检索结果）"""
+        self.query_embedding_cache.clear(reset_stats=True)
+        self.search_cache.clear(reset_stats=True)
+    
     def get_stats(self):
         """
         获取知识库统计信息
@@ -194,19 +1042,20 @@ class KnowledgeBase:
         if count == 0:
             return {
                 "total": 0,
+                "chunks": 0,
                 "crops": {},
                 "topics": {}
             }
         
-        # 获取所有文档元数据
-        all_docs = self.collection.get()
-        metadatas = all_docs['metadatas']
+        # 按父文档统计（只读元数据），一篇文档切成多块也只算一篇
+        parents = self._group_parents()
         
         # 统计作物和主题分布
         crops = {}
         topics = {}
         
-        for meta in metadatas:
+        for group in parents.values():
+            meta = group["metadata"]
             crop = meta.get('crop', '未分类')
             topic = meta.get('topic', '未分类')
             
@@ -214,7 +1063,8 @@ class KnowledgeBase:
             topics[topic] = topics.get(topic, 0) + 1
         
         return {
-            "total": count,
+            "total": len(parents),
+            "chunks": count,
             "crops": crops,
             "topics": topics
         }
@@ -227,9 +1077,14 @@ class KnowledgeBase:
         # 重新创建
         self.collection = self.client.get_or_create_collection(
             name=COLLECTION_NAME,
-            embedding_function=self.embedding_function
+            embedding_function=self.embedding_function,
+            metadata=COLLECTION_METADATA
         )
         
+        self._update_index("clear")
+        self._bump_version(clear=True)
+        
+        # 向量缓存不清空：重新导入同样的内容时直接复用
         print("⚠️ 知识库已清空")
 
 # ===== 测试代码 =====
@@ -0,0 +1,218 @@
+# lexical_index.py - 关键词倒排索引
+# 功能：按中文字符二元组（bigram）建立内存倒排索引，用 BM25 打分
+#       弥补向量检索对农药名、病害名等精确词不敏感的问题，也可以不跑模型直接检索
+
+import heapq
+import math
+import re
+import threading
+from collections import Counter
+
+# 连续的汉字，或连续的字母/数字（如 50%多菌灵 → "50"、"多菌"、"菌灵"）
+_TOKEN_RE = re.compile(r'[\u4e00-\u9fff]+|[a-z0-9]+(?:\.[0-9]+)?')
+
+
+def tokenize(text):
+    """
+    切词：汉字按二元组切分，字母数字按整词
+
+    参数:
+        text: 文本
+
+    返回:
+        词列表（可重复）
+    """
+    tokens = []
+    for run in _TOKEN_RE.findall(text.lower()):
+        if '\u4e00' <= run[0] <= '\u9fff':
+            if len(run) == 1:
+                tokens.append(run)
+            else:
+                tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+        else:
+            tokens.append(run)
+    return tokens
+
+
+def match_where(metadata, where):
+    """
+    判断元数据是否满足 Chroma 风格的过滤条件（支持 等值、$in、$and、$or）
+
+    参数:
+        metadata: 元数据字典
+        where: 过滤条件，None 表示不过滤
+
+    返回:
+        True / False
+    """
+    if not where:
+        return True
+    if "$and" in where:
+        return all(match_where(metadata, w) for w in where["$and"])
+    if "$or" in where:
+        return any(match_where(metadata, w) for w in where["$or"])
+
+    for key, condition in where.items():
+        value = metadata.get(key)
+        if isinstance(condition, dict):
+            if "$in" in condition and value not in condition["$in"]:
+                return False
+            if "$nin" in condition and value in condition["$nin"]:
+                return False
+            if "$eq" in condition and value != condition["$eq"]:
+                return False
+            if "$ne" in condition and value == condition["$ne"]:
+                return False
+        elif value != condition:
+            return False
+    return True
+
+
+class LexicalIndex:
+    """BM25 倒排索引（线程安全，支持增量添加和删除）"""
+
+    def __init__(self, k1=1.5, b=0.75):
+        """
+        参数:
+            k1: BM25 词频饱和参数
+            b: BM25 文档长度归一化参数
+        """
+        self.k1 = k1
+        self.b = b
+        self.lock = threading.Lock()
+        self.clear()
+
+    def clear(self):
+        """清空索引"""
+        with self.lock:
+            self.postings = {}      # 词 → {块ID: 词频}
+            self.doc_terms = {}     # 块ID → Counter（删除时用）
+            self.doc_len = {}       # 块ID → 词数
+            self.docs = {}          # 块ID → (内容, 元数据)，检索结果直接从这里返回
+            self.children = {}      # 父文档ID → {块ID}
+            self.total_len = 0
+
+    def __len__(self):
+        return len(self.docs)
+
+    # ===== 增删 =====
+
+    def add(self, ids, contents, metadatas):
+        """添加（或覆盖）一批块"""
+        with self.lock:
+            for doc_id, content, metadata in zip(ids, contents, metadatas):
+                metadata = metadata or {}
+                self._remove(doc_id)
+
+                terms = Counter(tokenize(content))
+                for term, tf in terms.items():
+                    self.postings.setdefault(term, {})[doc_id] = tf
+
+                length = sum(terms.values())
+                self.doc_terms[doc_id] = terms
+                self.doc_len[doc_id] = length
+                self.docs[doc_id] = (content, metadata)
+                self.total_len += length
+
+                parent_id = metadata.get("parent_id")
+                if parent_id:
+                    self.children.setdefault(parent_id, set()).add(doc_id)
+
+    def remove(self, ids):
+        """删除一批块"""
+        with self.lock:
+            for doc_id in ids:
+                self._remove(doc_id)
+
+    def remove_parent(self, parent_id):
+        """删除一个父文档的所有块"""
+        with self.lock:
+            for doc_id in list(self.children.get(parent_id, ())):
+                self._remove(doc_id)
+
+    def children_of(self, parent_id):
+        """一个父文档已索引的块ID"""
+        with self.lock:
+            return set(self.children.get(parent_id, ()))
+
+    def values(self, *keys, default=None):
+        """
+        已索引的块里某些元数据字段出现过的值（只读内存，不访问向量库）
+
+        参数:
+            keys: 元数据字段名
+            default: 字段缺失时记为的值
+
+        返回:
+            每个字段一个集合
+        """
+        with self.lock:
+            return tuple({metadata.get(key, default) for _, metadata in self.docs.values()} for key in keys)
+
+    def _remove(self, doc_id):
+        """删除一个块（调用方持有锁）"""
+        terms = self.doc_terms.pop(doc_id, None)
+        if terms is None:
+            return
+
+        for term in terms:
+            posting = self.postings.get(term)
+            if posting is not None:
+                posting.pop(doc_id, None)
+                if not posting:
+                    del self.postings[term]
+
+        self.total_len -= self.doc_len.pop(doc_id)
+        _, metadata = self.docs.pop(doc_id)
+
+        parent_id = metadata.get("parent_id")
+        if parent_id in self.children:
+            self.children[parent_id].discard(doc_id)
+            if not self.children[parent_id]:
+                del self.children[parent_id]
+
+    # ===== 检索 =====
+
+    def search(self, query, n_results=5, where=None):
+        """
+        BM25 检索
+
+        参数:
+            query: 查询文本
+            n_results: 返回结果数量
+            where: Chroma 风格的元数据过滤条件（可选）
+
+        返回:
+            [(块ID, 分数)]，按分数从高到低
+        """
+        terms = set(tokenize(query))
+
+        with self.lock:
+            total = len(self.docs)
+            if not total or not terms:
+                return []
+            avg_len = self.total_len / total
+
+            scores = {}
+            for term in terms:
+                posting = self.postings.get(term)
+                if not posting:
+                    continue
+                df = len(posting)
+                idf = math.log(1 + (total - df + 0.5) / (df + 0.5))
+                for doc_id, tf in posting.items():
+                    norm = self.k1 * (1 - self.b + self.b * self.doc_len[doc_id] / avg_len)
+                    scores[doc_id] = scores.get(doc_id, 0.0) + idf * tf * (self.k1 + 1) / (tf + norm)
+
+            if where:
+                scores = {
+                    doc_id: score for doc_id, score in scores.items()
+                    if match_where(self.docs[doc_id][1], where)
+                }
+
+            return heapq.nlargest(n_results, scores.items(), key=lambda item: item[1])
+
+    def get(self, doc_id):
+        """获取块的 (内容, 元数据)，不存在时返回 None"""
+        with self.lock:
+            return self.docs.get(doc_id)
@@ -0,0 +1,165 @@
+# llm_scheduler.py - 大模型调用调度
+# 功能：所有大模型调用都经过这里，限制同时进行的调用数，按优先级排队
+#       交互式问答优先于批量分析；队列满或等太久时直接拒绝（接口返回 503 + Retry-After），
+#       避免一批分析请求把服务商的限流额度用完、卡住正在聊天的用户
+
+import math
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+from config import LLM_MAX_CONCURRENCY, LLM_QUEUE_LIMITS, LLM_QUEUE_TIMEOUT
+
+# 优先级从高到低
+PRIORITIES = ("interactive", "batch")
+
+
+class SchedulerBusy(Exception):
+    """调度器饱和（队列已满或排队超时）"""
+
+    def __init__(self, message, retry_after):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class LLMScheduler:
+    """
+    带优先级的大模型调用调度器（线程安全）
+
+    - 同时进行的调用数不超过 max_concurrency
+    - 有空位时总是先放行高优先级队列的队首，同一优先级先到先得
+    - 每个优先级有自己的队列长度上限，排队超过 max_wait 秒放弃
+    """
+
+    def __init__(self, max_concurrency=LLM_MAX_CONCURRENCY, queue_limits=LLM_QUEUE_LIMITS, max_wait=LLM_QUEUE_TIMEOUT):
+        """
+        参数:
+            max_concurrency: 最多同时进行的调用数
+            queue_limits: 各优先级的排队上限，如 {"interactive": 32, "batch": 8}
+            max_wait: 最长排队秒数
+        """
+        self.max_concurrency = max_concurrency
+        self.queue_limits = dict(queue_limits)
+        self.max_wait = max_wait
+        self.cond = threading.Condition()
+        self.running = 0
+        self.queues = {priority: deque() for priority in PRIORITIES}
+        self.avg_duration = 5.0    # 单次调用耗时的滑动平均（秒），用来估算 Retry-After
+        self.stats = {priority: {
+            'admitted': 0,
+            'rejected': 0,
+            'timeouts': 0,
+            'wait_total': 0.0,
+            'wait_max': 0.0
+        } for priority in PRIORITIES}
+
+    def _head(self):
+        """下一个应该放行的排队请求（调用方持有锁）"""
+        for priority in PRIORITIES:
+            if self.queues[priority]:
+                return self.queues[priority][0]
+        return None
+
+    def _retry_after(self):
+        """估算多久以后再试（秒）：排在前面的调用按当前并发数跑完需要的时间"""
+        waiting = sum(len(queue) for queue in self.queues.values())
+        seconds = self.avg_duration * (waiting + 1) / self.max_concurrency
+        return max(1, min(60, math.ceil(seconds)))
+
+    def acquire(self, priority="interactive"):
+        """
+        占用一个调用名额（必要时排队等待）
+
+        参数:
+            priority: 优先级，"interactive" 或 "batch"
+
+        返回:
+            排队等待的秒数
+
+        异常:
+            SchedulerBusy: 队列已满或排队超时
+        """
+        if priority not in self.queues:
+            raise ValueError(f"未知的优先级：{priority}")
+
+        start = time.monotonic()
+        stats = self.stats[priority]
+        with self.cond:
+            queue = self.queues[priority]
+            if len(queue) >= self.queue_limits.get(priority, 0) and \
+                    (self.running >= self.max_concurrency or self._head() is not None):
+                stats['rejected'] += 1
+                raise SchedulerBusy("服务繁忙，请稍后重试", self._retry_after())
+
+            ticket = object()
+            queue.append(ticket)
+            try:
+                while self.running >= self.max_concurrency or self._head() is not ticket:
+                    remaining = start + self.max_wait - time.monotonic()
+                    if remaining <= 0:
+                        stats['timeouts'] += 1
+                        raise SchedulerBusy("排队超时，请稍后重试", self._retry_after())
+                    self.cond.wait(remaining)
+            finally:
+                queue.remove(ticket)
+                self.cond.notify_all()    # 队首变了，让下一个请求重新检查
+
+            self.running += 1
+            waited = time.monotonic() - start
+            stats['admitted'] += 1
+            stats['wait_total'] += waited
+            stats['wait_max'] = max(stats['wait_max'], waited)
+            return waited
+
+    def release(self, duration=None):
+        """
+        归还调用名额
+
+        参数:
+            duration: 本次调用耗时（秒），用于更新平均耗时
+        """
+        with self.cond:
+            self.running -= 1
+            if duration is not None:
+                self.avg_duration = 0.8 * self.avg_duration + 0.2 * duration
+            self.cond.notify_all()
+
+    @contextmanager
+    def slot(self, priority="interactive"):
+        """
+        占用一个调用名额的上下文管理器
+
+        用法:
+            with scheduler.slot("batch"):
+                llm.invoke(prompt)
+        """
+        self.acquire(priority)
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.release(time.monotonic() - start)
+
+    def get_stats(self):
+        """调度统计：并发数、各优先级的队列深度和等待时间"""
+        with self.cond:
+            classes = {}
+            for priority in PRIORITIES:
+                stats = self.stats[priority]
+                admitted = stats['admitted']
+                classes[priority] = {
+                    'queued': len(self.queues[priority]),
+                    'queue_limit': self.queue_limits.get(priority, 0),
+                    'admitted': admitted,
+                    'rejected': stats['rejected'],
+                    'timeouts': stats['timeouts'],
+                    'avg_wait': round(stats['wait_total'] / admitted, 3) if admitted else 0.0,
+                    'max_wait': round(stats['wait_max'], 3)
+                }
+            return {
+                'running': self.running,
+                'max_concurrency': self.max_concurrency,
+                'avg_duration': round(self.avg_duration, 3),
+                'classes': classes
+            }
@@ -1,13 +1,22 @@
 # models.py - 数据库模型（完整版 - 包含分析历史）
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import inspect, text
 from datetime import datetime, timedelta
 
+from crop_rollup import CropStatsMixin, Rollup, summarize
+
 db = SQLAlchemy()
 
 # ===== 作物模型（核心）=====
 class Crop(db.Model):
     """作物 - 一个作物就是一个完整的生命周期"""
     __tablename__ = 'crops'
+    __table_args__ = (
+        # 列表按 (创建时间, id) 游标分页，可按状态、类型筛选
+        db.Index('ix_crops_created', 'created_at', 'id'),
+        db.Index('ix_crops_status_created', 'status', 'created_at', 'id'),
+        db.Index('ix_crops_type_created', 'crop_type', 'created_at', 'id'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     
@@ -40,13 +49,12 @@ class Crop(db.Model):
     # 关联：分析历史
     analysis_histories = db.relationship('AnalysisHistory', backref='crop', lazy=True, cascade='all, delete-orphan')
     
+    # 关联：统计汇总（查询作物时一起连接查出）
+    stats = db.relationship('CropStats', uselist=False, lazy='joined', cascade='all', passive_deletes=True)
+    
     def get_growth_days(self):
         """计算生长天数"""
-        if not self.planting_date:
-            return 0
-        
-        end_date = self.actual_harvest_date or datetime.now().date()
-        return (end_date - self.planting_date).days
+        return growth_days(self.planting_date, self.actual_harvest_date)
     
     def get_latest_record(self):
         """获取最新记录"""
@@ -71,21 +79,14 @@ class Crop(db.Model):
         return round(sum(humidities) / len(humidities), 1) if humidities else None
     
     def to_dict(self):
-        """转换为字典"""
+        """转换为字典（记录数、平均值、最新记录读汇总表 crop_stats，不加载记录）"""
+        summary = summarize(self.stats) if self.stats is not None else self._live_summary()
+        return crop_dict(self, summary)
+    
+    def _live_summary(self):
+        """还没有汇总时（升级前的数据，应用启动时会补齐）直接按记录计算"""
         latest = self.get_latest_record()
-        
         return {
-            'id': self.id,
-            'name': self.name,
-            'crop_type': self.crop_type,
-            'variety': self.variety,
-            'area': self.area,
-            'planting_date': self.planting_date.strftime('%Y-%m-%d') if self.planting_date else None,
-            'expected_harvest_date': self.expected_harvest_date.strftime('%Y-%m-%d') if self.expected_harvest_date else None,
-            'actual_harvest_date': self.actual_harvest_date.strftime('%Y-%m-%d') if self.actual_harvest_date else None,
-            'status': self.status,
-            'notes': self.notes,
-            'growth_days': self.get_growth_days(),
             'record_count': len(self.daily_records),
             'event_count': len(self.events),
             'avg_temperature_7d': self.get_avg_temperature(7),
@@ -93,16 +94,91 @@ class Crop(db.Model):
             'latest_temperature': latest.temperature if latest else None,
             'latest_humidity': latest.humidity if latest else None,
             'latest_date': latest.date.strftime('%Y-%m-%d') if latest else None,
-            'created_at': self.created_at.strftime('%Y-%m-%d %H:%M:%S')
+            'season': None
         }
     
     def __repr__(self):
         return f'<Crop {self.name}>'
 
+
+def growth_days(planting_date, actual_harvest_date=None):
+    """从种植到收获（未收获时到今天）的天数"""
+    if not planting_date:
+        return 0
+    
+    end_date = actual_harvest_date or datetime.now().date()
+    return (end_date - planting_date).days
+
+
+def crop_dict(crop, summary):
+    """
+    作物字段加上汇总字段
+    
+    参数:
+        crop: Crop 对象，或带同名列的查询结果行
+        summary: crop_rollup.summarize 的返回值
+    """
+    fmt_date = lambda d: d.strftime('%Y-%m-%d') if d else None
+    return {
+        'id': crop.id,
+        'name': crop.name,
+        'crop_type': crop.crop_type,
+        'variety': crop.variety,
+        'area': crop.area,
+        'planting_date': fmt_date(crop.planting_date),
+        'expected_harvest_date': fmt_date(crop.expected_harvest_date),
+        'actual_harvest_date': fmt_date(crop.actual_harvest_date),
+        'status': crop.status,
+        'notes': crop.notes,
+        'growth_days': growth_days(crop.planting_date, crop.actual_harvest_date),
+        'record_count': summary['record_count'],
+        'event_count': summary['event_count'],
+        'avg_temperature_7d': summary['avg_temperature_7d'],
+        'avg_humidity_7d': summary['avg_humidity_7d'],
+        'latest_temperature': summary['latest_temperature'],
+        'latest_humidity': summary['latest_humidity'],
+        'latest_date': summary['latest_date'],
+        'season': summary['season'],
+        'created_at': crop.created_at.strftime('%Y-%m-%d %H:%M:%S')
+    }
+
+
+def crop_summaries(crop_ids=None):
+    """
+    作物列表（作物表连接汇总表 crop_stats，一条 SQL，每个作物 O(1)，不创建 ORM 对象）
+    
+    参数:
+        crop_ids: 只查这些作物（分页时传入当前页的作物ID），None 表示全部
+    
+    返回:
+        字典列表（与 Crop.to_dict 相同）；给了 crop_ids 时按 crop_ids 的顺序，否则按创建时间倒序
+    """
+    query = db.select(*Crop.__table__.c, *CropStats.__table__.c)\
+        .outerjoin(CropStats, CropStats.crop_id == Crop.id)\
+        .order_by(Crop.created_at.desc())
+    if crop_ids is not None:
+        query = query.where(Crop.id.in_(crop_ids))
+    
+    summaries = []
+    for row in db.session.execute(query):
+        if row.crop_id is None:
+            # 还没有汇总：按记录计算
+            summaries.append(db.session.get(Crop, row.id).to_dict())
+        else:
+            summaries.append(crop_dict(row, summarize(row)))
+    
+    if crop_ids is not None:
+        by_id = {summary['id']: summary for summary in summaries}
+        summaries = [by_id[crop_id] for crop_id in crop_ids if crop_id in by_id]
+    return summaries
+
 # ===== 每日记录模型 =====
 class DailyRecord(db.Model):
     """每日记录 - 快速记录每天的数据"""
     __tablename__ = 'daily_records'
+    __table_args__ = (
+        db.Index('ix_daily_records_crop_date', 'crop_id', 'date', 'id'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     crop_id = db.Column(db.Integer, db.ForeignKey('crops.id'), nullable=False)
@@ -168,6 +244,10 @@ class CropEvent(db.Model):
 class AnalysisHistory(db.Model):
     """AI分析历史记录"""
     __tablename__ = 'analysis_history'
+    __table_args__ = (
+        db.Index('ix_analysis_history_fingerprint', 'crop_id', 'data_fingerprint'),
+        db.Index('ix_analysis_history_crop_date', 'crop_id', 'analysis_date', 'id'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     crop_id = db.Column(db.Integer, db.ForeignKey('crops.id'), nullable=False)
@@ -185,6 +265,9 @@ class AnalysisHistory(db.Model):
     # 完整分析内容（JSON）
     full_analysis = db.Column(db.Text)
     
+    # 数据指纹：分析所用的记录、事件和参数的哈希，数据没变时直接复用这条分析
+    data_fingerprint = db.Column(db.String(40))
+    
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     
     def to_dict(self):
@@ -202,4 +285,49 @@ class AnalysisHistory(db.Model):
         }
     
     def __repr__(self):
-        return f'<AnalysisHistory {self.id} - {self.analysis_date}>'
\ No newline at end of file
+        return f'<AnalysisHistory {self.id} - {self.analysis_date}>'
+
+
+# ===== 作物统计汇总 =====
+class CropStats(CropStatsMixin, db.Model):
+    """作物统计汇总（每日记录、事件增删改时自动更新，见 crop_rollup.py）"""
+    __tablename__ = 'crop_stats'
+    
+    crop_id = db.Column(db.Integer, db.ForeignKey('crops.id', ondelete='CASCADE'), primary_key=True)
+    
+    def __repr__(self):
+        return f'<CropStats {self.crop_id}>'
+
+
+# 每次 flush 时在同一个事务里更新汇总
+stats_rollup = Rollup(CropStats, DailyRecord, Crop, crop_key='crop_id',
+                      event_model=CropEvent, harvest_key='actual_harvest_date')
+stats_rollup.install(db.session)
+
+
+# ===== 数据库升级 =====
+def upgrade_schema():
+    """
+    给已有的数据库补上模型里新增的列和索引（db.create_all 只建新表，不会修改已有的表）
+    
+    只能自动添加可以为空的列；需要在应用上下文里、db.create_all() 之后调用。
+    """
+    inspector = inspect(db.engine)
+    for table in db.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        
+        existing = {column['name'] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in existing:
+                continue
+            if not column.nullable:
+                print(f"⚠️ 数据库升级：{table.name}.{column.name} 不能为空，需要手动迁移")
+                continue
+            column_type = column.type.compile(dialect=db.engine.dialect)
+            db.session.execute(text(f'ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}'))
+            print(f"🔧 数据库升级：{table.name} 新增列 {column.name}")
+        db.session.commit()
+        
+        for index in table.indexes:
+            index.create(db.engine, checkfirst=True)
\ No newline at end of file
@@ -0,0 +1,193 @@
+# pagination.py - 列表分页
+# 功能：列表接口的游标（keyset）分页：按 (日期, id) 或 (创建时间, id) 排序，
+#       下一页从上一页最后一行之后接着查（WHERE (date, id) < 上一页最后的值），配合索引每页耗时固定，
+#       不像 OFFSET 那样越往后越慢，翻页期间有新数据插入也不会重复或漏掉
+#       游标是 base64 编码的 JSON，客户端原样传回即可
+
+import base64
+import json
+from datetime import date, datetime
+
+from sqlalchemy import and_, or_
+
+from config import PAGE_SIZE_DEFAULT, PAGE_SIZE_MAX, SEARCH_N_RESULTS_MAX
+
+ORDERS = ("desc", "asc")
+
+
+class InvalidPageArgs(ValueError):
+    """分页或筛选参数不合法（接口返回 400）"""
+
+
+def _encode(payload):
+    raw = json.dumps(payload, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def _decode(cursor):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        payload = json.loads(raw.decode('utf-8'))
+    except (ValueError, TypeError):
+        raise InvalidPageArgs("无效的游标")
+    if not isinstance(payload, dict):
+        raise InvalidPageArgs("无效的游标")
+    return payload
+
+
+def _dump_value(value):
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()
+    return value
+
+
+def _load_value(value, column):
+    """把游标里的值转回列的类型（日期/时间在 JSON 里是字符串）"""
+    if value is None:
+        raise InvalidPageArgs("无效的游标")
+    try:
+        python_type = column.type.python_type
+    except NotImplementedError:
+        return value
+    try:
+        if python_type is datetime:
+            return datetime.fromisoformat(value)
+        if python_type is date:
+            return date.fromisoformat(value)
+    except (TypeError, ValueError):
+        raise InvalidPageArgs("无效的游标")
+    return value
+
+
+def page_args(args):
+    """
+    从请求参数里读取分页参数
+
+    参数:
+        args: request.args
+
+    返回:
+        (limit, cursor, order)；limit 限制在 1 到 PAGE_SIZE_MAX 之间，order 为 "desc"（默认，新的在前）或 "asc"
+
+    异常:
+        InvalidPageArgs: 参数不合法
+    """
+    try:
+        limit = int(args.get('limit', PAGE_SIZE_DEFAULT))
+    except (TypeError, ValueError):
+        raise InvalidPageArgs("limit 必须是整数")
+    limit = max(1, min(limit, PAGE_SIZE_MAX))
+
+    order = args.get('order', 'desc').lower()
+    if order not in ORDERS:
+        raise InvalidPageArgs("order 只能是 desc 或 asc")
+
+    return limit, args.get('cursor') or None, order
+
+
+def result_count(data, default):
+    """
+    从请求体里读取检索结果数 n_results
+
+    参数:
+        data: 请求体（JSON 字典）
+        default: 没传时的默认值
+
+    返回:
+        限制在 1 到 SEARCH_N_RESULTS_MAX 之间的整数
+
+    异常:
+        InvalidPageArgs: 不是整数
+    """
+    try:
+        n_results = int(data.get('n_results', default))
+    except (TypeError, ValueError):
+        raise InvalidPageArgs("n_results 必须是整数")
+    return max(1, min(n_results, SEARCH_N_RESULTS_MAX))
+
+
+def parse_date(value, name):
+    """
+    解析日期筛选参数（YYYY-MM-DD）
+
+    返回:
+        date 对象，参数为空时返回 None
+
+    异常:
+        InvalidPageArgs: 格式不对
+    """
+    if not value:
+        return None
+    try:
+        return datetime.strptime(value, '%Y-%m-%d').date()
+    except ValueError:
+        raise InvalidPageArgs(f"{name} 的格式应为 YYYY-MM-DD")
+
+
+def _after(columns, values, descending):
+    """排在游标之后的行：(c1, c2) < (v1, v2) 展开成 c1 < v1 OR (c1 = v1 AND c2 < v2)"""
+    conditions = []
+    for i, (column, value) in enumerate(zip(columns, values)):
+        beyond = column < value if descending else column > value
+        conditions.append(and_(*[c == v for c, v in zip(columns[:i], values[:i])], beyond))
+    return or_(*conditions)
+
+
+def keyset_page(query, columns, limit, cursor=None, order="desc"):
+    """
+    按游标取一页
+
+    参数:
+        query: 已加好筛选条件、还没有排序的查询（Query 对象）
+        columns: 排序列，最后一列必须唯一（通常是 id），各列都不能为空，如 [DailyRecord.date, DailyRecord.id]
+        limit: 每页条数
+        cursor: 上一页返回的 next_cursor，第一页为 None
+        order: "desc" 或 "asc"
+
+    返回:
+        (本页的行, 下一页的游标)；没有下一页时游标为 None
+
+    异常:
+        InvalidPageArgs: 游标不合法或与排序方式不匹配
+    """
+    descending = order == "desc"
+    if cursor:
+        payload = _decode(cursor)
+        keys = payload.get("k")
+        if payload.get("o") != order or not isinstance(keys, list) or len(keys) != len(columns):
+            raise InvalidPageArgs("游标与当前排序方式不匹配，请从第一页重新开始")
+        values = [_load_value(value, column) for value, column in zip(keys, columns)]
+        query = query.filter(_after(columns, values, descending))
+
+    query = query.order_by(*[column.desc() if descending else column.asc() for column in columns])
+    rows = query.limit(limit + 1).all()
+
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    last = rows[-1]
+    return rows, _encode({"k": [_dump_value(getattr(last, column.key)) for column in columns], "o": order})
+
+
+def offset_page(cursor, limit, fetch):
+    """
+    不支持按列排序的数据源（如向量库）用偏移量分页，游标格式与 keyset_page 相同
+
+    参数:
+        cursor: 上一页返回的 next_cursor，第一页为 None
+        limit: 每页条数
+        fetch: fetch(offset, count) 返回从 offset 开始最多 count 条
+
+    返回:
+        (本页的条目, 下一页的游标)
+    """
+    offset = 0
+    if cursor:
+        offset = _decode(cursor).get("offset")
+        if not isinstance(offset, int) or offset < 0:
+            raise InvalidPageArgs("无效的游标")
+
+    items = fetch(offset, limit + 1)
+    if len(items) <= limit:
+        return items, None
+    return items[:limit], _encode({"offset": offset + limit})
@@ -1,7 +1,15 @@
 # rag_engine.py - RAG检索增强生成引擎
 from langchain_community.chat_models import ChatTongyi
+from context_builder import build_context, estimate_tokens
+from semantic_cache import SemanticCache
+from cache_backend import create_answer_cache
+from single_flight import SingleFlight, FlightAbandoned
+from llm_scheduler import LLMScheduler, SchedulerBusy
+from config import SINGLE_FLIGHT_TIMEOUT, USE_STUB_MODELS
 import os
+import json
 import hashlib
+import threading
 
 class RAGEngine:
     """RAG检索增强生成引擎"""
@@ -11,15 +19,30 @@ class RAGEngine:
         self.kb = knowledge_base
         self.llm = self._init_llm()
         
-        # 缓存系统
-        self.cache = {}
+        # 缓存系统（默认进程内 + SQLite 两级，所有 worker 共享，重启后仍然有效）
+        self.cache = create_answer_cache()
         self.cache_hits = 0
         self.cache_misses = 0
+        self.stats_lock = threading.Lock()    # 多线程处理请求时保证计数准确
+        
+        # 语义缓存：问法不同、意思相同的问题复用回答
+        self.semantic_cache = SemanticCache()
+        
+        # 并发请求合并：相同缓存键（或相同提示词）的请求同时到达时只调用一次大模型
+        self.flights = SingleFlight(timeout=SINGLE_FLIGHT_TIMEOUT)
+        
+        # 大模型调用调度：限制并发，交互式问答优先于批量分析
+        self.scheduler = LLMScheduler()
         
         print("✅ RAG引擎已初始化")
     
     def _init_llm(self):
         """初始化大语言模型"""
+        if USE_STUB_MODELS:
+            from stubs import StubChatModel
+            print("🧪 使用离线模拟大模型（AGRI_STUB_MODELS=1）")
+            return StubChatModel()
+        
         # 🔑 在这里替换你的新API Key
         api_key = os.getenv('DASHSCOPE_API_KEY', "sk-20f85e700899477b82bcbb00713108d9")
         
@@ -40,45 +63,163 @@ class RAGEngine:
             print("💡 请检查API Key是否有效：https://dashscope.console.aliyun.com/apiKey")
             raise Exception(f"模型初始化失败: {str(e)}")
     
-    def _get_cache_key(self, query):
-        """生成查询的缓存键"""
-        return hashlib.md5(query.encode('utf-8')).hexdigest()
+    def _get_cache_key(self, question, doc_ids, history=None):
+        """
+        生成回答的缓存键
+        
+        参数:
+            question: 用户问题（规范化后参与计算）
+            doc_ids: 检索到的文档ID（ID是内容哈希，文档被修改、删除或有更相关的新文档时都会变化）
+            history: 放进提示词的对话历史，没有历史时为 None
+        
+        返回:
+            缓存键
+        """
+        payload = json.dumps({
+            "question": self.kb.normalize_query(question),
+            "docs": sorted(doc_ids),
+            "history": history
+        }, ensure_ascii=False, sort_keys=True)
+        return hashlib.md5(payload.encode('utf-8')).hexdigest()
     
-    def query(self, question, chat_history=None, show_sources=False):
-        """RAG查询（带缓存和错误处理）"""
+    def query(self, question, chat_history=None, show_sources=False, priority="interactive"):
+        """
+        RAG查询（带缓存和错误处理）
+        
+        调度器饱和时抛出 SchedulerBusy，由接口返回 503，其他错误转成提示文字返回。
+        """
         try:
-            # 检查缓存
-            cache_key = self._get_cache_key(question)
+            prepared = self._prepare(question, chat_history)
+            if "answer" in prepared:
+                return prepared["answer"]
             
-            if cache_key in self.cache:
-                self.cache_hits += 1
-                total = self.cache_hits + self.cache_misses
-                print(f"🚀 缓存命中！(命中率: {self.cache_hits}/{total} = {self.cache_hits/total*100:.1f}%)")
-                return self.cache[cache_key]
+            # 调用LLM（同一缓存键的并发请求共享这一次调用）
+            return self.flights.do(prepared["cache_key"], lambda: self._generate(prepared, priority))
             
-            self.cache_misses += 1
+        except SchedulerBusy:
+            raise
+        except Exception as e:
+            return self.describe_error(e)
+    
+    def stream_query(self, question, chat_history=None, priority="interactive"):
+        """
+        流式RAG查询（生成器，边生成边产出文本片段）
+        
+        缓存命中时一次性产出完整回答；生成完毕后把完整回答写入缓存。
+        调用方提前关闭生成器（如客户端断开连接）时，会关闭大模型的流式连接，
+        不再为没人看的内容付费，不完整的回答也不会写入缓存。
+        同一缓存键已有回答在生成时，等它生成完一次性产出，不再重复调用大模型。
+        出错时直接抛出异常（调度器饱和时是 SchedulerBusy），可以用 describe_error 转成提示文字。
+        
+        参数:
+            question: 用户问题
+            chat_history: 对话历史
+            priority: 调度优先级
+        
+        返回:
+            生成器，每项是一段文本
+        """
+        prepared = self._prepare(question, chat_history)
+        if "answer" in prepared:
+            yield prepared["answer"]
+            return
+        
+        key = prepared["cache_key"]
+        while True:
+            future, leader = self.flights.join(key)
+            if leader:
+                break
+            try:
+                yield self.flights.wait(future)
+                return
+            except FlightAbandoned:
+                continue    # 正在生成的请求被放弃了，重新竞争
+        
+        stream = None
+        error = FlightAbandoned("流式回答未完成")
+        try:
+            # 流式回答在整个生成过程中占用一个调用名额
+            with self.scheduler.slot(priority):
+                stream = self.llm.stream(prepared["prompt"])
+                parts = []
+                for chunk in stream:
+                    if chunk.content:
+                        parts.append(chunk.content)
+                        yield chunk.content
             
-            # 1. 检索相关文档
+            result = ''.join(parts).strip()
+            self._remember(prepared, result)
+            self.flights.finish(key, future, result)
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            close = getattr(stream, 'close', None)
+            if close:
+                close()
+            self.flights.finish(key, future, error=error)
+    
+    def _prepare(self, question, chat_history=None):
+        """
+        检索、查缓存并构建提示词
+        
+        返回:
+            {"answer": ...}：可以直接返回的回答（缓存命中或知识库无结果）
+            否则 {"prompt", "question", "cache_key", "query_embedding", "doc_ids", "context_info"}
+            （context_info 是本次请求的上下文统计：保留的文档数、句子数、token 数等）
+        """
+        # 1. 检索相关文档（问题提到作物时只检索该作物的文档，检索不到再放开过滤）
+        #    检索结果本身有缓存，先检索再查回答缓存开销很小
+        where = self.kb.detect_filter(question)
+        relevant_docs = self.kb.search(question, n_results=5, where=where)
+        if where and not relevant_docs:
             relevant_docs = self.kb.search(question, n_results=5)
-            
-            if not relevant_docs:
-                result = "抱歉，我的知识库中没有找到相关信息。你可以尝试换个方式提问，或者联系管理员添加相关知识。"
-                return result
-            
-            # 2. 构建上下文
-            context = "\n\n".join([
-                f"【文档{i+1} - {doc['metadata'].get('crop', '未分类')}】\n{doc['content']}"
-                for i, doc in enumerate(relevant_docs)
+        
+        if not relevant_docs:
+            return {"answer": "抱歉，我的知识库中没有找到相关信息。你可以尝试换个方式提问，或者联系管理员添加相关知识。"}
+        
+        # 2. 回答缓存：规范化问题 + 检索到的文档 + 对话历史
+        #    有对话历史时总是放进提示词（“用量是多少”这类追问不一定带指代词，看不出是否依赖上文），
+        #    缓存键也带上历史，只有同一段对话里的重复提问才会命中；没有历史的问题在不同对话里共用回答
+        doc_ids = [doc['id'] for doc in relevant_docs]
+        history = self._recent_history(chat_history)
+        cache_key = self._get_cache_key(question, doc_ids, history)
+        
+        cached_answer = self.cache.get(cache_key)
+        if cached_answer is not None:
+            with self.stats_lock:
+                self.cache_hits += 1
+                hits, total = self.cache_hits, self.cache_hits + self.cache_misses
+            print(f"🚀 缓存命中！(命中率: {hits}/{total} = {hits/total*100:.1f}%)")
+            return {"answer": cached_answer}
+        
+        with self.stats_lock:
+            self.cache_misses += 1
+        
+        # 语义缓存：意思相近且检索到的文档完全相同时直接复用回答（有对话历史时不用）
+        query_embedding = None
+        if not history:
+            # 检索时已经算过查询向量，这里直接从查询向量缓存取
+            query_embedding = self.kb.embed_query(self.kb.normalize_query(question))
+            cached = self.semantic_cache.lookup(query_embedding, doc_ids)
+            if cached:
+                answer, score, cached_question = cached
+                print(f"🧠 语义缓存命中（相似度 {score:.3f}，原问题：{cached_question}）")
+                return {"answer": answer}
+        
+        # 3. 构建上下文（过滤低相似度、去重、按 token 预算挑句子）
+        context, context_info = build_context(question, relevant_docs)
+        if not context:
+            context = "（知识库中没有找到足够相关的资料）"
+        
+        # 4. 构建prompt
+        if history:
+            chat_context = history if isinstance(history, str) else "\n".join([
+                f"{'用户' if msg['role'] == 'user' else 'AI'}：{msg['content']}"
+                for msg in history
             ])
             
-            # 3. 构建prompt
-            if chat_history and len(chat_history) > 0:
-                chat_context = "\n".join([
-                    f"{'用户' if msg['role'] == 'user' else 'AI'}：{msg['content']}"
-                    for msg in chat_history[-5:]
-                ])
-                
-                prompt = f"""你是农宝🌾，一位专业、友好的农业AI助手。
+            prompt = f"""你是农宝🌾，一位专业、友好的农业AI助手。
 
 【对话历史】
 {chat_context}
@@ -97,8 +238,8 @@ class RAGEngine:
 5. 150-300字左右
 
 请回答："""
-            else:
-                prompt = f"""你是农宝🌾，一位专业、友好的农业AI助手。
+        else:
+            prompt = f"""你是农宝🌾，一位专业、友好的农业AI助手。
 
 【相关知识】
 {context}
@@ -114,46 +255,106 @@ class RAGEngine:
 5. 150-300字左右
 
 请回答："""
-            
-            # 4. 调用LLM
-            response = self.llm.invoke(prompt)
-            result = response.content.strip()
-            
-            # 存入缓存（最多100条）
-            if len(self.cache) >= 100:
-                oldest_key = next(iter(self.cache))
-                del self.cache[oldest_key]
-            
-            self.cache[cache_key] = result
-            return result
-            
-        except Exception as e:
-            error_msg = str(e)
-            
-            # API Key错误
-            if "InvalidApiKey" in error_msg or "401" in error_msg:
-                return "❌ API Key无效或已过期！\n\n请管理员访问以下链接更新API Key：\nhttps://dashscope.console.aliyun.com/apiKey"
-            
-            # 其他错误
-            return f"😔 抱歉，AI回答时出现错误：{error_msg}\n\n请稍后重试或联系管理员。"
+        
+        context_info["prompt_tokens"] = estimate_tokens(prompt)
+        print(f"📏 上下文：{context_info['documents']}/{context_info['retrieved']} 个文档，"
+              f"{context_info['sentences']} 句，约 {context_info['tokens']} tokens"
+              f"（提示词约 {context_info['prompt_tokens']} tokens）")
+        
+        return {
+            "prompt": prompt,
+            "question": question,
+            "cache_key": cache_key,
+            "query_embedding": query_embedding,
+            "doc_ids": doc_ids,
+            "context_info": context_info
+        }
+    
+    def _generate(self, prepared, priority="interactive"):
+        """调用大模型生成回答并写入缓存"""
+        with self.scheduler.slot(priority):
+            response = self.llm.invoke(prepared["prompt"])
+        result = response.content.strip()
+        self._remember(prepared, result)
+        return result
+    
+    def invoke_shared(self, prompt, priority="batch"):
+        """
+        调用大模型（提示词完全相同的并发请求只调用一次，共享结果）
+        
+        供作物分析等不走知识库检索的接口使用。
+        
+        参数:
+            prompt: 提示词
+            priority: 调度优先级，批量分析用 "batch"，对话类用 "interactive"
+        
+        返回:
+            模型回答文本（已去掉首尾空白）
+        
+        异常:
+            SchedulerBusy: 调度器饱和
+        """
+        def call():
+            with self.scheduler.slot(priority):
+                return self.llm.invoke(prompt).content.strip()
+        
+        key = "prompt:" + hashlib.md5(prompt.encode('utf-8')).hexdigest()
+        return self.flights.do(key, call)
+    
+    def _remember(self, prepared, result):
+        """把生成的回答写入缓存（过期时间和容量上限由缓存后端控制）"""
+        if not result:
+            return
+        self.cache.set(prepared["cache_key"], result)
+        if prepared["query_embedding"] is not None:
+            self.semantic_cache.put(prepared["question"], prepared["query_embedding"], prepared["doc_ids"], result)
+    
+    @staticmethod
+    def describe_error(error):
+        """把异常转换成给用户看的提示文字"""
+        error_msg = str(error)
+        
+        # API Key错误
+        if "InvalidApiKey" in error_msg or "401" in error_msg:
+            return "❌ API Key无效或已过期！\n\n请管理员访问以下链接更新API Key：\nhttps://dashscope.console.aliyun.com/apiKey"
+        
+        # 其他错误
+        return f"😔 抱歉，AI回答时出现错误：{error_msg}\n\n请稍后重试或联系管理员。"
+    
+    @staticmethod
+    def _recent_history(chat_history):
+        """提示词里使用的最近几条对话（列表取最近5条；命令行传入的是字符串，原样使用）"""
+        if not chat_history:
+            return None
+        if isinstance(chat_history, str):
+            return chat_history
+        return [{"role": msg['role'], "content": msg['content']} for msg in chat_history[-5:]]
     
     def get_cache_stats(self):
         """获取缓存统计"""
-        total = self.cache_hits + self.cache_misses
-        hit_rate = (self.cache_hits / total * 100) if total > 0 else 0
+        with self.stats_lock:
+            hits, misses = self.cache_hits, self.cache_misses
+        total = hits + misses
+        hit_rate = (hits / total * 100) if total > 0 else 0
         return {
-            'hits': self.cache_hits,
-            'misses': self.cache_misses,
+            'hits': hits,
+            'misses': misses,
             'total_queries': total,
             'hit_rate': f'{hit_rate:.1f}%',
-            'cache_size': len(self.cache)
+            'backend': self.cache.get_stats(),
+            'semantic': self.semantic_cache.get_stats(),
+            'single_flight': self.flights.get_stats(),
+            'retrieval': self.kb.get_cache_stats()
         }
     
     def clear_cache(self):
         """清空缓存"""
-        self.cache = {}
-        self.cache_hits = 0
-        self.cache_misses = 0
+        self.cache.clear()
+        with self.stats_lock:
+            self.cache_hits = 0
+            self.cache_misses = 0
+        self.semantic_cache.clear(reset_stats=True)
+        self.kb.clear_cache()
         print("🧹 缓存已清空")
 
 
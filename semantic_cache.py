@@ -0,0 +1,109 @@
+# semantic_cache.py - 语义答案缓存
+# 功能：问法不同但意思相同的问题（如“小麦什么时候播种？”和“小麦几月播种”）复用已有回答
+#       缓存的问题向量放在一个矩阵里，查询时一次矩阵乘法算出所有余弦相似度
+
+import threading
+
+import numpy as np
+
+from config import SEMANTIC_CACHE_THRESHOLD, SEMANTIC_CACHE_SIZE
+
+
+class SemanticCache:
+    """语义答案缓存（线程安全，固定容量，满了以后覆盖最早的条目）"""
+
+    def __init__(self, threshold=SEMANTIC_CACHE_THRESHOLD, maxsize=SEMANTIC_CACHE_SIZE):
+        """
+        参数:
+            threshold: 余弦相似度阈值，达到才算命中
+            maxsize: 最多缓存的问题数
+        """
+        self.threshold = threshold
+        self.maxsize = maxsize
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self._reset()
+
+    def _reset(self):
+        self.matrix = None                    # (maxsize, 向量维度)，每行是归一化后的问题向量
+        self.entries = [None] * self.maxsize  # 每行对应的 (问题, 文档ID集合, 回答)
+        self.count = 0
+        self.next_slot = 0
+
+    def clear(self, reset_stats=False):
+        """清空缓存（reset_stats=True 时连统计一起清零）"""
+        with self.lock:
+            self._reset()
+            if reset_stats:
+                self.hits = 0
+                self.misses = 0
+
+    @staticmethod
+    def _normalize(embedding):
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def lookup(self, embedding, doc_ids):
+        """
+        查找语义相近的已缓存问题
+
+        只有检索到的文档集合完全相同时才返回缓存的回答，
+        避免相似问题因为知识库内容不同而拿到过时或不对应的答案。
+
+        参数:
+            embedding: 问题向量
+            doc_ids: 本次检索到的文档ID列表
+
+        返回:
+            (回答, 相似度, 缓存的原问题)，未命中时返回 None
+        """
+        query = self._normalize(embedding)
+        doc_key = frozenset(doc_ids)
+
+        with self.lock:
+            if self.count:
+                scores = self.matrix[:self.count] @ query
+                candidates = np.flatnonzero(scores >= self.threshold)
+                for row in candidates[np.argsort(-scores[candidates])]:
+                    question, cached_docs, answer = self.entries[row]
+                    if cached_docs == doc_key:
+                        self.hits += 1
+                        return answer, float(scores[row]), question
+
+            self.misses += 1
+            return None
+
+    def put(self, question, embedding, doc_ids, answer):
+        """
+        写入缓存
+
+        参数:
+            question: 原问题
+            embedding: 问题向量
+            doc_ids: 回答所依据的文档ID列表
+            answer: 回答
+        """
+        vector = self._normalize(embedding)
+
+        with self.lock:
+            if self.matrix is None:
+                self.matrix = np.zeros((self.maxsize, vector.shape[0]), dtype=np.float32)
+
+            slot = self.next_slot
+            self.matrix[slot] = vector
+            self.entries[slot] = (question, frozenset(doc_ids), answer)
+            self.next_slot = (slot + 1) % self.maxsize
+            self.count = min(self.count + 1, self.maxsize)
+
+    def get_stats(self):
+        """缓存统计"""
+        total = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': f'{(self.hits / total * 100) if total else 0:.1f}%',
+            'cache_size': self.count,
+            'threshold': self.threshold
+        }
@@ -0,0 +1,105 @@
+# single_flight.py - 并发请求合并
+# 功能：相同键的请求同时到达时只执行一次，其余请求等待同一个结果（single-flight）
+#       用于大模型调用：群里转发的同一个问题几秒内涌进来几十次，只调用一次大模型
+
+import threading
+from concurrent.futures import Future
+
+
+class FlightAbandoned(Exception):
+    """执行中的请求被放弃（如流式回答的客户端断开），没有产生结果"""
+
+
+class SingleFlight:
+    """并发请求合并器（线程安全）"""
+
+    def __init__(self, timeout=None):
+        """
+        参数:
+            timeout: 等待其他请求结果的最长秒数，None 表示一直等
+        """
+        self.timeout = timeout
+        self.lock = threading.Lock()
+        self.calls = {}       # 键 → 正在执行的 Future
+        self.leaders = 0      # 实际执行的次数
+        self.followers = 0    # 被合并（等待别人结果）的次数
+
+    def join(self, key):
+        """
+        加入某个键的执行
+
+        返回:
+            (future, leader)：leader 为 True 时调用方负责执行，完成后必须调用 finish；
+            否则等待 future 的结果即可
+        """
+        with self.lock:
+            future = self.calls.get(key)
+            if future is not None:
+                self.followers += 1
+                return future, False
+
+            future = Future()
+            self.calls[key] = future
+            self.leaders += 1
+            return future, True
+
+    def finish(self, key, future, result=None, error=None):
+        """
+        结束一次执行，把结果（或异常）交给所有等待者
+
+        重复调用时忽略，方便放在 finally 里兜底。
+        """
+        with self.lock:
+            if self.calls.get(key) is future:
+                del self.calls[key]
+            if future.done():
+                return
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
+
+    def wait(self, future):
+        """等待其他请求的结果（对方出错时抛出同样的异常）"""
+        return future.result(self.timeout)
+
+    def do(self, key, fn):
+        """
+        执行 fn()，相同键的并发调用共享一次执行的结果
+
+        执行者出错时所有等待者都收到同一个异常（额度用完等错误不会被重试放大）；
+        执行者放弃时，等待者重新竞争执行。
+
+        参数:
+            key: 合并键
+            fn: 无参函数
+
+        返回:
+            fn() 的返回值
+        """
+        while True:
+            future, leader = self.join(key)
+            if not leader:
+                try:
+                    return self.wait(future)
+                except FlightAbandoned:
+                    continue
+
+            try:
+                result = fn()
+            except BaseException as e:
+                self.finish(key, future, error=e if isinstance(e, Exception) else FlightAbandoned(str(e)))
+                raise
+            self.finish(key, future, result)
+            return result
+
+    def get_stats(self):
+        """合并统计"""
+        with self.lock:
+            total = self.leaders + self.followers
+            return {
+                'executions': self.leaders,
+                'coalesced': self.followers,
+                'in_flight': len(self.calls),
+                'coalesce_rate': f'{(self.followers / total * 100) if total else 0:.1f}%'
+            }
@@ -0,0 +1,109 @@
+# stubs.py - 离线模拟模型
+# 功能：代替通义千问（ChatTongyi）和 HuggingFace 向量模型，用于压测和 CI
+#       不联网、不需要 API Key，相同输入总是得到相同输出；延迟和生成速度可配置
+#       设置环境变量 AGRI_STUB_MODELS=1 后，KnowledgeBase 和 RAGEngine 自动使用这里的实现
+
+import hashlib
+import random
+import time
+
+import numpy as np
+from chromadb.api.types import EmbeddingFunction
+
+from config import (
+    STUB_EMBEDDING_DIM, STUB_EMBEDDING_LATENCY,
+    STUB_LLM_LATENCY, STUB_LLM_TOKENS_PER_SEC, STUB_LLM_ANSWER_TOKENS
+)
+from lexical_index import tokenize
+
+# 模拟回答用的短语（每个约 2 个 token）
+_PHRASES = [
+    "适时", "播种", "浇水", "追肥", "除草", "防治", "病害", "虫害", "土壤", "墒情",
+    "温度", "湿度", "光照", "通风", "排水", "施用", "氮肥", "磷肥", "钾肥", "有机肥",
+    "注意", "观察", "长势", "叶片", "根系", "分蘖", "拔节", "抽穗", "灌浆", "收获"
+]
+
+
+class StubMessage:
+    """模拟的模型消息（与 langchain 消息一样有 content 属性）"""
+
+    def __init__(self, content):
+        self.content = content
+
+
+class StubChatModel:
+    """
+    模拟的大模型（接口与 ChatTongyi 的 invoke / stream 相同）
+
+    回答由提示词的哈希决定，等待 latency 秒后按 tokens_per_sec 的速度生成 answer_tokens 个 token。
+    """
+
+    def __init__(self, latency=STUB_LLM_LATENCY, tokens_per_sec=STUB_LLM_TOKENS_PER_SEC,
+                 answer_tokens=STUB_LLM_ANSWER_TOKENS):
+        """
+        参数:
+            latency: 第一个 token 之前的延迟（秒）
+            tokens_per_sec: 生成速度，0 表示不限速
+            answer_tokens: 回答长度（token 数）
+        """
+        self.latency = latency
+        self.tokens_per_sec = tokens_per_sec
+        self.answer_tokens = answer_tokens
+
+    def _tokens(self, prompt):
+        """根据提示词生成确定的 token 序列"""
+        seed = int(hashlib.md5(str(prompt).encode('utf-8')).hexdigest()[:8], 16)
+        rng = random.Random(seed)
+        count = max(self.answer_tokens // 2, 1)
+        tokens = ["🌾（离线模拟回答）"]
+        tokens += [rng.choice(_PHRASES) + ("，" if i % 6 == 5 else "") for i in range(count)]
+        tokens.append("。")
+        return tokens
+
+    def _generate_seconds(self, tokens):
+        return len(tokens) * 2 / self.tokens_per_sec if self.tokens_per_sec else 0
+
+    def invoke(self, prompt):
+        tokens = self._tokens(prompt)
+        time.sleep(self.latency + self._generate_seconds(tokens))
+        return StubMessage(''.join(tokens))
+
+    def stream(self, prompt):
+        tokens = self._tokens(prompt)
+        time.sleep(self.latency)
+        delay = 2 / self.tokens_per_sec if self.tokens_per_sec else 0
+        for token in tokens:
+            if delay:
+                time.sleep(delay)
+            yield StubMessage(token)
+
+
+class StubEmbeddingFunction(EmbeddingFunction):
+    """
+    模拟的向量模型（特征哈希）
+
+    把文本切成词（与关键词索引相同的二元组），每个词哈希到一个维度上累加，再归一化。
+    共享词越多的文本余弦相似度越高，检索结果有意义，而且完全确定、不需要下载模型。
+    """
+
+    def __init__(self, dim=STUB_EMBEDDING_DIM, latency=STUB_EMBEDDING_LATENCY):
+        """
+        参数:
+            dim: 向量维度
+            latency: 每次调用的模拟耗时（秒）
+        """
+        self.dim = dim
+        self.latency = latency
+
+    def _embed(self, text):
+        vector = np.zeros(self.dim, dtype=np.float32)
+        for token in tokenize(text) or [text]:
+            digest = hashlib.md5(token.encode('utf-8')).digest()
+            vector[int.from_bytes(digest[:4], 'little') % self.dim] += 1.0
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def __call__(self, input):
+        if self.latency:
+            time.sleep(self.latency)
+        return [self._embed(text).tolist() for text in input]
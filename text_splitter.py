@@ -0,0 +1,209 @@
+# text_splitter.py - 文档切分模块
+# 功能：按 ##/### 标题结构把长文档切成适合向量化的小块（带重叠）
+
+import re
+from config import CHUNK_SIZE, CHUNK_OVERLAP
+
+# Markdown 标题：# 一级 / ## 二级 / ### 三级
+HEADING_PATTERN = re.compile(r'^(#{1,6})\s+(.+?)\s*#*\s*$')
+
+# 句子边界：中英文句末标点之后
+SENTENCE_PATTERN = re.compile(r'[^。！？；!?;]*[。！？；!?;]?')
+
+# 章节路径的分隔符（写入块内容和元数据）
+SECTION_SEPARATOR = " > "
+
+
+def iter_sections(lines):
+    """
+    按标题把文本行分组为章节
+
+    参数:
+        lines: 文本行的可迭代对象（可以是生成器）
+
+    返回:
+        生成器，每项是 (标题路径列表, 正文行列表)
+    """
+    path = []
+    body = []
+
+    for line in lines:
+        line = line.rstrip('\r\n')
+        match = HEADING_PATTERN.match(line.strip())
+
+        if match:
+            if any(l.strip() for l in body):
+                yield list(path), body
+            body = []
+
+            level = len(match.group(1))
+            # 截断到上一级，再压入当前标题
+            path = path[:level - 1]
+            path += [''] * (level - 1 - len(path))
+            path.append(match.group(2).strip())
+        else:
+            body.append(line)
+
+    if any(l.strip() for l in body):
+        yield list(path), body
+
+
+def _split_units(text):
+    """把正文拆成句子/行级别的最小单元"""
+    units = []
+    for line in text.split('\n'):
+        line = line.strip()
+        if not line:
+            continue
+        for sentence in SENTENCE_PATTERN.findall(line):
+            if sentence.strip():
+                units.append(sentence.strip())
+    return units
+
+
+def split_text(text, chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP):
+    """
+    把一段正文按句子切成带重叠的窗口
+
+    参数:
+        text: 正文
+        chunk_size: 每块最大字数
+        chunk_overlap: 相邻块重叠字数
+
+    返回:
+        文本块列表
+    """
+    chunk_size = max(chunk_size, 1)
+    chunk_overlap = max(0, min(chunk_overlap, chunk_size // 2))
+
+    # 超长句子先硬切
+    units = []
+    for unit in _split_units(text):
+        if len(unit) <= chunk_size:
+            units.append(unit)
+        else:
+            step = chunk_size - chunk_overlap
+            units.extend(unit[i:i + chunk_size] for i in range(0, len(unit) - chunk_overlap, step))
+
+    chunks = []
+    window = []
+    size = 0
+
+    for unit in units:
+        # 块内句子用换行连接，换行也计入字数
+        if window and size + len(window) + len(unit) > chunk_size:
+            chunks.append('\n'.join(window))
+
+            # 保留窗口尾部的句子作为重叠部分
+            tail = []
+            tail_size = 0
+            for prev in reversed(window):
+                if tail_size + len(prev) > chunk_overlap or tail_size + len(tail) + len(prev) + len(unit) + 1 > chunk_size:
+                    break
+                tail.insert(0, prev)
+                tail_size += len(prev)
+            window, size = tail, tail_size
+
+        window.append(unit)
+        size += len(unit)
+
+    if window:
+        chunks.append('\n'.join(window))
+
+    return chunks
+
+
+def split_lines(lines, chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP):
+    """
+    按标题结构切分文档（流式）
+
+    同一个二级标题（##）下的小节会尽量合并到一块，
+    超过 chunk_size 的章节再按句子切成带重叠的窗口。
+    每块开头都带上章节路径，方便向量检索命中。
+
+    参数:
+        lines: 文本行的可迭代对象
+        chunk_size: 每块最大字数（含章节路径）
+        chunk_overlap: 相邻块重叠字数
+
+    返回:
+        生成器，每项是 {"content": ..., "section": ...}
+    """
+    group = None      # 当前合并组（标题 + 二级标题）
+    buffer = []       # 当前合并组内已缓存的小节文本
+    buffer_size = 0
+
+    def flush():
+        header = SECTION_SEPARATOR.join(p for p in group if p)
+        body = '\n'.join(buffer)
+        return {
+            "content": f"{header}\n{body}" if header else body,
+            "section": header
+        }
+
+    for path, body_lines in iter_sections(lines):
+        body = '\n'.join(l.strip() for l in body_lines if l.strip())
+
+        # 三级及以下标题作为正文的第一行保留
+        sub_titles = [p for p in path[2:] if p]
+        text = '\n'.join(sub_titles + [body])
+        section_group = tuple(path[:2])
+        header = SECTION_SEPARATOR.join(p for p in section_group if p)
+        budget = max(chunk_size - len(header) - 1, chunk_size // 2)
+
+        # 能合并进当前组就合并
+        if buffer and section_group == group and buffer_size + len(text) + 1 <= budget:
+            buffer.append(text)
+            buffer_size += len(text) + 1
+            continue
+
+        if buffer:
+            yield flush()
+
+        group = section_group
+        buffer = []
+        buffer_size = 0
+
+        if len(text) <= budget:
+            buffer = [text]
+            buffer_size = len(text)
+            continue
+
+        # 超长章节：按句子切窗口
+        for piece in split_text(text, budget, chunk_overlap):
+            buffer = [piece]
+            yield flush()
+        buffer = []
+        buffer_size = 0
+
+    if buffer:
+        yield flush()
+
+
+def split_document(text, chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP):
+    """
+    切分整篇文档
+
+    参数:
+        text: 文档全文
+        chunk_size: 每块最大字数
+        chunk_overlap: 相邻块重叠字数
+
+    返回:
+        块列表 [{"content": "...", "section": "..."}]
+    """
+    return list(split_lines(text.splitlines(), chunk_size, chunk_overlap))
+
+
+# ===== 测试代码 =====
+if __name__ == "__main__":
+    import sys
+
+    path = sys.argv[1] if len(sys.argv) > 1 else "data/knowledge/小麦种植指南.txt"
+    with open(path, 'r', encoding='utf-8') as f:
+        chunks = split_document(f.read())
+
+    for i, chunk in enumerate(chunks, 1):
+        print(f"\n--- 块{i}（{len(chunk['content'])}字）【{chunk['section']}】")
+        print(chunk['content'])
+    print(f"\n共 {len(chunks)} 块")
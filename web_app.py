@@ -6,8 +6,11 @@ from flask import Flask, render_template, request, jsonify, session, redirect, u
 from flask_cors import CORS
 from knowledge_base import KnowledgeBase
 from rag_engine import RAGEngine
+from llm_scheduler import SchedulerBusy
 from chat_manager import ChatManager
-from database import db, DataRecord
+from database import db, DataRecord, create_indexes, stats_rollup
+from pagination import InvalidPageArgs, page_args, result_count, parse_date, keyset_page, offset_page
+from sqlalchemy.orm import joinedload
 import uuid
 from database import Crop  # 添加到文件顶部的导入
 
@@ -28,6 +31,16 @@ kb = KnowledgeBase()
 rag = RAGEngine(kb)
 chat_managers = {}
 
+def busy_response(error):
+    """大模型调度器饱和时的响应：503 + Retry-After"""
+    response = jsonify({
+        "success": False,
+        "error": str(error),
+        "retry_after": error.retry_after
+    })
+    response.headers["Retry-After"] = str(error.retry_after)
+    return response, 503
+
 def get_chat_manager():
     """获取当前用户的ChatManager"""
     if 'user_id' not in session:
@@ -102,6 +115,9 @@ def api_ask():
             "answer": answer
         })
         
+    except SchedulerBusy as busy:
+        return busy_response(busy)
+        
     except Exception as e:
         return jsonify({
             "success": False,
@@ -231,14 +247,44 @@ def api_delete_crop(crop_id):
 
 @app.route('/api/records', methods=['GET'])
 def api_get_records():
-    """获取所有记录"""
+    """
+    获取记录（按日期游标分页）
+    
+    参数（查询字符串，均可选）:
+        crop_db_id / crop_type / record_type: 筛选
+        date_from / date_to: 日期范围（YYYY-MM-DD，含两端）
+        limit / cursor / order: 分页，见 pagination.page_args
+    """
     try:
-        records = DataRecord.query.order_by(DataRecord.date.desc()).all()
+        limit, cursor, order = page_args(request.args)
+        date_from = parse_date(request.args.get('date_from'), 'date_from')
+        date_to = parse_date(request.args.get('date_to'), 'date_to')
+        
+        query = DataRecord.query.options(joinedload(DataRecord.crop))
+        crop_db_id = request.args.get('crop_db_id', type=int)
+        if crop_db_id:
+            query = query.filter(DataRecord.crop_db_id == crop_db_id)
+        if request.args.get('crop_type'):
+            crop_ids = db.session.query(Crop.id).filter(Crop.crop_type == request.args['crop_type'])
+            query = query.filter(DataRecord.crop_db_id.in_(crop_ids.scalar_subquery()))
+        if request.args.get('record_type'):
+            query = query.filter(DataRecord.record_type == request.args['record_type'])
+        # 日期存的是 YYYY-MM-DD 字符串，按字符串比较即可
+        if date_from:
+            query = query.filter(DataRecord.date >= date_from.isoformat())
+        if date_to:
+            query = query.filter(DataRecord.date <= date_to.isoformat())
+        
+        records, next_cursor = keyset_page(query, [DataRecord.date, DataRecord.id], limit, cursor, order)
         return jsonify({
             "success": True,
             "records": [r.to_dict() for r in records],
-            "total": len(records)
+            "count": len(records),
+            "has_more": next_cursor is not None,
+            "next_cursor": next_cursor
         })
+    except InvalidPageArgs as e:
+        return jsonify({"success": False, "error": str(e)}), 400
     except Exception as e:
         return jsonify({"success": False, "error": str(e)}), 500
 
@@ -312,8 +358,8 @@ def api_analysis_summary():
         crop_name = data.get('crop_name', None)
         days = data.get('days', 7)
         
-        # 获取记录
-        query = DataRecord.query
+        # 获取记录（作物一起查出来，生成文本时不再逐条查询）
+        query = DataRecord.query.options(joinedload(DataRecord.crop))
         if crop_name:
             query = query.filter_by(crop_name=crop_name)
         
@@ -353,8 +399,7 @@ def api_analysis_summary():
         
         # 调用AI生成分析
         chat = get_chat_manager()
-        response = rag.llm.invoke(analysis_prompt)
-        analysis_result = response.content
+        analysis_result = rag.invoke_shared(analysis_prompt, priority="batch")
         
         return jsonify({
             "success": True,
@@ -364,6 +409,9 @@ def api_analysis_summary():
             "analysis": analysis_result
         })
         
+    except SchedulerBusy as busy:
+        return busy_response(busy)
+        
     except Exception as e:
         return jsonify({
             "success": False,
@@ -382,7 +430,7 @@ def api_ask_about_records():
             return jsonify({"error": "问题不能为空"}), 400
         
         # 获取相关记录
-        query = DataRecord.query
+        query = DataRecord.query.options(joinedload(DataRecord.crop))
         if crop_name:
             query = query.filter_by(crop_name=crop_name)
         
@@ -413,8 +461,7 @@ def api_ask_about_records():
 请回答：
 """
             
-            response = rag.llm.invoke(prompt)
-            answer = response.content
+            answer = rag.invoke_shared(prompt, priority="interactive")
         
         return jsonify({
             "success": True,
@@ -423,6 +470,9 @@ def api_ask_about_records():
             "records_used": len(records) if records else 0
         })
         
+    except SchedulerBusy as busy:
+        return busy_response(busy)
+        
     except Exception as e:
         return jsonify({
             "success": False,
@@ -433,16 +483,22 @@ def api_ask_about_records():
 
 @app.route('/api/documents', methods=['GET'])
 def api_get_documents():
-    """获取文档列表"""
+    """获取文档列表（分页，可按 crop / topic / source 筛选）"""
     try:
-        limit = request.args.get('limit', 50, type=int)
-        docs = kb.list_documents(limit=limit)
+        limit, cursor, _ = page_args(request.args)
+        filters = {key: request.args[key] for key in ('crop', 'topic', 'source') if request.args.get(key)}
+        docs, next_cursor = offset_page(cursor, limit,
+                                        lambda offset, count: kb.list_documents(count, offset, filters))
         
         return jsonify({
             "success": True,
             "documents": docs,
-            "total": kb.collection.count()
+            "total": kb.count_documents(filters),
+            "has_more": next_cursor is not None,
+            "next_cursor": next_cursor
         })
+    except InvalidPageArgs as e:
+        return jsonify({"success": False, "error": str(e)}), 400
     except Exception as e:
         return jsonify({
             "success": False,
@@ -518,7 +574,7 @@ def api_search():
     try:
         data = request.json
         query = data.get('query', '').strip()
-        n_results = data.get('n_results', 20)
+        n_results = result_count(data, 20)
         
         if not query:
             return jsonify({
@@ -532,6 +588,11 @@ def api_search():
             "success": True,
             "results": results
         })
+    except InvalidPageArgs as e:
+        return jsonify({
+            "success": False,
+            "error": str(e)
+        }), 400
     except Exception as e:
         return jsonify({
             "success": False,
@@ -573,6 +634,8 @@ if __name__ == '__main__':
     # 创建数据库表
     with app.app_context():
         db.create_all()
+        create_indexes()
+        stats_rollup.rebuild_all(db.session, missing_only=True)
         print("✅ 数据库表已创建")
     
     # 加载示例数据